@@ -1,14 +1,22 @@
 import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from enum import IntEnum, unique
 import datetime
 import logging
 import logging.config
+import math
 import multiprocessing as mp
 import os
+import pickle
+import signal
+import subprocess
 import sys
+import tempfile
 import time
 import traceback
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 import unittest
 
 from osm2city import details, pylons, roads, buildings, parameters, trees
@@ -17,26 +25,55 @@ import osm2city.utils.aptdat_io as aio
 import osm2city.utils.btg_io as bio
 from osm2city.utils import calc_tile
 from osm2city.utils import coordinates
+from osm2city.utils import metrics
+from osm2city.utils import osmparser as op
+from osm2city.utils import profiling
 from osm2city.utils import stg_io2
+from osm2city.utils import tile_journal as tj
 from osm2city.utils import utilities as u
 
 
 class SceneryTile(object):
-    __slots__ = ('boundary_west', 'boundary_south', 'boundary_north', 'boundary_east', 'tile_index', 'prefix')
+    __slots__ = ('boundary_west', 'boundary_south', 'boundary_north', 'boundary_east', 'tile_index', 'prefix',
+                 'part', 'parts')
 
     def __init__(self, my_boundary_west: float, my_boundary_south: float,
                  my_boundary_east: float, my_boundary_north: float,
-                 my_tile_index: int, prefix: str) -> None:
+                 my_tile_index: int, prefix: str, part: int = 0, parts: int = 1) -> None:
         self.boundary_west = my_boundary_west
         self.boundary_south = my_boundary_south
         self.boundary_east = my_boundary_east
         self.boundary_north = my_boundary_north
         self.tile_index = my_tile_index
         self.prefix = prefix
+        self.part = part  # 0 if the tile is processed as a whole, otherwise 1 to parts
+        self.parts = parts
+
+    def split(self, divisions: int) -> List['SceneryTile']:
+        """Splits the tile into divisions x divisions parts, each processed with its own prefix, such that
+        the parts still write to the same stg-file(s) in separate sections."""
+        if divisions < 2:
+            return [self]
+        parts = list()
+        lon_step = (self.boundary_east - self.boundary_west) / divisions
+        lat_step = (self.boundary_north - self.boundary_south) / divisions
+        for lon_index in range(divisions):
+            for lat_index in range(divisions):
+                part = lon_index * divisions + lat_index + 1
+                west = self.boundary_west + lon_index * lon_step
+                south = self.boundary_south + lat_index * lat_step
+                # use the original boundary at the end to prevent gaps due to rounding
+                east = self.boundary_east if lon_index == divisions - 1 else west + lon_step
+                north = self.boundary_north if lat_index == divisions - 1 else south + lat_step
+                parts.append(SceneryTile(west, south, east, north, self.tile_index,
+                                         '{}_{}'.format(self.prefix, part), part, divisions * divisions))
+        return parts
 
     def __str__(self) -> str:
         my_string = "Tile index: " + str(self.tile_index)
         my_string += ", prefix: " + self.prefix
+        if self.part:
+            my_string += ", part {} of {}".format(self.part, self.parts)
         my_string += "; boundary west: " + str(self.boundary_west)
         my_string += " - south: " + str(self.boundary_south)
         my_string += " - east: " + str(self.boundary_east)
@@ -62,6 +99,112 @@ def _parse_exec_for_procedure(exec_argument: str) -> Procedures:
     return Procedures.__members__[exec_argument.lower()]
 
 
+def _estimate_tile_costs(scenery_tiles: List[SceneryTile], journal_file_name: str,
+                         run_procedure: str) -> Tuple[Dict[str, float], float]:
+    """Estimates the relative work per tile prefix: the durations of a previous run in the journal if available
+    for all tiles - otherwise the number of buildings and highways in the database. As a last resort the known
+    durations, where tiles without duration are assumed to be the most expensive ones.
+    Returns the costs and the threshold for splitting tiles applicable to the estimate (0 if tiles must not
+    be split)."""
+    durations = tj.read_tile_durations(journal_file_name, run_procedure)
+    if durations and all(tile.tile_index in durations for tile in scenery_tiles):
+        logging.info('Estimating the work per tile based on durations in the journal')
+        return ({tile.prefix: durations[tile.tile_index] for tile in scenery_tiles},
+                parameters.TILE_SPLIT_THRESHOLD_SECONDS)
+    try:
+        db_connection = op.make_db_connection()
+        try:
+            costs = dict()
+            for tile in scenery_tiles:
+                costs[tile.prefix] = op.count_db_ways(['building', 'highway'],
+                                                      tile.boundary_west, tile.boundary_south,
+                                                      tile.boundary_east, tile.boundary_north, db_connection)
+        finally:
+            db_connection.close()
+        logging.info('Estimating the work per tile based on the number of buildings and highways')
+        return costs, parameters.TILE_SPLIT_THRESHOLD_WAYS
+    except Exception as e:
+        logging.warning('Unable to count buildings and highways per tile in the database: %s', e)
+    return {tile.prefix: durations.get(tile.tile_index, float('inf')) for tile in scenery_tiles}, 0
+
+
+def _split_expensive_tiles(scenery_tiles: List[SceneryTile], costs: Dict[str, float],
+                           threshold: float) -> Tuple[List[SceneryTile], Dict[str, float]]:
+    """Splits tiles with costs above the threshold into parts (at most TILE_SPLIT_MAX_DIVISIONS squared), such
+    that a very dense tile can be processed by several processes. Returns the tiles and the costs incl. the parts,
+    where the cost of a tile is distributed evenly to its parts."""
+    if threshold <= 0 or parameters.TILE_SPLIT_MAX_DIVISIONS < 2:
+        return scenery_tiles, costs
+    split_tiles = list()
+    split_costs = dict()
+    for tile in scenery_tiles:
+        cost = costs.get(tile.prefix, 0.)
+        divisions = 1
+        if threshold < cost < float('inf'):
+            divisions = min(int(math.ceil(math.sqrt(cost / threshold))), parameters.TILE_SPLIT_MAX_DIVISIONS)
+        parts = tile.split(divisions)
+        if len(parts) > 1:
+            logging.info('Splitting tile %s into %i parts', tile.prefix, len(parts))
+        for part in parts:
+            split_tiles.append(part)
+            split_costs[part.prefix] = cost / len(parts)
+    return split_tiles, split_costs
+
+
+def _sort_tiles_by_cost(scenery_tiles: List[SceneryTile], costs: Dict[str, float]) -> List[SceneryTile]:
+    """Sorts the most expensive tiles first, such that no long running tile is started at the end
+    while other processes are idle. Tiles with the same cost keep their order."""
+    return sorted(scenery_tiles, key=lambda tile: costs.get(tile.prefix, 0.), reverse=True)
+
+
+class _MemoryAdmission(object):
+    """Decides which waiting tile can be started, such that the estimated memory of all running tiles stays within
+    the budget. The memory of a tile is estimated as a base (the smallest peak reported) plus its cost (cf.
+    _estimate_tile_costs) times the largest ratio of additional memory to cost reported by finished tiles.
+    Until the memory of a tile is reported, tiles are started as long as there are free processes."""
+    __slots__ = ('budget_mb', 'processes', '_base_mb', '_mb_per_cost', '_largest_mb', '_reports')
+
+    def __init__(self, budget_mb: Optional[float], processes: int) -> None:
+        self.budget_mb = budget_mb  # if None, then tiles are started as long as there are free processes
+        self.processes = processes
+        self._base_mb = None
+        self._mb_per_cost = 0.
+        self._largest_mb = None
+        self._reports = list()
+
+    def report(self, cost: float, peak_mb: Optional[float]) -> None:
+        """Adds the peak memory reported for a finished tile."""
+        if peak_mb is None:
+            return
+        if self._largest_mb is None or peak_mb > self._largest_mb:
+            self._largest_mb = peak_mb
+        if 0 < cost < float('inf'):
+            self._reports.append((cost, peak_mb))
+            self._base_mb = min(peak for _, peak in self._reports)
+            self._mb_per_cost = max((peak - self._base_mb) / cost for cost, peak in self._reports)
+
+    def estimate(self, cost: float) -> Optional[float]:
+        if self._largest_mb is None:
+            return None
+        if self._base_mb is None or not 0 < cost < float('inf'):
+            return self._largest_mb
+        return self._base_mb + self._mb_per_cost * cost
+
+    def select(self, waiting: List[SceneryTile], costs: Dict[str, float],
+               running: List[SceneryTile]) -> Optional[SceneryTile]:
+        """The first waiting tile, which fits into the budget besides the running tiles. If nothing is running,
+        then the first waiting tile is started anyway. None if no tile can be started now."""
+        if not waiting:
+            return None
+        if self.budget_mb is None or not running or self._largest_mb is None:
+            return waiting[0]
+        available = self.budget_mb - sum(self.estimate(costs.get(tile.prefix, 0.)) for tile in running)
+        for tile in waiting:
+            if self.estimate(costs.get(tile.prefix, 0.)) <= available:
+                return tile
+        return None
+
+
 class RuntimeFormatter(logging.Formatter):
     """A logging formatter which includes the delta time since start.
 
@@ -105,65 +248,210 @@ def pool_initializer(log_level: str, log_to_file: bool):
     configure_time_logging(log_level, log_to_file)
 
 
-def process_scenery_tile(scenery_tile: SceneryTile, params_file_name: str,
+class _TileInputs(object):
+    """The inputs of the procedures for a tile, which are read resp. created once per tile and then only read."""
+    __slots__ = ('airports', 'stg_entries_in_tile', 'stg_entries', 'lit_areas', 'water_areas', 'osm_buildings')
+
+    def __init__(self, airports: List[aio.Airport], stg_entries_in_tile: List[stg_io2.STGEntry],
+                 stg_entries: List[stg_io2.STGEntry]) -> None:
+        self.airports = airports
+        self.stg_entries_in_tile = stg_entries_in_tile
+        self.stg_entries = stg_entries
+        self.lit_areas = None
+        self.water_areas = None
+        self.osm_buildings = None
+
+
+# The procedures run for a tile after the land-use (owbb) and the procedures they depend on.
+# Procedures without dependencies between each other can run concurrently.
+_PROCEDURE_DEPENDENCIES = {Procedures.buildings: [Procedures.owbb],
+                           Procedures.roads: [Procedures.owbb],
+                           Procedures.pylons: [],
+                           Procedures.details: [Procedures.owbb],
+                           Procedures.trees: [Procedures.owbb]}
+
+
+def _procedures_to_run(exec_argument: Procedures, process_built_stuff: bool) -> List[Procedures]:
+    """The procedures to run after the land-use in the sequence used when not running concurrently."""
+    procedures = list()
+    if exec_argument in [Procedures.buildings, Procedures.main, Procedures.all] and process_built_stuff:
+        procedures.append(Procedures.buildings)
+    if exec_argument in [Procedures.roads, Procedures.main, Procedures.all] and process_built_stuff:
+        procedures.append(Procedures.roads)
+    if exec_argument in [Procedures.pylons, Procedures.main, Procedures.all] and process_built_stuff:
+        procedures.append(Procedures.pylons)
+    if exec_argument in [Procedures.details, Procedures.all]:
+        procedures.append(Procedures.details)
+    if exec_argument in [Procedures.trees, Procedures.all]:
+        procedures.append(Procedures.trees)
+    return procedures
+
+
+def _init_tile_parameters(scenery_tile: SceneryTile, params_snapshot: parameters.Snapshot) -> None:
+    parameters.apply_snapshot(params_snapshot)
+    # adapt boundary
+    parameters.set_boundary(scenery_tile.boundary_west, scenery_tile.boundary_south,
+                            scenery_tile.boundary_east, scenery_tile.boundary_north)
+    parameters.PREFIX = scenery_tile.prefix
+    parameters.TILE_PART = scenery_tile.part
+    parameters.TILE_PARTS = scenery_tile.parts
+
+
+@contextmanager
+def _procedure_context(procedure: Procedures, scenery_tile: SceneryTile, journal: tj.TileJournal) -> Iterator[None]:
+    """Records a procedure of a tile in the journal and the metrics - and profiles it if selected in the parameters."""
+    with journal.procedure(procedure.name), metrics.span('procedure.' + procedure.name), \
+            profiling.profile(scenery_tile.tile_index, scenery_tile.prefix, procedure.name):
+        yield
+
+
+def _run_procedure(procedure: Procedures, the_coords_transform: coordinates.Transformation,
+                   my_fg_elev: u.ElevationProvider, tile_inputs: _TileInputs, file_lock: mp.Lock) -> None:
+    if procedure is Procedures.buildings:
+        # cannot be read once for all outside of tiles in main function due to local coordinates
+        blocked_apt_areas = aio.get_apt_dat_blocked_areas_from_airports(the_coords_transform,
+                                                                        parameters.BOUNDARY_WEST,
+                                                                        parameters.BOUNDARY_SOUTH,
+                                                                        parameters.BOUNDARY_EAST,
+                                                                        parameters.BOUNDARY_NORTH,
+                                                                        tile_inputs.airports, True)
+        buildings.process_buildings(the_coords_transform, my_fg_elev, blocked_apt_areas, tile_inputs.stg_entries,
+                                    tile_inputs.osm_buildings, file_lock)
+    elif procedure is Procedures.roads:
+        blocked_apt_areas = aio.get_apt_dat_blocked_areas_from_airports(the_coords_transform,
+                                                                        parameters.BOUNDARY_WEST,
+                                                                        parameters.BOUNDARY_SOUTH,
+                                                                        parameters.BOUNDARY_EAST,
+                                                                        parameters.BOUNDARY_NORTH,
+                                                                        tile_inputs.airports, False)
+        blocked_apt_areas.extend(bio.get_blocked_areas_from_btg_airport_data(the_coords_transform,
+                                                                             tile_inputs.airports))
+        the_stg_entries = stg_io2.read_stg_entries_in_boundary(the_coords_transform, True,
+                                                               tile_inputs.stg_entries_in_tile)
+        roads.process_roads(the_coords_transform, my_fg_elev, blocked_apt_areas, tile_inputs.lit_areas,
+                            tile_inputs.water_areas, the_stg_entries, file_lock)
+    elif procedure is Procedures.pylons:
+        pylons.process_pylons(the_coords_transform, my_fg_elev, tile_inputs.stg_entries, file_lock)
+    elif procedure is Procedures.details:
+        details.process_details(the_coords_transform, tile_inputs.lit_areas, my_fg_elev, file_lock)
+    elif procedure is Procedures.trees:
+        trees.process_trees(the_coords_transform, my_fg_elev, tile_inputs.osm_buildings, file_lock)
+
+
+def _run_procedure_in_process(procedure: Procedures, scenery_tile: SceneryTile, params_snapshot: parameters.Snapshot,
+                              journal: tj.TileJournal, tile_inputs_file_name: str,
+                              file_lock: mp.Lock) -> Tuple[Dict[Tuple[float, float], Tuple[float, bool]],
+                                                           Dict[str, dict]]:
+    """Runs a procedure for a tile in a separate process. The tile inputs are read from a pickled file.
+    Returns the new elevation probes, such that only the main process of the tile writes the elevation cache,
+    plus the metrics collected."""
+    metrics.reset()
+    _init_tile_parameters(scenery_tile, params_snapshot)
+    with open(tile_inputs_file_name, 'rb') as file_pickle:
+        tile_inputs = pickle.load(file_pickle)
+    the_coords_transform = coordinates.Transformation(parameters.get_center_global())
+    my_fg_elev = u.create_elevation_provider(the_coords_transform, scenery_tile.tile_index, auto_save_every=0)
+    try:
+        with _procedure_context(procedure, scenery_tile, journal):
+            _run_procedure(procedure, the_coords_transform, my_fg_elev, tile_inputs, file_lock)
+        return my_fg_elev.cache_additions(), metrics.collect()
+    finally:
+        my_fg_elev.close(save_cache=False)
+
+
+def _run_procedures_concurrently(procedures: List[Procedures], scenery_tile: SceneryTile,
+                                 params_snapshot: parameters.Snapshot, journal: tj.TileJournal,
+                                 tile_inputs: _TileInputs, my_fg_elev: u.ElevationProvider, max_processes: int,
+                                 file_lock: mp.Lock) -> None:
+    """Runs the procedures in separate processes as soon as the procedures they depend on are done.
+    The tile inputs are pickled once to a file read by all processes. The file_lock must be shared between
+    processes (e.g. from a Manager) if locking per stg-file is not available."""
+    with tempfile.NamedTemporaryFile(suffix='_tile_inputs.pkl', delete=False) as file_pickle:
+        pickle.dump(tile_inputs, file_pickle, pickle.HIGHEST_PROTOCOL)
+    done = {Procedures.owbb}
+    waiting = list(procedures)
+    running = dict()  # key: future, value: procedure
+    first_exception = None
+    try:
+        log_level = logging.getLevelName(logging.getLogger().level)
+        with ProcessPoolExecutor(max_workers=max_processes, mp_context=mp.get_context('spawn'),
+                                 initializer=pool_initializer, initargs=(log_level, False)) as executor:
+            while waiting or running:
+                for procedure in [p for p in waiting if set(_PROCEDURE_DEPENDENCIES[p]) <= done]:
+                    waiting.remove(procedure)
+                    future = executor.submit(_run_procedure_in_process, procedure, scenery_tile, params_snapshot,
+                                             journal, file_pickle.name, file_lock)
+                    running[future] = procedure
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done.add(running.pop(future))
+                    if future.exception() is not None:
+                        if first_exception is None:
+                            first_exception = future.exception()
+                        waiting.clear()  # let the running procedures finish, but do not start new ones
+                    else:
+                        cache_additions, procedure_metrics = future.result()
+                        my_fg_elev.update_cache(cache_additions)
+                        metrics.merge(procedure_metrics)
+    finally:
+        os.remove(file_pickle.name)
+    if first_exception is not None:
+        raise first_exception
+
+
+def process_scenery_tile(scenery_tile: SceneryTile, params_snapshot: parameters.Snapshot,
                          exec_argument: Procedures, my_airports: List[aio.Airport],
-                         file_lock: mp.Lock, my_progress: str) -> None:
+                         file_lock: mp.Lock, my_progress: str,
+                         journal_file_name: str = None, concurrent_procedures: int = 0,
+                         metrics_file_name: str = None) -> Optional[float]:
+    """Processes the procedures of a tile. Returns the peak resident memory in MB of the process after a procedure,
+    such that the memory used by tiles can be estimated (None if unknown)."""
     my_fg_elev = None
+    journal = tj.TileJournal(journal_file_name, scenery_tile.tile_index, scenery_tile.prefix, exec_argument.name,
+                             scenery_tile.parts)
+    journal.start()
+    metrics.reset()
+    tile_start_time = time.time()
+    tile_status = tj.TileStatus.failed
     try:
-        parameters.read_from_file(params_file_name)
-        # adapt boundary
-        parameters.set_boundary(scenery_tile.boundary_west, scenery_tile.boundary_south,
-                                scenery_tile.boundary_east, scenery_tile.boundary_north)
-        parameters.PREFIX = scenery_tile.prefix
+        _init_tile_parameters(scenery_tile, params_snapshot)
         logging.info("Processing tile {} in prefix {} with process id = {} - {}".format(scenery_tile.tile_index,
                                                                                         parameters.PREFIX,
                                                                                         os.getpid(), my_progress))
 
         the_coords_transform = coordinates.Transformation(parameters.get_center_global())
 
-        my_fg_elev = u.FGElev(the_coords_transform, scenery_tile.tile_index)
-        my_stg_entries = stg_io2.read_stg_entries_in_boundary(the_coords_transform, False)
+        my_fg_elev = u.create_elevation_provider(the_coords_transform, scenery_tile.tile_index)
+        # read once per tile and then apply the exclude areas of buildings resp. roads
+        my_stg_entries_in_tile = stg_io2.read_stg_entries_in_tile(the_coords_transform)
+        my_stg_entries = stg_io2.read_stg_entries_in_boundary(the_coords_transform, False, my_stg_entries_in_tile)
+        tile_inputs = _TileInputs(my_airports, my_stg_entries_in_tile, my_stg_entries)
 
         # run programs
-        if (exec_argument is Procedures.details and parameters.C2P_PROCESS_STREETLAMPS is False) or (
-            exec_argument is Procedures.pylons):
-            lit_areas = None
-            water_areas = None
-            osm_buildings = None
-        else:
-            lit_areas, water_areas, osm_buildings = ol.process(the_coords_transform, my_airports)
+        if not ((exec_argument is Procedures.details and parameters.C2P_PROCESS_STREETLAMPS is False) or (
+                exec_argument is Procedures.pylons)):
+            with _procedure_context(Procedures.owbb, scenery_tile, journal):
+                tile_inputs.lit_areas, tile_inputs.water_areas, tile_inputs.osm_buildings = ol.process(
+                    the_coords_transform, my_airports)
         process_built_stuff = True  # only relevant for buildings.py and roads.py. E.g. pylons.py can still run
-        if lit_areas is None and water_areas is None and osm_buildings is None:
+        if tile_inputs.lit_areas is None and tile_inputs.water_areas is None and tile_inputs.osm_buildings is None:
             process_built_stuff = False
-        if exec_argument in [Procedures.buildings, Procedures.main, Procedures.all] and process_built_stuff:
-            # cannot be read once for all outside of tiles in main function due to local coordinates
-            blocked_apt_areas = aio.get_apt_dat_blocked_areas_from_airports(the_coords_transform,
-                                                                            parameters.BOUNDARY_WEST,
-                                                                            parameters.BOUNDARY_SOUTH,
-                                                                            parameters.BOUNDARY_EAST,
-                                                                            parameters.BOUNDARY_NORTH,
-                                                                            my_airports, True)
-            buildings.process_buildings(the_coords_transform, my_fg_elev, blocked_apt_areas, my_stg_entries,
-                                        osm_buildings, file_lock)
-        if exec_argument in [Procedures.roads, Procedures.main, Procedures.all] and process_built_stuff:
-            blocked_apt_areas = aio.get_apt_dat_blocked_areas_from_airports(the_coords_transform,
-                                                                            parameters.BOUNDARY_WEST,
-                                                                            parameters.BOUNDARY_SOUTH,
-                                                                            parameters.BOUNDARY_EAST,
-                                                                            parameters.BOUNDARY_NORTH,
-                                                                            my_airports, False)
-            blocked_apt_areas.extend(bio.get_blocked_areas_from_btg_airport_data(the_coords_transform, my_airports))
-            the_stg_entries = stg_io2.read_stg_entries_in_boundary(the_coords_transform, True)
-            roads.process_roads(the_coords_transform, my_fg_elev, blocked_apt_areas, lit_areas, water_areas,
-                                the_stg_entries, file_lock)
-        if exec_argument in [Procedures.pylons, Procedures.main, Procedures.all] and process_built_stuff:
-            pylons.process_pylons(the_coords_transform, my_fg_elev, my_stg_entries, file_lock)
-        if exec_argument in [Procedures.details, Procedures.all]:
-            details.process_details(the_coords_transform, lit_areas, my_fg_elev, file_lock)
-        if exec_argument in [Procedures.trees, Procedures.all]:
-            trees.process_trees(the_coords_transform, my_fg_elev, osm_buildings, file_lock)
+        procedures = _procedures_to_run(exec_argument, process_built_stuff)
+
+        if concurrent_procedures > 1 and len(procedures) > 1 and mp.current_process().daemon:
+            logging.info('Running procedures one by one, because already running in a pool of processes')
+        elif concurrent_procedures > 1 and len(procedures) > 1:
+            _run_procedures_concurrently(procedures, scenery_tile, params_snapshot, journal, tile_inputs,
+                                         my_fg_elev, concurrent_procedures, file_lock)
+            procedures = list()
+        for procedure in procedures:
+            with _procedure_context(procedure, scenery_tile, journal):
+                _run_procedure(procedure, the_coords_transform, my_fg_elev, tile_inputs, file_lock)
+        tile_status = tj.TileStatus.ok
+        journal.finish(tile_status)
 
     except:
+        journal.finish(tj.TileStatus.failed)
         logging.exception('Exception occurred while processing tile {}.'.format(scenery_tile.tile_index))
         msg = "******* Exception in tile {} - to reprocess use boundaries: {}_{}_{}_{} *******".format(
             scenery_tile.tile_index, scenery_tile.boundary_west, scenery_tile.boundary_south,
@@ -181,8 +469,166 @@ def process_scenery_tile(scenery_tile: SceneryTile, params_file_name: str,
         # clean-up
         if my_fg_elev:
             my_fg_elev.close()
+        metrics.write_tile_metrics(metrics_file_name, scenery_tile.tile_index, scenery_tile.prefix,
+                                   exec_argument.name, tile_status.name, time.time() - tile_start_time)
 
     logging.info("******* Finished tile {} - {} *******".format(scenery_tile.tile_index, my_progress))
+    return journal.peak_rss_mb
+
+
+# Modules imported once by the forkserver process, such that workers forked from it start without importing them
+_FORKSERVER_PRELOAD_MODULES = ['numpy', 'scipy.interpolate', 'shapely.geometry', 'shapely.ops', 'pyproj', 'psycopg2',
+                               'osm2city.buildings', 'osm2city.roads', 'osm2city.pylons', 'osm2city.details',
+                               'osm2city.trees', 'osm2city.owbb.landuse', 'osm2city.prepare_textures', '__main__']
+
+
+def _set_start_method(start_method: str) -> None:
+    """Both spawn and forkserver make sure that e.g. the parameters module is initialized separately per worker.
+    With forkserver the heavy modules are only imported once, such that starting a worker is much faster
+    (e.g. when using -m). Modules which cannot be imported are just skipped by the forkserver."""
+    if start_method == 'forkserver':
+        mp.set_forkserver_preload(_FORKSERVER_PRELOAD_MODULES)
+    mp.set_start_method(start_method)
+
+
+# Parameters changed when a tile is processed again after exceeding the time limit: e.g. no straight skeleton roofs
+_TIMEOUT_RETRY_PARAMETERS = dict(BUILDING_COMPLEX_ROOFS=False)
+
+
+def _worker_initializer(log_level: str, log_to_file: bool) -> None:
+    pool_initializer(log_level, log_to_file)
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()  # such that the worker can be killed together with its fgelev process
+
+
+def _kill_worker(pid: int) -> None:
+    """Kills a worker process incl. the processes it has started (e.g. fgelev) - the latter only if process groups
+    are available (i.e. not on Windows)."""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(pid, signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGTERM)
+    except OSError as e:
+        logging.warning('Unable to kill worker process %i: %s', pid, e)
+
+
+class _Worker(object):
+    """An executor with one process, such that the worker can be replaced (e.g. when using too much memory) or
+    killed (e.g. when hanging) without affecting the other workers."""
+    __slots__ = ('executor', 'pid_future', 'tasks')
+
+    def __init__(self, log_level: str, log_to_file: bool) -> None:
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context(),
+                                            initializer=_worker_initializer, initargs=(log_level, log_to_file))
+        self.pid_future = self.executor.submit(os.getpid)  # done before the first tile is started
+        self.tasks = 0
+
+    def kill(self) -> None:
+        if self.pid_future.done() and self.pid_future.exception() is None:
+            _kill_worker(self.pid_future.result())
+        self.executor.shutdown(wait=False)
+
+
+def _process_tiles_in_workers(scenery_tiles: List[SceneryTile], tile_costs: Dict[str, float],
+                              admission: _MemoryAdmission, memory_cap_mb: Optional[float],
+                              max_tasks_per_child: Optional[int], tile_timeout: Optional[float],
+                              retry_timed_out: bool, log_level: str, log_to_file: bool,
+                              params_snapshot: parameters.Snapshot, exec_argument: Procedures,
+                              my_airports: List[aio.Airport], file_lock: mp.Lock, journal_file_name: str,
+                              metrics_file_name: str) -> int:
+    """Processes the tiles (sorted by cost) in up to admission.processes workers, but only starts a tile if the
+    admission allows it given the tiles running. A worker with more resident memory than the cap after a tile
+    (or after max_tasks_per_child tiles) is replaced. A worker still processing a tile after tile_timeout seconds
+    is killed and the tile is journaled as timed out - and processed again once with _TIMEOUT_RETRY_PARAMETERS
+    if retry_timed_out. Returns the number of tiles processed.
+    Contrary to the processes of a Pool the workers are not daemonic, so they are explicitly told not to start
+    processes of their own for generating buildings."""
+    params_snapshot = params_snapshot.replace(OWBB_GENERATE_BUILDINGS_PROCESSES=1)
+    waiting = [(tile, params_snapshot) for tile in scenery_tiles]
+    total = len(waiting)
+    retried = set()  # the prefixes of tiles re-queued after timing out
+    workers = [None] * admission.processes  # per slot a _Worker - or None if not started
+    running = dict()  # key: future, value: (slot, tile, journal, deadline)
+    processed = 0
+    admission_blocked = False  # for logging only when the admission starts blocking
+    try:
+        while waiting or running:
+            free_slots = [slot for slot in range(admission.processes)
+                          if slot not in [values[0] for values in running.values()]]
+            for slot in free_slots:
+                tile = admission.select([tile for tile, _ in waiting], tile_costs,
+                                        [values[1] for values in running.values()])
+                if tile is None:
+                    break
+                index = [waiting_tile for waiting_tile, _ in waiting].index(tile)
+                tile_snapshot = waiting.pop(index)[1]
+                if workers[slot] is None:
+                    workers[slot] = _Worker(log_level, log_to_file)
+                progress_str = '{}/{}'.format(processed + len(running) + 1, total)
+                future = workers[slot].executor.submit(process_scenery_tile, tile, tile_snapshot, exec_argument,
+                                                       my_airports, file_lock, progress_str, journal_file_name, 0,
+                                                       metrics_file_name)
+                journal = tj.TileJournal(journal_file_name, tile.tile_index, tile.prefix, exec_argument.name,
+                                         tile.parts)
+                deadline = time.time() + tile_timeout if tile_timeout else None
+                running[future] = (slot, tile, journal, deadline)
+            if waiting and len(running) < admission.processes:
+                if not admission_blocked:
+                    logging.info('Waiting with %i tiles to stay within the memory budget of %i MB', len(waiting),
+                                 admission.budget_mb)
+                admission_blocked = True
+            else:
+                admission_blocked = False
+
+            deadlines = [values[3] for values in running.values() if values[3] is not None]
+            timeout = max(0., min(deadlines) - time.time()) if deadlines else None
+            finished, _ = wait(running.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in finished:
+                slot, tile, _, _ = running.pop(future)
+                processed += 1
+                workers[slot].tasks += 1
+                peak_mb = None
+                replace = False
+                if future.exception() is not None:
+                    logging.error('Worker process failed for tile %s: %s', tile.prefix, future.exception())
+                    replace = True
+                else:
+                    peak_mb = future.result()
+                admission.report(tile_costs.get(tile.prefix, 0.), peak_mb)
+                if memory_cap_mb is not None and peak_mb is not None and peak_mb > memory_cap_mb:
+                    logging.info('Replacing worker process using %i MB after tile %s (cap %i MB)', peak_mb,
+                                 tile.prefix, memory_cap_mb)
+                    replace = True
+                if max_tasks_per_child and workers[slot].tasks >= max_tasks_per_child:
+                    replace = True
+                if replace:
+                    workers[slot].executor.shutdown()
+                    workers[slot] = None
+
+            now = time.time()
+            for future in [f for f, values in running.items() if values[3] is not None and values[3] <= now]:
+                slot, tile, journal, _ = running.pop(future)
+                logging.error('Killing worker process for tile %s after %i seconds', tile.prefix, tile_timeout)
+                workers[slot].kill()
+                workers[slot] = None
+                journal.finish(tj.TileStatus.timed_out)
+                if retry_timed_out and tile.prefix not in retried:
+                    retried.add(tile.prefix)
+                    waiting.append((tile, params_snapshot.replace(**_TIMEOUT_RETRY_PARAMETERS)))
+                    total += 1
+                    logging.info('Processing tile %s again at the end with reduced options', tile.prefix)
+                else:
+                    processed += 1
+    finally:
+        for worker in workers:
+            if worker is None:
+                continue
+            if running:  # e.g. interrupted - the workers must not keep processing tiles
+                worker.kill()
+            else:
+                worker.executor.shutdown()
+    return processed
 
 
 counter = 0
@@ -216,6 +662,39 @@ if __name__ == '__main__':
                         required=False)
     parser.add_argument('-o', '--logtofile', dest='log_to_file', action='store_true',
                         help='Write the logging output to files in addition to stderr')
+    parser.add_argument('-u', '--skip-unchanged', dest='skip_unchanged', action='store_true',
+                        help='Do not rewrite output files with unchanged content (cf. WRITE_SKIP_UNCHANGED)')
+    parser.add_argument('-j', '--journal', dest='journal', default=tj.JOURNAL_FILE_NAME, metavar='FILE',
+                        help='Record start, finish and status of tiles and procedures in the journal FILE ' +
+                             '(default: {})'.format(tj.JOURNAL_FILE_NAME))
+    parser.add_argument('-c', '--concurrent-procedures', dest='concurrent_procedures', type=int, default=0,
+                        metavar='NUMBER',
+                        help='Run the procedures of a tile (e.g. buildings and roads) concurrently in up to NUMBER ' +
+                             'processes. Only used if -p is 1')
+    parser.add_argument('-s', '--start-method', dest='start_method', default='spawn',
+                        choices=[m for m in ['spawn', 'forkserver'] if m in mp.get_all_start_methods()],
+                        help='How worker processes are started if -p is larger than 1 (default: spawn). ' +
+                             'forkserver starts workers faster by importing modules only once')
+    parser.add_argument('--metrics', dest='metrics', default=metrics.METRICS_FILE_NAME, metavar='FILE',
+                        help='Append the timing spans and counters per tile to FILE and log a summary at the end ' +
+                             '(default: {})'.format(metrics.METRICS_FILE_NAME))
+    parser.add_argument('--memory-budget', dest='memory_budget', type=float, metavar='MB',
+                        help='Only start a tile if the estimated resident memory of all running tiles stays ' +
+                             'within MB. Only used if -p is larger than 1')
+    parser.add_argument('--memory-cap', dest='memory_cap', type=float, metavar='MB',
+                        help='Replace a worker process using more than MB resident memory after a tile. ' +
+                             'Only used if -p is larger than 1')
+    parser.add_argument('-t', '--tile-timeout', dest='tile_timeout', type=float, metavar='SECONDS',
+                        help='Kill the worker process of a tile not finished after SECONDS and continue with the ' +
+                             'other tiles. Only used if -p is larger than 1')
+    parser.add_argument('--retry-timed-out', dest='retry_timed_out', action='store_true',
+                        help='Process a tile killed after --tile-timeout once more at the end with reduced options ' +
+                             '(no complex roofs)')
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument('-r', '--resume', dest='resume', action='store_true',
+                              help='Skip tiles, which according to the journal were completed with the same -e')
+    resume_group.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                              help='Only process tiles, which according to the journal failed or never finished')
 
     args = parser.parse_args()
 
@@ -226,6 +705,8 @@ if __name__ == '__main__':
     configure_time_logging(my_log_level, args.log_to_file)
 
     parameters.read_from_file(args.filename)
+    if args.skip_unchanged:
+        parameters.WRITE_SKIP_UNCHANGED = True
 
     exec_procedure = Procedures.all
     if args.exec:
@@ -288,43 +769,82 @@ if __name__ == '__main__':
                     scenery_tiles_list.append(a_scenery_tile)
                     logging.info("Added new scenery tile: {}".format(a_scenery_tile))
 
+    tile_costs = dict()
+    if args.processes > 1:
+        tile_costs, split_threshold = _estimate_tile_costs(scenery_tiles_list, args.journal, exec_procedure.name)
+        scenery_tiles_list, tile_costs = _split_expensive_tiles(scenery_tiles_list, tile_costs, split_threshold)
+
+    if args.resume or args.retry_failed:
+        tile_states = tj.read_tile_states(args.journal, exec_procedure.name)
+        selected_prefixes = set(tj.select_prefixes([tile.prefix for tile in scenery_tiles_list], tile_states,
+                                                   args.retry_failed))
+        logging.info('Processing %i of %i tiles based on the journal %s', len(selected_prefixes),
+                     len(scenery_tiles_list), args.journal)
+        scenery_tiles_list = [tile for tile in scenery_tiles_list if tile.prefix in selected_prefixes]
+
     # get airports from apt_dat. Transformation to blocked areas can only be done in sub-process due to local
     # coordinate system
     airports = aio.read_apt_dat_gz_file(boundary_west, boundary_south,
                                         boundary_east, boundary_north)
 
+    # the parameters file is read and validated only once - the workers just apply the snapshot per tile
+    params_snapshot = parameters.take_snapshot()
+
+    # e.g. left behind by a worker killed by the watchdog while writing an stg-file
+    stg_io2.remove_temporary_files(parameters.get_output_path())
+
     start_time = time.time()
     progress = 1
     total = len(scenery_tiles_list)
     if args.processes > 1:
-        mp.set_start_method('spawn')  # use safe approach to make sure e.g. parameters module is initialized separately
+        _set_start_method(args.start_method)
         # max tasks per child: see https://docs.python.org/3.5/library/multiprocessing.html#module-multiprocessing.pool
         max_tasks_per_child = None  # the default, meaning a worker processes will live as long as the pool
         if args.max_tasks:
             max_tasks_per_child = args.max_tasks
-        pool = mp.Pool(processes=args.processes, maxtasksperchild=max_tasks_per_child,
-                       initializer=pool_initializer, initargs=(my_log_level, args.log_to_file))
-        the_file_lock = mp.Manager().Lock()  # must be after "set_start_method"
-        with pool:
-            for my_scenery_tile in scenery_tiles_list:
-                progress_str = '{}/{}'.format(progress, total)
-                pool.apply_async(process_scenery_tile, (my_scenery_tile, args.filename,
-                                                        exec_procedure, airports, the_file_lock, progress_str),
-                                 callback=counter_callback())
-                progress += 1
-            pool.close()
-            pool.join()
+        # largest first, such that the processes finish at about the same time
+        scenery_tiles_list = _sort_tiles_by_cost(scenery_tiles_list, tile_costs)
+        the_file_lock = None  # stg-files are locked one by one instead of through a Manager process
+        if not stg_io2.LOCKING_PER_STG_FILE:
+            the_file_lock = mp.Manager().Lock()  # must be after "set_start_method"
+        if args.memory_budget or args.memory_cap or args.tile_timeout:
+            counter = _process_tiles_in_workers(scenery_tiles_list, tile_costs,
+                                                _MemoryAdmission(args.memory_budget, args.processes),
+                                                args.memory_cap, max_tasks_per_child, args.tile_timeout,
+                                                args.retry_timed_out, my_log_level, args.log_to_file,
+                                                params_snapshot, exec_procedure, airports, the_file_lock,
+                                                args.journal, args.metrics)
+        else:
+            pool = mp.Pool(processes=args.processes, maxtasksperchild=max_tasks_per_child,
+                           initializer=pool_initializer, initargs=(my_log_level, args.log_to_file))
+            with pool:
+                for my_scenery_tile in scenery_tiles_list:
+                    progress_str = '{}/{}'.format(progress, total)
+                    pool.apply_async(process_scenery_tile, (my_scenery_tile, params_snapshot,
+                                                            exec_procedure, airports, the_file_lock, progress_str,
+                                                            args.journal, 0, args.metrics),
+                                     callback=counter_callback())
+                    progress += 1
+                pool.close()
+                pool.join()
 
     else:  # do it linearly, which is easier to debug and profile
-        the_file_lock = mp.Manager().Lock()
+        the_file_lock = None  # only one process, so no locking needed - unless running procedures concurrently
+        if args.concurrent_procedures > 1 and not stg_io2.LOCKING_PER_STG_FILE:
+            the_file_lock = mp.Manager().Lock()
         for my_scenery_tile in scenery_tiles_list:
             progress_str = '{}/{}'.format(progress, total)
-            process_scenery_tile(my_scenery_tile, args.filename,
-                                 exec_procedure, airports, the_file_lock, progress_str)
+            process_scenery_tile(my_scenery_tile, params_snapshot,
+                                 exec_procedure, airports, the_file_lock, progress_str,
+                                 args.journal, args.concurrent_procedures, args.metrics)
             progress += 1
 
+    if parameters.STG_WRITE_FRAGMENTS:
+        stg_io2.merge_stg_fragments(parameters.get_output_path())
+
     u.time_logging("Total time used", start_time)
     logging.info('Processed %i tiles', counter)
+    metrics.log_summary(metrics.summarize(metrics.read_tile_metrics(args.metrics, start_time)))
 
 
 # ================ UNITTESTS =======================
@@ -334,3 +854,75 @@ class TestProcedures(unittest.TestCase):
     def test_middle_angle(self):
         self.assertTrue(_parse_exec_for_procedure('PyloNs') is Procedures.pylons)
         self.assertRaises(KeyError, _parse_exec_for_procedure, 'Hello')
+
+    def test_procedures_to_run(self):
+        self.assertEqual([Procedures.buildings, Procedures.roads, Procedures.pylons, Procedures.details,
+                          Procedures.trees], _procedures_to_run(Procedures.all, True))
+        self.assertEqual([Procedures.details, Procedures.trees], _procedures_to_run(Procedures.all, False))
+        self.assertEqual([Procedures.roads], _procedures_to_run(Procedures.roads, True))
+        for procedure in _procedures_to_run(Procedures.all, True):
+            self.assertTrue(procedure in _PROCEDURE_DEPENDENCIES)
+
+
+class TestSceneryTiles(unittest.TestCase):
+    def test_sort_tiles_by_cost(self):
+        tiles = [SceneryTile(0., 0., 1., 1., index, 'p_%i' % index) for index in range(5)]
+        sorted_tiles = _sort_tiles_by_cost(tiles, {'p_0': 10., 'p_1': 300., 'p_2': float('inf'), 'p_3': 10.})
+        self.assertEqual([2, 1, 0, 3, 4], [tile.tile_index for tile in sorted_tiles])
+
+    def test_split_expensive_tiles(self):
+        tiles = [SceneryTile(11., 47., 11.25, 47.125, 1, 'p_1'), SceneryTile(11., 47.125, 11.25, 47.25, 2, 'p_2'),
+                 SceneryTile(11., 47.25, 11.25, 47.375, 3, 'p_3')]
+        split_tiles, costs = _split_expensive_tiles(tiles, {'p_1': 50., 'p_2': 250., 'p_3': float('inf')}, 100.)
+        self.assertEqual(['p_1', 'p_2_1', 'p_2_2', 'p_2_3', 'p_2_4', 'p_3'], [tile.prefix for tile in split_tiles])
+        self.assertEqual(62.5, costs['p_2_3'])
+        self.assertEqual((11.125, 47.125, 11.25, 47.1875), (split_tiles[3].boundary_west,
+                                                             split_tiles[3].boundary_south,
+                                                             split_tiles[3].boundary_east,
+                                                             split_tiles[3].boundary_north))
+        self.assertEqual(4, split_tiles[3].parts)
+        self.assertEqual(tiles, _split_expensive_tiles(tiles, {'p_2': 250.}, 0)[0])
+
+
+class TestMemoryAdmission(unittest.TestCase):
+    def test_select(self):
+        tiles = [SceneryTile(0., 0., 1., 1., index, 'p_%i' % index) for index in range(4)]
+        costs = {'p_0': 100., 'p_1': 50., 'p_2': 10., 'p_3': float('inf')}
+        admission = _MemoryAdmission(1000., 4)
+        self.assertIsNone(admission.estimate(100.))
+        self.assertEqual(tiles[0], admission.select(tiles[:3], costs, [tiles[3]] * 3))
+
+        admission.report(10., 200.)
+        admission.report(50., 400.)
+        self.assertEqual(600., admission.estimate(100.))
+        self.assertEqual(400., admission.estimate(float('inf')))  # the largest peak reported
+        self.assertEqual(tiles[0], admission.select(tiles[:3], costs, [tiles[2]]))  # 240 + 600
+        self.assertEqual(tiles[2], admission.select(tiles[:3], costs, [tiles[1], tiles[2]]))  # 400 + 240 + 240
+        self.assertIsNone(admission.select(tiles[:3], costs, [tiles[1], tiles[3]]))
+        self.assertEqual(tiles[0], admission.select(tiles[:3], costs, []))  # too expensive, but nothing running
+        self.assertEqual(tiles[0], _MemoryAdmission(None, 4).select(tiles[:3], costs, tiles))
+
+
+class TestWorkers(unittest.TestCase):
+    def test_kill(self):
+        worker = _Worker('WARNING', False)
+        future = worker.executor.submit(time.sleep, 60)
+        self.assertNotEqual(os.getpid(), worker.pid_future.result(timeout=60))
+        worker.kill()
+        with self.assertRaises(BrokenProcessPool):
+            future.result(timeout=60)
+
+
+class TestImports(unittest.TestCase):
+    def test_no_plotting_modules_imported(self):
+        """Plotting and debug-only modules must only be imported when actually used - otherwise every (spawned)
+        worker process pays for importing them."""
+        lazy_modules = ['matplotlib', 'matplotlib.pyplot', 'descartes', 'osm2city.owbb.plotting',
+                        'osm2city.utils.plot_utilities']
+        code = ('import sys, time; start = time.time(); import build_tiles; '
+                'print(round(time.time() - start, 2)); print(" ".join(m for m in %r if m in sys.modules))'
+                % lazy_modules)
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        logging.info('Import of build_tiles took %s seconds', output[0])
+        self.assertEqual('', output[1] if len(output) > 1 else '')
@@ -0,0 +1,6 @@
+"""Offline benchmarks of the processing stages (land-use, buildings, roads, pylons, trees) on synthetic data.
+
+Neither a database, fgelev, TerraSync scenery nor osm2city-data is needed: the OSM data, the BTG land-use and the
+textures are generated in module fixtures.py - and the elevation is computed (utilities.AnalyticElevation).
+Module suite.py times the stages and writes the results as JSON, such that they can be compared with a previous run.
+"""
@@ -0,0 +1,299 @@
+"""
+Synthetic input data for the offline benchmarks in suite.py - all generated deterministically:
+
+* OSM data for a town laid out as a grid of streets: blocks of land-use with buildings, a park with trees, a railway,
+  tree rows and power lines. It is served by an osmparser.InMemoryDataSource instead of the database.
+* A BTG file with the land-use materials around the town (incl. a lake) in a scenery directory.
+* Plain textures for facades and roofs instead of the ones in osm2city-data.
+"""
+import gzip
+import math
+import os
+import struct
+import time
+from typing import Dict, List, Tuple
+import unittest
+
+from PIL import Image
+import pyproj
+
+from osm2city import parameters, prepare_textures
+from osm2city.static_types import osmstrings as s
+from osm2city.utils import btg_io, calc_tile, coordinates as co, osmparser as op, stg_io2, utilities
+
+
+# The middle of scenery tile 3138112 (e011n47) - the boundary of the benchmark is within this tile
+CENTER_LON = 11.125
+CENTER_LAT = 47.0625
+
+BLOCK_SIZE = 120.  # the distance between streets in the grid in metres
+BUILDING_SPACING = 24.  # the distance between buildings along a street in metres
+BTG_CELL_SIZE = 500.  # the size of the square cells of land-use in the BTG file in metres
+
+
+class _TownBuilder(object):
+    """Creates the OSM elements of the synthetic town in local coordinates."""
+    def __init__(self, transformer: co.Transformation) -> None:
+        self.transformer = transformer
+        self.nodes_dict = dict()
+        self.ways_dict = dict()
+        self._next_id = 1
+
+    def _new_id(self) -> int:
+        osm_id = self._next_id
+        self._next_id += 1
+        return osm_id
+
+    def add_node(self, x: float, y: float, tags: Dict[str, str] = None) -> int:
+        lon, lat = self.transformer.to_global((x, y))
+        node = op.Node(self._new_id(), lat, lon)
+        if tags:
+            node.tags = tags
+        self.nodes_dict[node.osm_id] = node
+        return node.osm_id
+
+    def add_way(self, refs: List[int], tags: Dict[str, str]) -> int:
+        way = op.Way(self._new_id())
+        way.refs = refs
+        way.tags = tags
+        self.ways_dict[way.osm_id] = way
+        return way.osm_id
+
+    def add_line(self, points: List[Tuple[float, float]], tags: Dict[str, str],
+                 node_tags: Dict[str, str] = None) -> int:
+        return self.add_way([self.add_node(x, y, dict(node_tags) if node_tags else None) for x, y in points], tags)
+
+    def add_area(self, min_x: float, min_y: float, max_x: float, max_y: float, tags: Dict[str, str]) -> int:
+        refs = [self.add_node(x, y) for x, y in [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]]
+        refs.append(refs[0])
+        return self.add_way(refs, tags)
+
+
+def _building_tags(block_type: str, index: int) -> Dict[str, str]:
+    if block_type == 'industrial':
+        return {s.K_BUILDING: 'industrial', s.K_BUILDING_LEVELS: '2', s.K_ROOF_SHAPE: 'flat'}
+    if index % 5 == 0:
+        return {s.K_BUILDING: 'apartments', s.K_BUILDING_LEVELS: str(4 + index % 3)}
+    return {s.K_BUILDING: 'house', s.K_BUILDING_LEVELS: str(1 + index % 2), s.K_ROOF_SHAPE: 'gabled'}
+
+
+def create_town(transformer: co.Transformation, blocks: int, single_zone: bool = False) -> op.InMemoryDataSource:
+    """Creates a town of blocks x blocks squares around the origin of the transformer. The squares are residential
+    (every fourth industrial) with buildings along the streets - except the square in the middle, which is a park.
+    If single_zone is True, then the squares have neither land-use nor buildings. Instead the whole town is one
+    residential zone without buildings - e.g. to generate buildings in."""
+    town = _TownBuilder(transformer)
+    half = blocks * BLOCK_SIZE / 2
+
+    # streets: the outer ones are primary and form a ring, the inner ones residential lined with trees
+    grid = dict()  # key: (column, row), value: osm_id of the node at the intersection
+    for column in range(blocks + 1):
+        for row in range(blocks + 1):
+            grid[(column, row)] = town.add_node(-half + column * BLOCK_SIZE, -half + row * BLOCK_SIZE)
+    for line in range(blocks + 1):
+        if line in (0, blocks):
+            tags = {s.K_HIGHWAY: 'primary', 'name': 'Ring'}
+        else:
+            tags = {s.K_HIGHWAY: 'residential', s.K_TREE_LINED: 'both' if line % 2 else 'no'}
+        town.add_way([grid[(column, line)] for column in range(blocks + 1)], dict(tags))
+        town.add_way([grid[(line, row)] for row in range(blocks + 1)], dict(tags))
+
+    # land-use and buildings per block
+    park = (blocks // 2, blocks // 2)
+    if single_zone:
+        town.add_area(-half - 10., -half - 10., half + 10., half + 10., {s.K_LANDUSE: 'residential'})
+    building_index = 0
+    for column in range(blocks):
+        for row in range(blocks):
+            min_x = -half + column * BLOCK_SIZE + 8.
+            min_y = -half + row * BLOCK_SIZE + 8.
+            max_x = min_x + BLOCK_SIZE - 16.
+            max_y = min_y + BLOCK_SIZE - 16.
+            if (column, row) == park:
+                town.add_area(min_x, min_y, max_x, max_y, {s.K_LEISURE: s.V_PARK})
+                for tree_x in range(int(min_x) + 10, int(max_x) - 5, 15):
+                    for tree_y in range(int(min_y) + 10, int(max_y) - 5, 15):
+                        town.add_node(tree_x, tree_y, {s.K_NATURAL: 'tree'})
+                continue
+            if single_zone:
+                continue
+            block_type = 'industrial' if (column + row) % 4 == 0 else 'residential'
+            town.add_area(min_x, min_y, max_x, max_y, {s.K_LANDUSE: block_type})
+            if block_type == 'industrial':
+                town.add_area(min_x + 10., min_y + 10., max_x - 10., min_y + 45., _building_tags(block_type, 0))
+                town.add_area(min_x + 10., max_y - 40., max_x - 30., max_y - 10., _building_tags(block_type, 1))
+                continue
+            along = min_x + 6.
+            while along + 12. < max_x - 6.:  # two rows of buildings facing the streets in the south and north
+                for start_y in (min_y + 6., max_y - 16.):
+                    building_index += 1
+                    town.add_area(along, start_y, along + 12., start_y + 10., _building_tags(block_type,
+                                                                                             building_index))
+                along += BUILDING_SPACING
+
+    # a railway and a row of trees along it south of the town
+    rail_y = -half - 60.
+    town.add_line([(-half - 400. + i * 100., rail_y) for i in range(int(2 * half / 100.) + 9)],
+                  {s.K_RAILWAY: s.V_RAIL, 'gauge': '1435', 'electrified': 'no'})
+    town.add_line([(-half + i * 50., rail_y + 15.) for i in range(int(2 * half / 50.) + 1)],
+                  {s.K_NATURAL: 'tree_row'})
+
+    # a high voltage power line north of the town and a minor line along the eastern ring road
+    town.add_line([(-half - 800. + i * 300., half + 150.) for i in range(int((2 * half + 1600.) / 300.) + 1)],
+                  {s.K_POWER: 'line', 'voltage': '110000', 'cables': '6'}, {s.K_POWER: 'tower'})
+    town.add_line([(half + 20., -half + i * 60.) for i in range(int(2 * half / 60.) + 1)],
+                  {s.K_POWER: 'minor_line'}, {s.K_POWER: 'pole'})
+
+    town.add_node(0., 0., {s.K_PLACE: 'town', 'name': 'Synthetic', 'population': '12000'})
+    return op.InMemoryDataSource(town.nodes_dict, town.ways_dict)
+
+
+def town_extent(blocks: int) -> float:
+    """Half of the width of the town incl. the railway and power lines in metres."""
+    return blocks * BLOCK_SIZE / 2 + 800.
+
+
+def _material_of_cell(x: float, y: float, town_half: float) -> bytes:
+    if abs(x) < town_half and abs(y) < town_half:
+        return b'Town'
+    if x > town_half and y < -town_half:
+        return b'Lake'
+    return b'Grassland'
+
+
+def _btg_object(object_type: int, properties: List[Tuple[int, bytes]], elements: List[bytes]) -> bytes:
+    data = struct.pack('<BII', object_type, len(properties), len(elements))
+    for property_type, property_data in properties:
+        data += struct.pack('<BI', property_type, len(property_data)) + property_data
+    for element in elements:
+        data += struct.pack('<I', len(element)) + element
+    return data
+
+
+def write_btg(transformer: co.Transformation, half_extent: float) -> str:
+    """Writes a BTG file (version 10) for the tile in the parameters' boundary with triangles of land-use materials
+    covering a square around the origin of the transformer. Returns the file name."""
+    lon_lat = parameters.get_center_global()
+    path_to_btg = calc_tile.construct_path_to_files(parameters.PATH_TO_SCENERY,
+                                                    stg_io2.scenery_directory_name(stg_io2.SceneryType.terrain),
+                                                    (lon_lat.lon, lon_lat.lat))
+    os.makedirs(path_to_btg, exist_ok=True)
+    file_name = os.path.join(path_to_btg, calc_tile.construct_btg_file_name_from_tile_index(
+        parameters.get_tile_index()))
+
+    to_cartesian = pyproj.Transformer.from_crs('EPSG:4326', {"proj": 'geocent', "ellps": 'WGS84', "datum": 'WGS84'},
+                                               always_xy=True)
+    center = to_cartesian.transform(lon_lat.lon, lon_lat.lat, 0.)
+    cells = int(math.ceil(2 * half_extent / BTG_CELL_SIZE))
+    start = -cells * BTG_CELL_SIZE / 2
+    vertices = list()
+    for column in range(cells + 1):
+        for row in range(cells + 1):
+            lon, lat = transformer.to_global((start + column * BTG_CELL_SIZE, start + row * BTG_CELL_SIZE))
+            x, y, z = to_cartesian.transform(lon, lat, 0.)
+            vertices.append(struct.pack('<fff', x - center[0], y - center[1], z - center[2]))
+
+    triangles = dict()  # key: material, value: packed vertex indices
+    town_half = half_extent - 800.
+    for column in range(cells):
+        for row in range(cells):
+            material = _material_of_cell(start + (column + .5) * BTG_CELL_SIZE, start + (row + .5) * BTG_CELL_SIZE,
+                                         town_half)
+            sw = column * (cells + 1) + row
+            se = sw + cells + 1
+            triangles[material] = triangles.get(material, b'') + struct.pack('<6I', sw, se, se + 1, sw, se + 1,
+                                                                             sw + 1)
+
+    objects = [_btg_object(btg_io.OBJECT_TYPE_BOUNDING_SPHERE, [],
+                           [struct.pack('<dddf', center[0], center[1], center[2], cells * BTG_CELL_SIZE)]),
+               _btg_object(btg_io.OBJECT_TYPE_VERTEX_LIST, [], [b''.join(vertices)])]
+    for material, indices in sorted(triangles.items()):
+        objects.append(_btg_object(btg_io.OBJECT_TYPE_TRIANGLES,
+                                   [(btg_io.PROPERTY_TYPE_MATERIAL, material),
+                                    (btg_io.PROPERTY_TYPE_INDEX, bytes([btg_io.INDEX_TYPE_VERTICES]))],
+                                   [indices]))
+    with gzip.open(file_name, 'wb') as btg_file:
+        btg_file.write(struct.pack('<HHI', 10, 0x5347, int(time.time())))
+        btg_file.write(struct.pack('<I', len(objects)))
+        for btg_object in objects:
+            btg_file.write(btg_object)
+    return file_name
+
+
+_ROOFS_REGISTRATION = """
+roofs.append(Texture('roof_red.png', 30., [], True, 30., [], False,
+                     provides=['colour:red', 'compat:roof-pitched', 'compat:roof-flat', 'default']))
+roofs.append(Texture('roof_gray.png', 30., [], True, 30., [], False,
+                     provides=['colour:gray', 'compat:roof-flat', 'compat:roof-large', 'default']))
+"""
+
+_FACADES_REGISTRATION = """
+facades.append(Texture('generic/facade_house.png',
+                       h_size_meters=24., h_cuts=[64, 128, 192, 256], h_can_repeat=True,
+                       v_size_meters=12., v_cuts=[128, 256, 384, 512], v_can_repeat=False,
+                       provides=['shape:residential', 'age:old', 'age:modern', 'compat:roof-flat',
+                                 'compat:roof-pitched']))
+facades.append(Texture('generic/facade_block.png',
+                       h_size_meters=24., h_cuts=[64, 128, 192, 256], h_can_repeat=False,
+                       v_size_meters=12., v_cuts=[128, 256, 384, 512], v_can_repeat=True,
+                       provides=['shape:commercial', 'shape:industrial', 'age:modern', 'compat:roof-flat']))
+"""
+
+
+def write_textures() -> None:
+    """Writes plain textures with their registrations to tex.src in PATH_TO_OSM2CITY_DATA and creates the
+    texture atlas from them like prepare_textures.py."""
+    tex_src = os.path.join(parameters.PATH_TO_OSM2CITY_DATA, 'tex.src')
+    os.makedirs(os.path.join(tex_src, 'generic'), exist_ok=True)
+    os.makedirs(os.path.join(parameters.PATH_TO_OSM2CITY_DATA, 'tex'), exist_ok=True)
+    for file_name, size, colour in [('roof_red.png', (256, 256), (160, 50, 40)),
+                                    ('roof_gray.png', (256, 256), (110, 110, 110)),
+                                    (os.path.join('generic', 'facade_house.png'), (256, 512), (220, 210, 180)),
+                                    (os.path.join('generic', 'facade_block.png'), (256, 512), (180, 180, 190))]:
+        Image.new('RGB', size, colour).save(os.path.join(tex_src, file_name))
+    with open(os.path.join(tex_src, prepare_textures.ROOFS_DEFAULT_FILE_NAME), 'w') as registration:
+        registration.write(_ROOFS_REGISTRATION)
+    with open(os.path.join(tex_src, 'generic', 'facades.py'), 'w') as registration:
+        registration.write(_FACADES_REGISTRATION)
+    prepare_textures.init(utilities.Stats(), prepare_textures.InitMode.create)
+
+
+def configure_parameters(work_directory: str, blocks: int) -> None:
+    """Points all paths into the working directory and sets the boundary around the town. Caches are switched off,
+    such that each run of a benchmark does the same work. The elevation is computed instead of probed with fgelev."""
+    parameters.PATH_TO_SCENERY = os.path.join(work_directory, 'scenery')
+    parameters.PATH_TO_SCENERY_OPT = None
+    parameters.PATH_TO_OUTPUT = os.path.join(work_directory, 'output')
+    parameters.PATH_TO_OSM2CITY_DATA = os.path.join(work_directory, 'osm2city-data')
+    parameters.FG_ELEV_CACHE = False
+    parameters.OWBB_LANDUSE_CACHE = False
+    parameters.OWBB_GENERATED_BUILDINGS_CACHE = False
+    parameters.OVERLAP_CHECK_HULL_CACHE = False
+    parameters.FLAG_AFTER_2020_3 = True
+    parameters.C2P_PROCESS_TREES = True
+    parameters.C2P_PROCESS_POWERLINES_MINOR = True
+    parameters.PREFIX = 'benchmark'
+    parameters.ELEV_PROVIDER = 'analytic'
+
+    transformer = co.Transformation((CENTER_LON, CENTER_LAT))
+    half_extent = town_extent(blocks)
+    west, south = transformer.to_global((-half_extent, -half_extent))
+    east, north = transformer.to_global((half_extent, half_extent))
+    parameters.set_boundary(west, south, east, north)
+
+
+# ================ UNITTESTS =======================
+
+
+class TestFixtures(unittest.TestCase):
+    def test_create_town(self):
+        transformer = co.Transformation((CENTER_LON, CENTER_LAT))
+        data_source = create_town(transformer, 4)
+        highways = [way for way in data_source.ways_dict.values() if s.K_HIGHWAY in way.tags]
+        self.assertEqual(10, len(highways))
+        parks = [way for way in data_source.ways_dict.values() if way.tags.get(s.K_LEISURE) == s.V_PARK]
+        self.assertEqual(1, len(parks))
+        for way in data_source.ways_dict.values():
+            for ref in way.refs:
+                self.assertIn(ref, data_source.nodes_dict)
+        self.assertEqual(calc_tile.calc_tile_index((CENTER_LON, CENTER_LAT)), 3138112)
@@ -0,0 +1,189 @@
+"""
+Times the processing stages on the synthetic town of fixtures.py - without database, fgelev or network - and writes
+the results as JSON. A previous result can be given to check for regressions.
+
+Run e.g. from the root of the repository:
+
+    python -m osm2city.benchmark.suite -o new.json -c previous.json
+
+Each stage is run within the same process as in build_tiles.py for a tile: first the land-use (owbb), the results
+of which are used by the other stages. The median wall and CPU time per stage across the repetitions is compared.
+The spans and counters recorded by utils/metrics.py within a stage (e.g. 'buildings.analyse') are reported as
+measured in the last repetition.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+import unittest
+
+from osm2city import buildings, parameters, pylons, roads, trees
+from osm2city.benchmark import fixtures
+import osm2city.owbb.landuse as ol
+from osm2city.utils import coordinates as co, metrics, osmparser as op, utilities
+
+
+STAGES = ['owbb', 'buildings', 'roads', 'pylons', 'trees']
+
+RESULT_VERSION = 1
+
+
+def _run_stage(stage: str, transformer: co.Transformation, fg_elev: utilities.ElevationProvider,
+               owbb_results: dict) -> None:
+    if stage == 'owbb':
+        owbb_results['lit_areas'], owbb_results['water_areas'], owbb_results['osm_buildings'] = ol.process(
+            transformer, list())
+    elif stage == 'buildings':
+        buildings.process_buildings(transformer, fg_elev, list(), list(), owbb_results['osm_buildings'])
+    elif stage == 'roads':
+        roads.process_roads(transformer, fg_elev, list(), owbb_results['lit_areas'], owbb_results['water_areas'],
+                            list())
+    elif stage == 'pylons':
+        pylons.process_pylons(transformer, fg_elev, list())
+    elif stage == 'trees':
+        trees.process_trees(transformer, fg_elev, owbb_results['osm_buildings'])
+
+
+def _run_once(stages: List[str], transformer: co.Transformation) -> Dict[str, dict]:
+    """Runs the stages once. The land-use is always processed, as the other stages depend on it."""
+    fg_elev = utilities.create_elevation_provider(transformer, parameters.get_tile_index())
+    owbb_results = dict()
+    measurements = dict()
+    for stage in STAGES:
+        if stage != 'owbb' and stage not in stages:
+            continue
+        metrics.reset()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        _run_stage(stage, transformer, fg_elev, owbb_results)
+        measurements[stage] = dict(wall=time.perf_counter() - wall_start, cpu=time.process_time() - cpu_start,
+                                   metrics=metrics.collect())
+    fg_elev.close()
+    return {stage: values for stage, values in measurements.items() if stage in stages}
+
+
+def run_benchmark(work_directory: str, blocks: int, repetitions: int, stages: List[str]) -> dict:
+    """Creates the fixtures in the working directory and runs the stages a number of times.
+    The working directory is also the current directory during the run, as some caches are written there."""
+    fixtures.configure_parameters(work_directory, blocks)
+    transformer = co.Transformation(parameters.get_center_global())
+    data_source = fixtures.create_town(transformer, blocks)
+    op.set_data_source(data_source)
+    current_directory = os.getcwd()
+    try:
+        os.chdir(work_directory)
+        fixtures.write_btg(transformer, fixtures.town_extent(blocks))
+        fixtures.write_textures()
+        runs = [_run_once(stages, transformer) for _ in range(repetitions)]
+    finally:
+        os.chdir(current_directory)
+        op.set_data_source(None)
+
+    results = dict()
+    for stage in runs[0].keys():
+        walls = [run[stage]['wall'] for run in runs]
+        cpus = [run[stage]['cpu'] for run in runs]
+        results[stage] = dict(wall=round(statistics.median(walls), 4), cpu=round(statistics.median(cpus), 4),
+                              walls=[round(wall, 4) for wall in walls], metrics=runs[-1][stage]['metrics'])
+    return dict(version=RESULT_VERSION, time=round(time.time(), 3), python=platform.python_version(),
+                machine=platform.machine(), blocks=blocks, repetitions=repetitions,
+                osm_nodes=len(data_source.nodes_dict), osm_ways=len(data_source.ways_dict), stages=results)
+
+
+def compare(current: dict, previous: dict, tolerance: float, min_difference: float = 0.05) -> List[str]:
+    """Returns a message per stage, which is slower than in the previous result by more than the tolerance
+    (a fraction of the previous median wall time) and at least min_difference seconds."""
+    regressions = list()
+    if current['blocks'] != previous['blocks']:
+        logging.warning('The previous result was run with %i blocks instead of %i', previous['blocks'],
+                        current['blocks'])
+    for stage, values in current['stages'].items():
+        if stage not in previous['stages']:
+            continue
+        before = previous['stages'][stage]['wall']
+        if values['wall'] > before * (1. + tolerance) and values['wall'] - before >= min_difference:
+            regressions.append('{}: {:.3f} s instead of {:.3f} s ({:+.0%})'.format(stage, values['wall'], before,
+                                                                                 values['wall'] / before - 1.))
+    return regressions
+
+
+def print_results(results: dict, previous: Optional[dict]) -> None:
+    print('Benchmark with {} blocks ({} OSM nodes, {} ways) - median of {} repetitions in seconds:'.format(
+        results['blocks'], results['osm_nodes'], results['osm_ways'], results['repetitions']))
+    for stage, values in results['stages'].items():
+        before = ''
+        if previous is not None and stage in previous['stages']:
+            before = '  previous wall: {:8.3f}'.format(previous['stages'][stage]['wall'])
+        print('  {:10} wall: {:8.3f}  cpu: {:8.3f}{}'.format(stage, values['wall'], values['cpu'], before))
+        for name, span_values in sorted(values['metrics']['spans'].items()):
+            print('    {:30} calls: {:7}  wall: {:8.3f}'.format(name, span_values['calls'], span_values['wall']))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Runs the benchmark of the processing stages on synthetic data '
+                                                 'without database, fgelev or network')
+    parser.add_argument('-f', '--file', dest='filename', metavar='FILE',
+                        help='read parameters from FILE (e.g. params.py) - paths and caches are overridden')
+    parser.add_argument('-b', '--blocks', dest='blocks', type=int, default=8,
+                        help='the number of blocks of streets per direction in the synthetic town (default: 8)')
+    parser.add_argument('-r', '--repetitions', dest='repetitions', type=int, default=3,
+                        help='the number of times each stage is run (default: 3)')
+    parser.add_argument('-s', '--stages', dest='stages', nargs='+', choices=STAGES, default=STAGES,
+                        help='the stages to run (default: all)')
+    parser.add_argument('-o', '--output', dest='output', metavar='FILE',
+                        help='write the results as JSON to FILE')
+    parser.add_argument('-c', '--compare', dest='compare', metavar='FILE',
+                        help='compare with the results in FILE and exit with 1 if a stage is slower')
+    parser.add_argument('-t', '--tolerance', dest='tolerance', type=float, default=0.2,
+                        help='the fraction a stage may be slower than in the compared results (default: 0.2)')
+    parser.add_argument('-l', '--loglevel', dest='loglevel', default='WARNING',
+                        help='set logging level of the stages. Valid levels are DEBUG, INFO, WARNING (default), '
+                             'ERROR, CRITICAL')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)-9s: %(message)s', level=args.loglevel)
+    if args.filename is not None:
+        parameters.read_from_file(args.filename)
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare, 'r') as previous_file:
+            previous = json.load(previous_file)
+
+    with tempfile.TemporaryDirectory(prefix='osm2city_benchmark_') as work_directory:
+        results = run_benchmark(work_directory, args.blocks, args.repetitions, args.stages)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    print_results(results, previous)
+    if previous is not None:
+        regressions = compare(results, previous, args.tolerance)
+        for regression in regressions:
+            print('Regression in stage ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+# ================ UNITTESTS =======================
+
+
+class TestSuite(unittest.TestCase):
+    def test_compare(self):
+        previous = dict(blocks=8, stages=dict(owbb=dict(wall=1.), roads=dict(wall=2.), trees=dict(wall=0.01)))
+        current = dict(blocks=8, stages=dict(owbb=dict(wall=1.1), roads=dict(wall=3.), trees=dict(wall=0.04),
+                                             pylons=dict(wall=9.)))
+        regressions = compare(current, previous, 0.2)
+        self.assertEqual(1, len(regressions))
+        self.assertTrue(regressions[0].startswith('roads: 3.000 s instead of 2.000 s (+50%)'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
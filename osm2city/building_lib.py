@@ -17,7 +17,7 @@ Call hierarchy (as of summer 2017) - building_lib is called from building.py:
         b.analyse_roof_check(...)
         b.analyse_textures()
 * building_lib.decide_lod(...)
-* building_lib.write(...)
+* building_lib.create_ac_file(...)
     for building in ...
         b.write_to_ac(...)
 
@@ -648,7 +648,7 @@ class Building(object):
         logging.debug("__done" + str(self.roof_texture) + str(self.roof_texture.provides))
         return True
 
-    def analyse_elev_and_water(self, fg_elev: utilities.FGElev) -> bool:
+    def analyse_elev_and_water(self, fg_elev: utilities.ElevationProvider) -> bool:
         """Get the elevation of the node lowest node on the outer ring.
         If a node is in water or at -9999, then return False."""
         min_ground_elev, diff_elev = fg_elev.probe_list_of_points(self.pts_outer)
@@ -1651,7 +1651,7 @@ def decide_lod(buildings: List[Building], stats: utilities.Stats) -> None:
         stats.count_LOD(lod)
 
 
-def analyse(buildings: List[Building], fg_elev: utilities.FGElev, stg_manager: stg_io2.STGManager,
+def analyse(buildings: List[Building], fg_elev: utilities.ElevationProvider, stg_manager: stg_io2.STGManager,
             coords_transform: co.Transformation,
             facade_mgr: tex.FacadeManager, roof_mgr: tex.RoofManager, stats: utilities.Stats) -> List[Building]:
     """Analyse all buildings and either link directly static models or specify Building objects.
@@ -1732,9 +1732,9 @@ def analyse(buildings: List[Building], fg_elev: utilities.FGElev, stg_manager: s
     return new_buildings
 
 
-def write(ac_file_name: str, buildings: List[Building], cluster_offset: co.Vec2d,
-          roof_mgr: tex.RoofManager, stats: utilities.Stats) -> None:
-    """Write buildings across LOD for given tile.
+def create_ac_file(buildings: List[Building], cluster_offset: co.Vec2d,
+                   roof_mgr: tex.RoofManager, stats: utilities.Stats) -> ac3d.File:
+    """Create an ac-file with the buildings across LOD for given tile.
        While writing, accumulate some statistics (totals stored in global stats object, individually also in building).
        Offset accounts for cluster center
        All LOD in one file. Plus roofs. One ac3d.Object per LOD
@@ -1753,7 +1753,7 @@ def write(ac_file_name: str, buildings: List[Building], cluster_offset: co.Vec2d
         roof_mat_idx = mat.Material.facade.value
         b.write_to_ac(ac_object, cluster_offset, roof_mgr, face_mat_idx, roof_mat_idx, stats)
 
-    ac.write(ac_file_name)
+    return ac
 
 
 def _buildings_after_remove_with_parent_children(orig_buildings: List[Building],
@@ -1832,7 +1832,7 @@ def update_building_tags_in_aerodromes(my_buildings: List[Building]) -> None:
 
 
 def _analyse_worship_building(building: Building, building_parent: BuildingParent,
-                              stg_manager: stg_io2.STGManager, fg_elev: utilities.FGElev,
+                              stg_manager: stg_io2.STGManager, fg_elev: utilities.ElevationProvider,
                               coords_transform: co.Transformation) -> bool:
     """Returns True and adds shared model if the building is a worship place and there is a shared model for it.
     If the building has a parent, then it is not handled as it is assumed, that then there is a OSM 3D
@@ -16,7 +16,8 @@ import os
 import random
 import textwrap
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+import unittest
 
 import shapely.geometry as shg
 import shapely.ops as sho
@@ -27,8 +28,7 @@ from osm2city import building_lib, prepare_textures, cluster, parameters
 import osm2city.textures.materials
 import osm2city.utils.coordinates as co
 import osm2city.utils.osmparser as op
-from osm2city.utils import utilities, stg_io2
-from osm2city.owbb import plotting as p
+from osm2city.utils import metrics, utilities, stg_io2
 from osm2city.static_types import osmstrings as s
 from osm2city.static_types import enumerations as enu
 
@@ -38,6 +38,8 @@ OUR_MAGIC = "osm2city"  # Used in e.g. stg files to mark edits by osm2city
 # https://wiki.openstreetmap.org/wiki/Key%3Abuilding%3Apart
 ALLOWED_BUILDING_PART_VALUES = [s.V_YES, s.V_RESIDENTIAL, s.V_APARTMENTS, s.V_HOUSE, s.V_COMMERCIAL, s.V_RETAIL]
 
+_REMODELLED_PARTS_GRID_SIZE = 100  # in meters; cell size of the grid index of building parts re-modelled as buildings
+
 
 def _in_skip_list(way: op.Way) -> bool:
     """Checking if the way's name or osm_id are SKIP_LIST"""
@@ -127,6 +129,7 @@ def _process_rectify_buildings(nodes_dict: Dict[int, op.Node], rel_nodes_dict: D
     if parameters.DEBUG_PLOT_RECTIFY:
         if change_candidates:
             logging.info('Start plotting rectify')
+            from osm2city.owbb import plotting as p  # only imported when plotting for faster start-up
             p.draw_rectify(change_candidates, parameters.RECTIFY_MAX_DRAW_SAMPLE,
                            parameters.RECTIFY_SEED_SAMPLE)
             last_time = utilities.time_logging("Time used in seconds for plotting", last_time)
@@ -322,11 +325,25 @@ def _process_simple_3d_building(relation: op.Relation, my_buildings: Dict[int, b
             del my_buildings[osm_id]
 
 
+def _create_refs_index(keys_refs: List[Tuple[Any, List[int]]]) -> Dict[int, List[Any]]:
+    """Creates an index of node references (key) to the keys of the objects using the node (value).
+    The sequence of the keys per node reference is the same as in the input list."""
+    refs_index = dict()
+    for key, refs in keys_refs:
+        for ref in set(refs):
+            refs_index.setdefault(ref, list()).append(key)
+    return refs_index
+
+
 def _process_building_parts(nodes_dict: Dict[int, op.Node],
                             my_buildings: Dict[int, building_lib.Building],
                             coords_transform: co.Transformation) -> None:
     """Process building parts, for which there is no relationship tagging and therefore there might be overlaps.
-    I.e. methods related to _process_osm_relation do not help. Therefore some brute force searching is needed.
+    I.e. methods related to _process_osm_relation do not help. Therefore some searching is needed.
+
+    In order not to test each part against each building, the candidate outlines are indexed by node reference
+    and by a spatial index. Each part is then only tested against those candidates, which share a node or
+    which overlap with the part's bounds - in the same sequence as in my_buildings.
     """
     stats_parts_tested = 0
     stats_parts_removed = 0
@@ -336,6 +353,21 @@ def _process_building_parts(nodes_dict: Dict[int, op.Node],
     building_parents = dict()  # osm_id, BuildingParent object
     building_parts_to_remove = list()  # osm_ids
     building_prepared_geoms = dict()  # osm_id, PreparedGeometry
+
+    # index the candidate outlines
+    building_positions = dict()  # osm_id, position in my_buildings
+    outline_keys = list()
+    outline_polygons = list()
+    for position, (c_key, candidate) in enumerate(my_buildings.items()):
+        building_positions[c_key] = position
+        if s.K_BUILDING_PART not in candidate.tags and candidate.polygon is not None:
+            outline_keys.append(c_key)
+            outline_polygons.append(candidate.polygon)
+    outlines_refs_index = _create_refs_index([(key, my_buildings[key].refs) for key in outline_keys])
+    outlines_spatial_index = utilities.STRTreeIndex(outline_polygons, outline_keys)
+    # parts re-modelled as buildings, which therefore also can be outlines - added one by one
+    remodelled_grid = utilities.BoundsGrid(_REMODELLED_PARTS_GRID_SIZE)
+
     for part_key, b_part in my_buildings.items():
         if s.K_BUILDING_PART in b_part.tags and s.K_BUILDING not in b_part.tags:
             stats_parts_tested += 1
@@ -353,7 +385,12 @@ def _process_building_parts(nodes_dict: Dict[int, op.Node],
                 # do it by common nodes instead of geometry due to performance
                 b_part_valid_poly = b_part.polygon.is_valid
                 parent_missing = True
-                for c_key, candidate in my_buildings.items():
+                candidate_keys = set(outlines_spatial_index.query(b_part.polygon))
+                for ref in b_part.refs:
+                    candidate_keys.update(outlines_refs_index.get(ref, ()))
+                candidate_keys.update(remodelled_grid.query(b_part.polygon.bounds))
+                for c_key in sorted(candidate_keys, key=building_positions.get):
+                    candidate = my_buildings[c_key]
                     if part_key != c_key and s.K_BUILDING_PART not in candidate.tags and candidate.polygon is not None:
                         if c_key not in building_prepared_geoms:
                             prep_geom = None
@@ -387,6 +424,9 @@ def _process_building_parts(nodes_dict: Dict[int, op.Node],
                 if parent_missing:
                     stats_parts_remodelled += 1
                     b_part.make_building_from_part()
+                    remodelled_grid.add(b_part.polygon.bounds, part_key)
+                    for ref in b_part.refs:
+                        outlines_refs_index.setdefault(ref, list()).append(part_key)
             else:
                 if b_part.parent.outline:
                     if b_part.parent.osm_id not in building_parents:
@@ -535,10 +575,21 @@ def process_building_loose_parts(nodes_dict: Dict[int, op.Node], my_buildings: L
       would not be the case for the distance between the 2 pints not directly connected. We take the risk.
     """
     new_relations = 0
+    zone_refs_indices = dict()  # id of zone, refs index of positions in zone.osm_buildings
     for first_building in my_buildings:
         potential_attached = first_building.zone.osm_buildings
+        zone_key = id(first_building.zone)
+        if zone_key not in zone_refs_indices:
+            zone_refs_indices[zone_key] = _create_refs_index([(position, building.refs) for position, building
+                                                              in enumerate(potential_attached)])
+        zone_refs_index = zone_refs_indices[zone_key]
         ref_set_first = set(first_building.refs)
-        for second_building in potential_attached:
+        # only buildings sharing at least one node can be related - keep the sequence in the zone
+        candidate_positions = set()
+        for ref in ref_set_first:
+            candidate_positions.update(zone_refs_index.get(ref, ()))
+        for position in sorted(candidate_positions):
+            second_building = potential_attached[position]
             if first_building.osm_id == second_building.osm_id:  # do not compare with self
                 continue
             if first_building.parent is not None and first_building.parent.contains_child(second_building):
@@ -949,49 +1000,46 @@ def _write_buildings_in_lists(coords_transform: co.Transformation,
 
     path_to_stg = stg_manager.add_building_list(file_shader, material_name_shader, coords_transform.anchor, list_elev)
 
-    try:
-        with open(os.path.join(path_to_stg, file_shader), 'w') as shader:
-            for b, list_type in list_buildings.items():
-                elev = b.ground_elev - list_elev - co.calc_horizon_elev(b.anchor.x, b.anchor.y)
-                line = '{:.1f} {:.1f} {:.1f} {:.0f} {}'.format(-b.anchor.y, b.anchor.x, elev, b.street_angle,
-                                                               list_type.value)
-                b.compute_roof_height(True)
-                if parameters.BUILDING_TEXTURE_GROUP_RADIUS_M > 0:
-                    # Use same texture indexes for small buildings close together.  We take advantage of the building
-                    # list being approximately sorted spatially.  This provides some variability.
-                    delta_x = b.anchor.x - loc_x
-                    delta_y = b.anchor.y - loc_y
-                    dist2 = delta_x * delta_x + delta_y * delta_y
-
-                    if list_type.value == building_lib.BuildingListType.small:
-                        if dist2 > (parameters.BUILDING_TEXTURE_GROUP_RADIUS_M *
-                                    parameters.BUILDING_TEXTURE_GROUP_RADIUS_M):
-                            # Generate new texture index if a sufficient distance the center of the last location.
-                            wall_tex_idx = int(abs(b.anchor.x / 7.0))
-                            roof_tex_idx = int(abs(b.anchor.y / 5.0))
-                            loc_x = b.anchor.x
-                            loc_y = b.anchor.y
-                    else:
-                        # Medium and large buildings have semi-random texture
-                        wall_tex_idx = int(abs(b.anchor.x / 7.0))
-                        roof_tex_idx = int(abs(b.anchor.y / 5.0))
-                else:
-                    tex_variability = 6
-                    if list_type is building_lib.BuildingListType.large:
-                        tex_variability = 4
-                    wall_tex_idx = random.randint(0, tex_variability - 1)  # FIXME: should calc on street level or owbb
-                    roof_tex_idx = wall_tex_idx
-
-                roof_orientation = b.calc_roof_list_orientation()
-                line += ' {:.1f} {:.1f} {:.1f} {:.1f} {} {} {} {} {}'.format(b.width, b.depth, b.body_height,
-                                                                             b.roof_height, b.roof_shape.value,
-                                                                             roof_orientation, round(b.levels),
-                                                                             wall_tex_idx, roof_tex_idx)
-                shader.write(line)
-                shader.write('\n')
-            # _debug_building_list_lsme(coords_transform, shader, list_elev)
-    except IOError as e:
-        logging.warning('Could not write buildings in list to file %s', e)
+    lines = list()
+    for b, list_type in list_buildings.items():
+        elev = b.ground_elev - list_elev - co.calc_horizon_elev(b.anchor.x, b.anchor.y)
+        line = '{:.1f} {:.1f} {:.1f} {:.0f} {}'.format(-b.anchor.y, b.anchor.x, elev, b.street_angle,
+                                                       list_type.value)
+        b.compute_roof_height(True)
+        if parameters.BUILDING_TEXTURE_GROUP_RADIUS_M > 0:
+            # Use same texture indexes for small buildings close together.  We take advantage of the building
+            # list being approximately sorted spatially.  This provides some variability.
+            delta_x = b.anchor.x - loc_x
+            delta_y = b.anchor.y - loc_y
+            dist2 = delta_x * delta_x + delta_y * delta_y
+
+            if list_type.value == building_lib.BuildingListType.small:
+                if dist2 > (parameters.BUILDING_TEXTURE_GROUP_RADIUS_M *
+                            parameters.BUILDING_TEXTURE_GROUP_RADIUS_M):
+                    # Generate new texture index if a sufficient distance the center of the last location.
+                    wall_tex_idx = int(abs(b.anchor.x / 7.0))
+                    roof_tex_idx = int(abs(b.anchor.y / 5.0))
+                    loc_x = b.anchor.x
+                    loc_y = b.anchor.y
+            else:
+                # Medium and large buildings have semi-random texture
+                wall_tex_idx = int(abs(b.anchor.x / 7.0))
+                roof_tex_idx = int(abs(b.anchor.y / 5.0))
+        else:
+            tex_variability = 6
+            if list_type is building_lib.BuildingListType.large:
+                tex_variability = 4
+            wall_tex_idx = random.randint(0, tex_variability - 1)  # FIXME: should calc on street level or owbb
+            roof_tex_idx = wall_tex_idx
+
+        roof_orientation = b.calc_roof_list_orientation()
+        line += ' {:.1f} {:.1f} {:.1f} {:.1f} {} {} {} {} {}'.format(b.width, b.depth, b.body_height,
+                                                                     b.roof_height, b.roof_shape.value,
+                                                                     roof_orientation, round(b.levels),
+                                                                     wall_tex_idx, roof_tex_idx)
+        lines.append(line + '\n')
+    # _debug_building_list_lsme(coords_transform, shader, list_elev)
+    stg_manager.write_text_file(''.join(lines), os.path.join(path_to_stg, file_shader))
     logging.info("Total number of shader buildings written to a building_list: %d", len(list_buildings))
     stats.random_buildings = len(list_buildings)
 
@@ -1046,15 +1094,15 @@ def _write_buildings_in_meshes(coords_transform: co.Transformation,
                                                         parameters.get_cluster_dimension_radius(),
                                                         my_clusters.stg_verb_type)
 
-            building_lib.write(os.path.join(path_to_stg, file_name + ".ac"), cl.objects,
-                               cl.center, prepare_textures.roofs, stats)
+            ac_file = building_lib.create_ac_file(cl.objects, cl.center, prepare_textures.roofs, stats)
+            stg_manager.write_ac_file(ac_file, os.path.join(path_to_stg, file_name + ".ac"))
             total_buildings_written += len(cl.objects)
 
         handled_index += 1
     logging.info("Total number of buildings written to a cluster *.ac files: %d", total_buildings_written)
 
 
-def process_buildings(coords_transform: co.Transformation, fg_elev: utilities.FGElev,
+def process_buildings(coords_transform: co.Transformation, fg_elev: utilities.ElevationProvider,
                       blocked_apt_areas: List[shg.Polygon], stg_entries: List[stg_io2.STGEntry],
                       the_buildings: List[building_lib.Building],
                       file_lock: mp.Lock = None) -> None:
@@ -1088,8 +1136,9 @@ def process_buildings(coords_transform: co.Transformation, fg_elev: utilities.FG
         after = list()
         for b in the_buildings:
             after.append(b.geometry)
-        utilities.plot_blocked_areas_and_stg_entries(blocked_apt_areas, static_objects, shared_objects, before, after,
-                                                     coords_transform)
+        import osm2city.utils.plot_utilities as pu  # only imported when plotting for faster start-up
+        pu.plot_blocked_areas_and_stg_entries(blocked_apt_areas, static_objects, shared_objects, before, after,
+                                              coords_transform)
 
     # final check on building parent hierarchy and zones linked to buildings > remove dangling stuff
     building_lib.BuildingParent.clean_building_parents_dangling_children(the_buildings)
@@ -1109,37 +1158,103 @@ def process_buildings(coords_transform: co.Transformation, fg_elev: utilities.FG
     path_to_output = parameters.get_output_path()
     stg_manager = stg_io2.STGManager(path_to_output, stg_io2.SceneryType.buildings, OUR_MAGIC, parameters.PREFIX)
 
-    last_time = utilities.time_logging("Time used in seconds until before analyse", last_time)
-
-    # the heavy lifting: analysis
-    the_buildings = building_lib.analyse(the_buildings, fg_elev, stg_manager, coords_transform,
-                                         prepare_textures.facades, prepare_textures.roofs, stats)
-    last_time = utilities.time_logging("Time used in seconds for analyse", last_time)
-
-    # split between buildings in meshes and in buildings lists
-    building_lib.decide_lod(the_buildings, stats)
-    buildings_in_meshes = list()
-    buildings_in_lists = dict()  # key = building, value = building list type
-    if parameters.FLAG_STG_BUILDING_LIST:
-        for building in the_buildings:
-            if not building.is_owbb_model:  # owbb models already have it set when init of Building object
-                building.update_anchor(True)  # prepare anchor, street_angle, width, depth
-            building_list_type = building.calc_building_list_type()
-            if building_list_type is not None:
-                buildings_in_lists[building] = building_list_type
+    try:
+        last_time = utilities.time_logging("Time used in seconds until before analyse", last_time)
+
+        # the heavy lifting: analysis
+        with metrics.span('buildings.analyse'):
+            the_buildings = building_lib.analyse(the_buildings, fg_elev, stg_manager, coords_transform,
+                                                 prepare_textures.facades, prepare_textures.roofs, stats)
+        last_time = utilities.time_logging("Time used in seconds for analyse", last_time)
+
+        with metrics.span('buildings.write'):
+            # split between buildings in meshes and in buildings lists
+            building_lib.decide_lod(the_buildings, stats)
+            buildings_in_meshes = list()
+            buildings_in_lists = dict()  # key = building, value = building list type
+            if parameters.FLAG_STG_BUILDING_LIST:
+                for building in the_buildings:
+                    if not building.is_owbb_model:  # owbb models already have it set when init of Building object
+                        building.update_anchor(True)  # prepare anchor, street_angle, width, depth
+                    building_list_type = building.calc_building_list_type()
+                    if building_list_type is not None:
+                        buildings_in_lists[building] = building_list_type
+                    else:
+                        buildings_in_meshes.append(building)
+                if parameters.FLAG_BUILDINGS_LIST_SKIP is False:
+                    _write_buildings_in_lists(coords_transform, buildings_in_lists, stg_manager, stats)
+                    last_time = utilities.time_logging("Time used in seconds to write buildings in lists", last_time)
             else:
-                buildings_in_meshes.append(building)
-        if parameters.FLAG_BUILDINGS_LIST_SKIP is False:
-            _write_buildings_in_lists(coords_transform, buildings_in_lists, stg_manager, stats)
-            last_time = utilities.time_logging("Time used in seconds to write buildings in lists", last_time)
-    else:
-        buildings_in_meshes = the_buildings[:]
-    if parameters.FLAG_BUILDINGS_MESH_SKIP is False:
-        _write_buildings_in_meshes(coords_transform, buildings_in_meshes, stg_manager, stats)
-        _write_obstruction_lights(coords_transform, stg_manager, buildings_in_meshes)
-        last_time = utilities.time_logging("Time used in seconds to write buildings in meshes", last_time)
-
-    stg_manager.write(file_lock)
+                buildings_in_meshes = the_buildings[:]
+            if parameters.FLAG_BUILDINGS_MESH_SKIP is False:
+                _write_buildings_in_meshes(coords_transform, buildings_in_meshes, stg_manager, stats)
+                _write_obstruction_lights(coords_transform, stg_manager, buildings_in_meshes)
+                last_time = utilities.time_logging("Time used in seconds to write buildings in meshes", last_time)
+
+            stg_manager.write(file_lock)
+    finally:
+        stg_manager.cancel()
     _ = utilities.time_logging("Time used in seconds to write stg file", last_time)
     stats.print_summary()
     utilities.troubleshoot(stats)
+
+
+# ================ UNITTESTS =======================
+
+
+class TestBuildingParts(unittest.TestCase):
+    def test_create_refs_index(self):
+        refs_index = _create_refs_index([('a', [1, 2, 3, 1]), ('b', [3, 4]), ('c', [])])
+        self.assertEqual({1: ['a'], 2: ['a'], 3: ['a', 'b'], 4: ['b']}, refs_index)
+
+    @staticmethod
+    def _full_scan_parents(my_buildings: Dict[int, building_lib.Building]) -> Dict[int, Optional[int]]:
+        """The parent per building part as found by testing each part against all buildings in sequence."""
+        parents = dict()
+        is_part = {key: s.K_BUILDING_PART in building.tags for key, building in my_buildings.items()}
+        for part_key, b_part in my_buildings.items():
+            if not is_part[part_key]:
+                continue
+            parents[part_key] = None
+            for c_key, candidate in my_buildings.items():
+                if part_key == c_key or is_part[c_key]:
+                    continue
+                if all(ref in candidate.refs for ref in b_part.refs) or \
+                        prep(candidate.polygon).contains_properly(b_part.polygon):
+                    parents[part_key] = c_key
+                    break
+            if parents[part_key] is None:
+                is_part[part_key] = False  # re-modelled as a building
+        return parents
+
+    def test_process_building_parts(self):
+        coords_transform = co.Transformation((0., 0.))
+        nodes_dict = dict()
+        my_buildings = dict()
+
+        def add_building(osm_id: int, tag: str, first_ref: int, coords: List[Tuple[float, float]]) -> None:
+            refs = list(range(first_ref, first_ref + len(coords)))
+            for ref, local in zip(refs, coords):
+                lon, lat = coords_transform.to_global(local)
+                nodes_dict[ref] = op.Node(ref, lat, lon)
+            my_buildings[osm_id] = building_lib.Building(osm_id, {tag: s.V_YES}, shg.LinearRing(coords), None,
+                                                         refs=refs)
+
+        def box(min_x: float, min_y: float, max_x: float, max_y: float) -> List[Tuple[float, float]]:
+            return [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+
+        add_building(1, s.K_BUILDING, 100, box(0, 0, 20, 20))
+        add_building(2, s.K_BUILDING, 200, box(-10, -10, 30, 30))
+        add_building(10, s.K_BUILDING_PART, 1000, box(5, 5, 10, 10))  # within 1 and 2
+        add_building(20, s.K_BUILDING, 2000, box(100, 0, 120, 20))
+        add_building(25, s.K_BUILDING_PART, 2000, [(100, 0), (120, 0), (120, 20)])  # nodes of 20
+        add_building(30, s.K_BUILDING_PART, 3000, box(200, 0, 220, 20))  # no parent -> re-modelled
+        add_building(35, s.K_BUILDING_PART, 3500, box(205, 5, 210, 10))  # within re-modelled 30
+        expected = self._full_scan_parents(my_buildings)
+        self.assertEqual({10: 1, 25: 20, 30: None, 35: 30}, expected)
+
+        parts = {key: my_buildings[key] for key in expected}
+        _process_building_parts(nodes_dict, my_buildings, coords_transform)
+        # a re-modelled part with children becomes a part of its own parent with the area left
+        self.assertEqual(expected, {key: None if part.parent is None or part.parent.osm_id == key
+                                    else part.parent.osm_id for key, part in parts.items()})
@@ -17,7 +17,7 @@ OUR_MAGIC = "details"
 
 
 def process_details(coords_transform: co.Transformation, lit_areas: Optional[List[shg.Polygon]],
-                    fg_elev: utilities.FGElev, file_lock: mp.Lock = None) -> None:
+                    fg_elev: utilities.ElevationProvider, file_lock: mp.Lock = None) -> None:
     stats = utilities.Stats()
     lmin, lmax = parameters.get_extent_local(coords_transform)
     clusters = ClusterContainer(lmin, lmax)
@@ -40,36 +40,37 @@ def process_details(coords_transform: co.Transformation, lit_areas: Optional[Lis
     path_to_output = parameters.get_output_path()
     stg_manager = stg_io2.STGManager(path_to_output, stg_io2.SceneryType.details, OUR_MAGIC, parameters.PREFIX)
 
-    for cl in clusters:
-        if cl.objects:
-            cluster_center_global = co.Vec2d(coords_transform.to_global(cl.center))
-            ac_file_name = "%sd%i%i.ac" % (parameters.PREFIX, cl.grid_index.ix, cl.grid_index.iy)
-            ac = ac3d.File(stats=stats)
-            obj = ac.new_object('details', 'Textures/Terrain/asphalt.png', default_mat_idx=mat.Material.unlit.value)
-            for detail in cl.objects[:]:
-                if isinstance(detail, piers.Pier):
-                    detail.write(obj, cl.center)
-                else:
-                    detail.write(fg_elev, obj, cl.center)
-            path = stg_manager.add_object_static(ac_file_name, cluster_center_global, 0, 0,
-                                                 parameters.get_cluster_dimension_radius())
-            file_name = os.path.join(path, ac_file_name)
-            f = open(file_name, 'w')
-            f.write(str(ac))
-            f.close()
-
-    piers.write_boats(stg_manager, the_piers, coords_transform)
-
-    # -- write stg
-    stg_manager.write(file_lock)
-
-    # trigger processing of pylon related details
-    _process_pylon_details(coords_transform, lit_areas, fg_elev, stg_manager, lmin, lmax, file_lock)
+    try:
+        for cl in clusters:
+            if cl.objects:
+                cluster_center_global = co.Vec2d(coords_transform.to_global(cl.center))
+                ac_file_name = "%sd%i%i.ac" % (parameters.PREFIX, cl.grid_index.ix, cl.grid_index.iy)
+                ac = ac3d.File(stats=stats)
+                obj = ac.new_object('details', 'Textures/Terrain/asphalt.png', default_mat_idx=mat.Material.unlit.value)
+                for detail in cl.objects[:]:
+                    if isinstance(detail, piers.Pier):
+                        detail.write(obj, cl.center)
+                    else:
+                        detail.write(fg_elev, obj, cl.center)
+                path = stg_manager.add_object_static(ac_file_name, cluster_center_global, 0, 0,
+                                                     parameters.get_cluster_dimension_radius())
+                file_name = os.path.join(path, ac_file_name)
+                stg_manager.write_ac_file(ac, file_name)
+
+        piers.write_boats(stg_manager, the_piers, coords_transform)
+
+        # -- write stg
+        stg_manager.write(file_lock)
+
+        # trigger processing of pylon related details
+        _process_pylon_details(coords_transform, lit_areas, fg_elev, stg_manager, lmin, lmax, file_lock)
+    finally:
+        stg_manager.cancel()
 
 
 def _process_pylon_details(coords_transform: co.Transformation, lit_areas: Optional[List[shg.Polygon]],
-                           fg_elev: utilities.FGElev, stg_manager: stg_io2.STGManager, lmin: co.Vec2d, lmax: co.Vec2d,
-                           file_lock: mp.Lock = None) -> None:
+                           fg_elev: utilities.ElevationProvider, stg_manager: stg_io2.STGManager, lmin: co.Vec2d,
+                           lmax: co.Vec2d, file_lock: mp.Lock = None) -> None:
     """Pylon details (mostly cables) go also into details, but cannot be processed together with piers and pylons."""
     # Transform to real objects
     logging.info("Transforming OSM data to Line and Pylon objects -> details")
@@ -26,7 +26,7 @@ from typing import Dict, List, Tuple
 
 from osm2city import parameters
 import osm2city.utils.json_io as jio
-from osm2city.utils.utilities import FGElev, get_osm2city_directory
+from osm2city.utils.utilities import create_elevation_provider, get_osm2city_directory
 from osm2city.utils.coordinates import Vec2d
 import osm2city.utils.stg_io2 as stg
 
@@ -249,7 +249,7 @@ def main(icao: str) -> None:
                 jw_init_flag = False
 
                 tile_index = 11111  # FIXME make it real
-                my_fg_elev = FGElev(None, tile_index)
+                my_fg_elev = create_elevation_provider(None, tile_index)
                 stg_manager = stg.STGManager(parameters.PATH_TO_OUTPUT, stg.SceneryType.details, OUR_MAGIC)
                 for o in objects:
                     if o.msl is None:
@@ -4,9 +4,7 @@ import logging
 import math
 from typing import List, Dict, Optional, Tuple
 
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.interpolate
 import shapely.geometry as shg
 
 from osm2city import roads, parameters
@@ -16,7 +14,7 @@ from osm2city.utils import ac3d
 from osm2city.utils import coordinates as co
 from osm2city.utils import osmparser as op
 from osm2city.static_types import osmstrings as s
-from osm2city.utils.utilities import FGElev
+from osm2city.utils.utilities import ElevationProvider
 
 
 class LinearObject(object):
@@ -119,6 +117,7 @@ class LinearObject(object):
 
     def plot(self, center=True, left=False, right=False, angle=True, clf=True, show=True):
         """debug"""
+        import matplotlib.pyplot as plt  # only imported when plotting for faster start-up
         c = np.array(self.center.coords)
         left_edge = np.array(self.left.coords)
         right_edge = np.array(self.right.coords)
@@ -248,9 +247,9 @@ class LinearObject(object):
                     (right_nodes_list[i], xl, tex_y1)]
             obj.face(face[::-1], mat_idx=mat_idx.value)
 
-    def _probe_ground(self, fg_elev: FGElev, line_string) -> np.ndarray:
+    def _probe_ground(self, fg_elev: ElevationProvider, line_string) -> np.ndarray:
         """Probe ground elevation along given line string, return array"""
-        z_array = np.array([fg_elev.probe_elev(the_node) for the_node in line_string.coords])
+        z_array = np.array([elev for elev, _ in fg_elev.probe_many(list(line_string.coords))])
         for i in range(0, len(self.way.refs)):
             node = self.nodes_dict[self.way.refs[i]]
             layer = node.layer_for_way(self.way)
@@ -259,7 +258,7 @@ class LinearObject(object):
             z_array[i] += parameters.MIN_ABOVE_GROUND_LEVEL
         return z_array
 
-    def _get_v_add(self, fg_elev: FGElev):
+    def _get_v_add(self, fg_elev: ElevationProvider):
         """Got v_add data for first and last node. Now lift intermediate nodes.
         So far, v_add is for center line only.
         """
@@ -302,7 +301,7 @@ class LinearObject(object):
 
         return v_add, center_z
 
-    def _level_out(self, fg_elev: FGElev, v_add):
+    def _level_out(self, fg_elev: ElevationProvider, v_add):
         """given v_add, adjust left_z and right_z to stay below MAX_TRANSVERSE_GRADIENT"""
         left_z = self._probe_ground(fg_elev, self.left)
         right_z = self._probe_ground(fg_elev, self.right)
@@ -347,7 +346,7 @@ class LinearObject(object):
             ac.add_label('<' + str(self.way.osm_id) + '> add %5.2f' % v_add[i], -(anchor[1] - offset.y),
                          e + 0.5, -(anchor[0] - offset.x), scale=1)
 
-    def write_to(self, obj: ac3d.Object, fg_elev: FGElev, elev_offset, offset=None) -> bool:
+    def write_to(self, obj: ac3d.Object, fg_elev: ElevationProvider, elev_offset, offset=None) -> bool:
         """
            assume we are a street: flat (or elevated) on terrain, left and right edges
            #need adjacency info
@@ -396,7 +395,8 @@ class DeckShapeLinear(object):
 
 
 class LinearBridge(LinearObject):
-    def __init__(self, transform: co.Transformation, fg_elev: FGElev, way: op.Way, nodes_dict: Dict[int, op.Node],
+    def __init__(self, transform: co.Transformation, fg_elev: ElevationProvider, way: op.Way,
+                 nodes_dict: Dict[int, op.Node],
                  lit_areas: List[shg.Polygon],
                  width: float, tex_coords: Tuple[float, float] = road.EMBANKMENT_2):
         super().__init__(transform, way, nodes_dict, lit_areas, width, tex_coords)
@@ -408,6 +408,7 @@ class LinearBridge(LinearObject):
         for i, l in enumerate(probe_locations_nondim):
             local_point = self.center.interpolate(l, normalized=True)
             elevs[i] = fg_elev.probe_elev(local_point.coords[0])
+        import scipy.interpolate  # only imported when needed, as not all processes deal with bridges
         self.elev_spline = scipy.interpolate.interp1d(probe_locations_nondim, elevs)
         self._prep_height(nodes_dict, fg_elev)
 
@@ -422,7 +423,7 @@ class LinearBridge(LinearObject):
             linear_dist /= self.center.length
         return self.elev_spline(linear_dist)
 
-    def _prep_height(self, nodes_dict, fg_elev: FGElev):
+    def _prep_height(self, nodes_dict, fg_elev: ElevationProvider):
         """Preliminary deck shape depending on elevation. Write required v_add to end nodes"""
         # deck slope more or less continuous!
         # d2z/dx2 limit
@@ -453,7 +454,7 @@ class LinearBridge(LinearObject):
 
         msl_mid = self._elev([0.5])
 
-        msl = np.array([fg_elev.probe_elev(the_node) for the_node in self.center.coords])
+        msl = np.array([elev for elev, _ in fg_elev.probe_many(list(self.center.coords))])
 
         deck_msl = msl.copy()
         deck_msl[0] += node0.v_add
@@ -544,7 +545,7 @@ class LinearBridge(LinearObject):
 
         return ofs + 2*self.pillar_nnodes, vert, nodes_list
 
-    def write_to(self, obj: ac3d.Object, fg_elev: FGElev, elev_offset, offset=None) -> None:
+    def write_to(self, obj: ac3d.Object, fg_elev: ElevationProvider, elev_offset, offset=None) -> None:
         """
         write
         - deck
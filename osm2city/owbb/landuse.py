@@ -6,17 +6,17 @@ import logging
 import math
 import pickle
 import time
+import unittest
 from typing import Dict, List, Optional, Tuple
 
-from shapely.geometry import box, LineString, MultiPolygon, Polygon, CAP_STYLE, JOIN_STYLE
-from shapely.ops import unary_union
+from shapely.geometry import box, GeometryCollection, LineString, MultiLineString, MultiPolygon, Polygon
+from shapely.geometry import CAP_STYLE, JOIN_STYLE
 from shapely.prepared import prep
 
 import osm2city.static_types.enumerations as enu
 from osm2city import building_lib as bl
 from osm2city import buildings as bu
 from osm2city.owbb import models as m
-import osm2city.owbb.plotting as plotting
 import osm2city.owbb.would_be_buildings as wbb
 import osm2city.parameters as parameters
 import osm2city.static_types.osmstrings as s
@@ -24,8 +24,9 @@ import osm2city.utils.aptdat_io as aptdat_io
 import osm2city.utils.btg_io as btg
 import osm2city.utils.osmparser as op
 
-from osm2city.utils.coordinates import disjoint_bounds, Transformation
-from osm2city.utils.utilities import time_logging, merge_buffers
+from osm2city.utils import metrics
+from osm2city.utils.coordinates import Transformation
+from osm2city.utils.utilities import time_logging, merge_buffers, STRTreeIndex
 
 
 class GridHighway:
@@ -37,6 +38,54 @@ class GridHighway:
         self.grid_indices = set()
 
 
+def _extract_polygons(geometry) -> List[Polygon]:
+    """Returns the polygons in a geometry, which is the result of a difference or intersection."""
+    if isinstance(geometry, Polygon):
+        return [geometry]
+    if isinstance(geometry, (MultiPolygon, GeometryCollection)):
+        polygons = list()
+        for part in geometry.geoms:
+            polygons.extend(_extract_polygons(part))
+        return polygons
+    return list()
+
+
+class CityBlockFaces(object):
+    """The faces of the planar network built by the buffered highways of a tile, i.e. the areas surrounded by
+    streets, which are candidates for city blocks in all building zones.
+
+    The network is built once per tile instead of buffering and merging the highways again for each zone.
+    Buffering all highways in one go as a MultiLineString gives the same as the union of the buffers of each
+    highway, but is much faster.
+    """
+    __slots__ = 'faces_index'
+
+    def __init__(self, grid_highways: List[GridHighway], building_zones: List[m.BuildingZone]) -> None:
+        faces = list()
+        if grid_highways and building_zones:
+            lines = MultiLineString([grid_highway.geometry for grid_highway in grid_highways])
+            network = lines.buffer(parameters.OWBB_CITY_BLOCK_HIGHWAY_BUFFER,
+                                   cap_style=CAP_STYLE.square, join_style=JOIN_STYLE.bevel)
+            all_bounds = [network.bounds]
+            for building_zone in building_zones:
+                all_bounds.append(building_zone.geometry.bounds)
+            extent = box(min([bounds[0] for bounds in all_bounds]) - 1, min([bounds[1] for bounds in all_bounds]) - 1,
+                         max([bounds[2] for bounds in all_bounds]) + 1, max([bounds[3] for bounds in all_bounds]) + 1)
+            faces = _extract_polygons(extent.difference(network))
+        self.faces_index = STRTreeIndex(faces, faces)
+
+    def split_zone(self, zone_geometry: Polygon) -> List[Polygon]:
+        """Returns the polygons of the zone split by the buffered highways."""
+        prep_zone = prep(zone_geometry)
+        polygons = list()
+        for face in self.faces_index.query(zone_geometry):
+            if prep_zone.contains_properly(face):
+                polygons.append(face)
+            elif prep_zone.intersects(face):
+                polygons.extend(_extract_polygons(zone_geometry.intersection(face)))
+        return polygons
+
+
 def _process_aerodromes(building_zones: List[m.BuildingZone], aerodrome_zones: List[m.BuildingZone],
                         airports: List[aptdat_io.Airport], transformer: Transformation) -> None:
     """Merges aerodromes from OSM and apt.dat and then cuts the areas from buildings zones.
@@ -331,34 +380,6 @@ def _remove_osm_buildings_in_water(osm_buildings: List[bl.Building], btg_water_a
     logging.info('Removed %i buildings based on BTG water', counter)
 
 
-def _test_highway_intersecting_area(area: Polygon, highways_dict: Dict[int, m.Highway]) -> List[LineString]:
-    """Returns highways that are within an area or intersecting with an area.
-
-    Highways_dict gets reduced by those highways, which were within, such that searching in other
-    areas gets quicker due to reduced volume.
-    """
-    prep_area = prep(area)
-    linked_highways = list()
-    to_be_removed = list()
-    for my_highway in highways_dict.values():
-        if not my_highway.populate_buildings_along():
-            continue
-        # a bit speed up by looking at bounds first
-        is_disjoint = disjoint_bounds(my_highway.geometry.bounds, area.bounds)
-        if not is_disjoint:
-            if prep_area.contains_properly(my_highway.geometry):
-                linked_highways.append(my_highway.geometry)
-                to_be_removed.append(my_highway.osm_id)
-
-            elif prep_area.intersects(my_highway.geometry):
-                linked_highways.append(my_highway.geometry)
-
-    for key in to_be_removed:
-        del highways_dict[key]
-
-    return linked_highways
-
-
 def _test_highway_intersection_area(building_zone: m.BuildingZone,
                                     grid_highways: List[GridHighway]) -> List[LineString]:
     """Returns highways that are within a building_zone or intersecting with a building_zone.
@@ -375,39 +396,20 @@ def _test_highway_intersection_area(building_zone: m.BuildingZone,
     return linked_highways
 
 
-def _assign_city_blocks(building_zone: m.BuildingZone, highways_dict: Dict[int, m.Highway],
+def _assign_city_blocks(building_zone: m.BuildingZone, city_block_faces: CityBlockFaces,
                         grid_highways: List[GridHighway]) -> None:
     """Splits the land-use into (city) blocks, i.e. areas surrounded by streets.
-    Brute force by buffering all highways, then take the geometry difference, which splits the zone into
+    The zone is intersected with the faces of the network of buffered highways, which splits the zone into
     multiple polygons. Some of the polygons will be real city blocks, others will be border areas.
-
-    Could also be done by using e.g. networkx.algorithms.cycles.cycle_basis.html. However is a bit more complicated
-    logic and programming wise, but might be faster.
+    As before only zones intersected by at least one highway get city blocks.
     """
     building_zone.reset_city_blocks()
-    highways_dict_copy1 = highways_dict.copy()  # otherwise when using highways_dict in plotting it will be "used"
 
     polygons = list()
-    if grid_highways:
-        intersecting_highways = _test_highway_intersection_area(building_zone, grid_highways)
-    else:
-        intersecting_highways = _test_highway_intersecting_area(building_zone.geometry, highways_dict_copy1)
-    if intersecting_highways:
-        buffers = list()
-        for highway_geometry in intersecting_highways:
-            buffers.append(highway_geometry.buffer(parameters.OWBB_CITY_BLOCK_HIGHWAY_BUFFER,
-                                                   cap_style=CAP_STYLE.square,
-                                                   join_style=JOIN_STYLE.bevel))
-        geometry_difference = building_zone.geometry.difference(unary_union(buffers))
-        if isinstance(geometry_difference, Polygon) and geometry_difference.is_valid and \
-                geometry_difference.area >= parameters.OWBB_MIN_CITY_BLOCK_AREA:
-            polygons.append(geometry_difference)
-        elif isinstance(geometry_difference, MultiPolygon):
-            my_polygons = geometry_difference.geoms
-            for my_poly in my_polygons:
-                if isinstance(my_poly, Polygon) and my_poly.is_valid and \
-                        my_poly.area >= parameters.OWBB_MIN_CITY_BLOCK_AREA:
-                    polygons.append(my_poly)
+    if _test_highway_intersection_area(building_zone, grid_highways):
+        for my_poly in city_block_faces.split_zone(building_zone.geometry):
+            if my_poly.is_valid and my_poly.area >= parameters.OWBB_MIN_CITY_BLOCK_AREA:
+                polygons.append(my_poly)
 
     logging.debug('Found %i city blocks in building zone osm_ID=%i', len(polygons), building_zone.osm_id)
 
@@ -620,11 +622,11 @@ def _assign_minimum_settlement_type_to_zones(building_zones: List[m.BuildingZone
                     break
 
 
-def _assign_city_blocks_to_zones(building_zones: List[m.BuildingZone], highways_dict: Dict[int, m.Highway],
+def _assign_city_blocks_to_zones(building_zones: List[m.BuildingZone], city_block_faces: CityBlockFaces,
                                  grid_highways: List[GridHighway]) -> None:
     for zone in building_zones:
         if not zone.is_aerodrome:
-            _assign_city_blocks(zone, highways_dict, grid_highways)
+            _assign_city_blocks(zone, city_block_faces, grid_highways)
 
 
 def _assign_urban_settlement_type(building_zones: List[m.BuildingZone], current_settlement_type: enu.SettlementType,
@@ -647,7 +649,7 @@ def _assign_urban_settlement_type(building_zones: List[m.BuildingZone], current_
                                 city_block.settlement_type = current_settlement_type
 
 
-def _sanity_check_settlement_types(building_zones: List[m.BuildingZone], highways_dict: Dict[int, m.Highway],
+def _sanity_check_settlement_types(building_zones: List[m.BuildingZone], city_block_faces: CityBlockFaces,
                                    grid_highways: List[GridHighway]) -> None:
     upgraded = 0
     downgraded = 0
@@ -666,7 +668,7 @@ def _sanity_check_settlement_types(building_zones: List[m.BuildingZone], highway
                 zone.settlement_type = enu.SettlementType.dense
                 upgraded += 1
                 # now also make sure we actually have city blocks
-                _assign_city_blocks(zone, highways_dict, grid_highways)
+                _assign_city_blocks(zone, city_block_faces, grid_highways)
     logging.debug('Upgraded %i and downgraded %i settlement types for %i total building zones', upgraded, downgraded,
                   len(building_zones))
 
@@ -772,9 +774,10 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
 
     # =========== TRY TO READ CACHED DATA FIRST =======
     tile_index = parameters.get_tile_index()
-    cache_file_la = str(tile_index) + '_lit_areas.pkl'
-    cache_file_wa = str(tile_index) + '_water_areas.pkl'
-    cache_file_bz = str(tile_index) + '_buildings.pkl'
+    cache_name = parameters.get_tile_cache_name(tile_index)
+    cache_file_la = cache_name + '_lit_areas.pkl'
+    cache_file_wa = cache_name + '_water_areas.pkl'
+    cache_file_bz = cache_name + '_buildings.pkl'
     if parameters.OWBB_LANDUSE_CACHE:
         try:
             with open(cache_file_la, 'rb') as file_pickle:
@@ -847,16 +850,17 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
 
     # =========== GENERATE ADDITIONAL LAND-USE ZONES FOR AND/OR FROM BUILDINGS =============
     buildings_outside = list()  # buildings outside of OSM buildings zones
-    for candidate in osm_buildings:
-        found = False
-        for building_zone in building_zones:
-            if candidate.geometry.within(building_zone.geometry) or candidate.geometry.intersects(
-                    building_zone.geometry):
-                building_zone.relate_building(candidate)
-                found = True
-                break
-        if not found:
-            buildings_outside.append(candidate)
+    with metrics.span('owbb.assign_zones'):
+        for candidate in osm_buildings:
+            found = False
+            for building_zone in building_zones:
+                if candidate.geometry.within(building_zone.geometry) or candidate.geometry.intersects(
+                        building_zone.geometry):
+                    building_zone.relate_building(candidate)
+                    found = True
+                    break
+            if not found:
+                buildings_outside.append(candidate)
     last_time = time_logging("Time used in seconds for assigning buildings to OSM zones", last_time)
 
     _generate_building_zones_from_buildings(building_zones, buildings_outside)
@@ -915,7 +919,9 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
     last_time = time_logging('Time used in seconds assigning grid indices', last_time)
     _assign_minimum_settlement_type_to_zones(building_zones, settlement_clusters)
     last_time = time_logging('Time used in seconds assigning minimum settlement type', last_time)
-    _assign_city_blocks_to_zones(building_zones, highways_dict, grid_highways)
+    city_block_faces = CityBlockFaces(grid_highways, building_zones)
+    last_time = time_logging('Time used in seconds building the network of city block faces', last_time)
+    _assign_city_blocks_to_zones(building_zones, city_block_faces, grid_highways)
     _assign_urban_settlement_type(building_zones, enu.SettlementType.centre, centre_circles)
     last_time = time_logging('Time used in seconds assigning centre settlement type', last_time)
     _assign_urban_settlement_type(building_zones, enu.SettlementType.block, block_circles)
@@ -923,7 +929,7 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
     _assign_urban_settlement_type(building_zones, enu.SettlementType.dense, dense_circles)
     last_time = time_logging('Time used in seconds assigning dense settlement type', last_time)
     if parameters.OWBB_PLACE_CHECK_DENSITY:
-        _sanity_check_settlement_types(building_zones, highways_dict, grid_highways)
+        _sanity_check_settlement_types(building_zones, city_block_faces, grid_highways)
         last_time = time_logging('Time used in seconds for sanity checking settlement types', last_time)
 
     _count_zones_related_buildings(osm_buildings, 'after settlement linking', True)
@@ -986,6 +992,7 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
     # =========== FINALIZE Land-use PROCESSING =============================================
     if parameters.DEBUG_PLOT_LANDUSE:
         logging.info('Start of plotting zones')
+        import osm2city.owbb.plotting as plotting  # only imported when plotting for faster start-up
         plotting.draw_zones(osm_buildings, building_zones, btg_building_zones, water_areas, lit_areas, bounds)
         time_logging("Time used in seconds for plotting", last_time)
 
@@ -1015,3 +1022,39 @@ def process(transformer: Transformation, airports: List[aptdat_io.Airport]) -> T
             logging.info("Saving of cache %s or %s failed (%s)", cache_file_la, cache_file_bz, reason)
 
     return lit_areas, water_areas, osm_buildings
+
+
+# ================ UNITTESTS =======================
+
+
+class TestCityBlockFaces(unittest.TestCase):
+    @staticmethod
+    def _old_split_zone(zone_geometry: Polygon, highways: List[LineString]) -> List[Polygon]:
+        """The difference between the zone and the union of the buffered highways as before the faces."""
+        network = None
+        for highway in highways:
+            buffered = highway.buffer(parameters.OWBB_CITY_BLOCK_HIGHWAY_BUFFER,
+                                      cap_style=CAP_STYLE.square, join_style=JOIN_STYLE.bevel)
+            network = buffered if network is None else network.union(buffered)
+        return _extract_polygons(zone_geometry.difference(network))
+
+    def test_split_zone(self):
+        highways = list()
+        for position in (100., 200.):
+            highways.append(LineString([(position, -50.), (position, 350.)]))
+            highways.append(LineString([(-50., position), (350., position)]))
+        highways.append(LineString([(200., 250.), (260., 250.)]))  # a dead end does not split a block
+        zones = [m.BuildingZone(1, box(0., 0., 300., 300.), enu.BuildingZoneType.residential),
+                 m.BuildingZone(2, Polygon([(150., 320.), (250., 320.), (250., 380.), (150., 380.)]),
+                                enu.BuildingZoneType.commercial)]  # only partly within the network
+        city_block_faces = CityBlockFaces([GridHighway(highway) for highway in highways], zones)
+
+        for zone, expected_blocks in zip(zones, (9, 1)):
+            new_blocks = city_block_faces.split_zone(zone.geometry)
+            old_blocks = self._old_split_zone(zone.geometry, highways)
+            self.assertEqual(expected_blocks, len(new_blocks))
+            self.assertEqual(len(old_blocks), len(new_blocks))
+            for old_block in old_blocks:
+                matches = [new_block for new_block in new_blocks
+                           if old_block.symmetric_difference(new_block).area < 0.01]
+                self.assertEqual(1, len(matches))
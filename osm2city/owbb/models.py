@@ -23,6 +23,7 @@ from osm2city.static_types import osmstrings as s
 from osm2city.static_types import enumerations as e
 from osm2city.utils import coordinates as co
 from osm2city.utils import json_io as wio
+from osm2city.utils import utilities
 
 
 # type aliases
@@ -1125,12 +1126,14 @@ class GenBuilding:
 
 class TempGenBuildings:
     """Stores generated buildings temporarily before validations shows that they can be committed"""
-    __slots__ = ('bounding_box', 'generated_blocked_areas', 'generated_buildings',
+    __slots__ = ('bounding_box', 'generated_blocked_areas', 'generated_grid', 'generated_buildings',
                  'blocked_areas_along_objects', 'blocked_areas_along_sequence')
 
     def __init__(self, bounding_box) -> None:
         self.bounding_box = bounding_box
         self.generated_blocked_areas = list()  # List of BlockedArea objects from temp generated buildings
+        # the same BlockedArea objects indexed for spatial tests
+        self.generated_grid = utilities.BoundsGrid(parameters.OWBB_GENERATED_GRID_SIZE)
         self.generated_buildings = list()  # List of GenBuildings
         # found at generation along specific highway
         self.blocked_areas_along_objects = dict()  # key=BlockedArea value=None
@@ -1138,6 +1141,7 @@ class TempGenBuildings:
 
     def add_generated(self, building, blocked_area):
         self.generated_blocked_areas.append(blocked_area)
+        self.generated_grid.add(blocked_area.polygon.bounds, blocked_area)
         if building.area_polygon.within(self.bounding_box):
             self.generated_buildings.append(building)
         self.blocked_areas_along_objects[blocked_area] = True
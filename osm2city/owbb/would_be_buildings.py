@@ -2,25 +2,31 @@
 """Module analyzing OSM data and generating buildings at plausible places."""
 
 import logging
+import math
+import multiprocessing as mp
+import os
 import pickle
 import random
+import tempfile
 import time
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import sys
+import unittest
 
+import numpy as np
 from shapely.geometry import box
 from shapely.geometry import LineString, MultiLineString, Polygon
+from shapely.prepared import prep
 
 import osm2city.static_types.enumerations as enu
 from osm2city import parameters
-from osm2city.owbb import plotting
 import osm2city.building_lib as bl
 import osm2city.owbb.models as m
 import osm2city.static_types.enumerations as e
 import osm2city.static_types.osmstrings as s
 import osm2city.utils.coordinates as co
 import osm2city.utils.osmparser as op
-from osm2city.utils.utilities import time_logging, random_value_from_ratio_dict_parameter
+from osm2city.utils.utilities import time_logging, random_value_from_ratio_dict_parameter, BoundsGrid, STRTreeIndex
 
 
 def _prepare_building_zone_for_building_generation(building_zone, waterways_dict, railway_lines_dict, highways_dict,
@@ -114,10 +120,46 @@ def _prepare_building_zone_with_highways(building_zone, highways_dict):
 HIGHWAYS_FOR_ZONE_SPLIT = [e.HighwayType.motorway, e.HighwayType.trunk]
 
 
+def _intersects_blocked_area(polygon: Polygon, blocked_areas_grid: BoundsGrid) -> bool:
+    """True if the polygon intersects with any of the blocked areas in the grid."""
+    for blocked_area in blocked_areas_grid.query(polygon.bounds):
+        if polygon.intersects(blocked_area.polygon):
+            return True
+    return False
+
+
+class _ZoneGenerationIndex:
+    """Accelerates the geometric tests when generating buildings within a building zone.
+
+    The blocked areas linked to the zone before the generation starts are indexed in a static STRtree.
+    The blocked areas of generated buildings committed to the zone are added incrementally to a grid."""
+    __slots__ = ('prep_geom', 'blocked_areas_index', 'committed_grid')
+
+    def __init__(self, building_zone: m.BuildingZone) -> None:
+        self.prep_geom = prep(building_zone.geometry)
+        polygons = [blocked_area.polygon for blocked_area in building_zone.linked_blocked_areas]
+        self.blocked_areas_index = STRTreeIndex(polygons, building_zone.linked_blocked_areas)
+        self.committed_grid = BoundsGrid(parameters.OWBB_GENERATED_GRID_SIZE)
+
+    def is_blocked(self, polygon: Polygon) -> bool:
+        """True if the polygon intersects with a blocked area linked to the zone."""
+        for blocked_area in self.blocked_areas_index.query(polygon):
+            if polygon.intersects(blocked_area.polygon):
+                return True
+        return _intersects_blocked_area(polygon, self.committed_grid)
+
+    def commit_temp_gen_buildings(self, building_zone: m.BuildingZone, temp_buildings: m.TempGenBuildings,
+                                  highway: m.Highway, is_reverse: bool) -> None:
+        building_zone.commit_temp_gen_buildings(temp_buildings, highway, is_reverse)
+        for blocked_area in temp_buildings.generated_blocked_areas:
+            self.committed_grid.add(blocked_area.polygon.bounds, blocked_area)
+
+
 def _generate_extra_buildings(building_zone: m.BuildingZone, shared_models_library: m.SharedModelsLibrary,
                               bounding_box: Polygon):
     """AttributeErrors are expected because not all highways have settlement zones on both sides.
     Therefore they can get ignored."""
+    zone_index = _ZoneGenerationIndex(building_zone)
     for highway in building_zone.linked_genways:
         if highway.type_ in HIGHWAYS_FOR_ZONE_SPLIT:
             continue
@@ -179,10 +221,10 @@ def _generate_extra_buildings(building_zone: m.BuildingZone, shared_models_libra
                     if highway.along_city_block.settlement_type in [enu.SettlementType.rural,
                                                                     enu.SettlementType.periphery]:
                         _generate_extra_buildings_residential(building_zone, highway, detached_houses_list,
-                                                              alternatives_list, False, bounding_box)
+                                                              alternatives_list, False, bounding_box, zone_index)
                     else:
                         _generate_extra_buildings_residential(building_zone, highway, primary_houses, None,
-                                                              False, bounding_box)
+                                                              False, bounding_box, zone_index)
                 except AttributeError:
                     pass
                 # reverse
@@ -190,105 +232,186 @@ def _generate_extra_buildings(building_zone: m.BuildingZone, shared_models_libra
                     if highway.reversed_city_block.settlement_type in [enu.SettlementType.rural,
                                                                        enu.SettlementType.periphery]:
                         _generate_extra_buildings_residential(building_zone, highway, detached_houses_list,
-                                                              alternatives_list, True, bounding_box)
+                                                              alternatives_list, True, bounding_box, zone_index)
                     else:
                         _generate_extra_buildings_residential(building_zone, highway, primary_houses, None,
-                                                              True, bounding_box)
+                                                              True, bounding_box, zone_index)
                 except AttributeError:
                     pass
 
         else:  # elif landuse.type_ is Landuse.TYPE_INDUSTRIAL:
-            _generate_extra_buildings_industrial(building_zone, highway, shared_models_library, False, bounding_box)
-            _generate_extra_buildings_industrial(building_zone, highway, shared_models_library, True, bounding_box)
+            _generate_extra_buildings_industrial(building_zone, highway, shared_models_library, False, bounding_box,
+                                                 zone_index)
+            _generate_extra_buildings_industrial(building_zone, highway, shared_models_library, True, bounding_box,
+                                                 zone_index)
 
 
 def _generate_extra_buildings_residential(building_zone: m.BuildingZone, highway: m.Highway,
                                           primary_houses_list: List[m.SharedModel],
                                           alternatives_list: Optional[List[m.SharedModel]],
-                                          is_reverse: bool, bounding_box: m.Polygon):
+                                          is_reverse: bool, bounding_box: m.Polygon,
+                                          zone_index: _ZoneGenerationIndex):
     my_settlement_type = highway.along_city_block.settlement_type
     if is_reverse:
         my_settlement_type = highway.reversed_city_block.settlement_type
     if alternatives_list:
         temp_buildings = m.TempGenBuildings(bounding_box)
         _generate_buildings_along_highway(building_zone, my_settlement_type,
-                                          highway, alternatives_list, is_reverse, temp_buildings)
+                                          highway, alternatives_list, is_reverse, temp_buildings, zone_index)
         if 0 < temp_buildings.validate_uninterrupted_sequence(parameters.OWBB_RESIDENTIAL_HIGHWAY_MIN_GEN_SHARE,
                                                               parameters.OWBB_RESIDENTIAL_TERRACE_MIN_NUMBER):
-            building_zone.commit_temp_gen_buildings(temp_buildings, highway, is_reverse)
+            zone_index.commit_temp_gen_buildings(building_zone, temp_buildings, highway, is_reverse)
             return  # we do not want to spoil row houses with other houses to fill up
 
     # start from scratch - either because terrace not chosen or not successfully validated
     temp_buildings = m.TempGenBuildings(bounding_box)
     _generate_buildings_along_highway(building_zone, my_settlement_type,
-                                      highway, primary_houses_list, is_reverse, temp_buildings)
+                                      highway, primary_houses_list, is_reverse, temp_buildings, zone_index)
     if temp_buildings.validate_min_share_generated(parameters.OWBB_RESIDENTIAL_HIGHWAY_MIN_GEN_SHARE):
-        building_zone.commit_temp_gen_buildings(temp_buildings, highway, is_reverse)
+        zone_index.commit_temp_gen_buildings(building_zone, temp_buildings, highway, is_reverse)
 
 
 def _generate_extra_buildings_industrial(building_zone: m.BuildingZone, highway: m.Highway,
                                          shared_models_library: m.SharedModelsLibrary,
-                                         is_reverse: bool, bounding_box: Polygon):
+                                         is_reverse: bool, bounding_box: Polygon,
+                                         zone_index: _ZoneGenerationIndex):
     temp_buildings = m.TempGenBuildings(bounding_box)
     if random.random() <= parameters.OWBB_INDUSTRIAL_LARGE_SHARE:
         shared_models_list = shared_models_library.industrial_buildings_large
         _generate_buildings_along_highway(building_zone, building_zone.settlement_type,
-                                          highway, shared_models_list, is_reverse, temp_buildings)
+                                          highway, shared_models_list, is_reverse, temp_buildings, zone_index)
 
     shared_models_list = shared_models_library.industrial_buildings_small
     _generate_buildings_along_highway(building_zone, building_zone.settlement_type,
-                                      highway, shared_models_list, is_reverse, temp_buildings)
-    building_zone.commit_temp_gen_buildings(temp_buildings, highway, is_reverse)
+                                      highway, shared_models_list, is_reverse, temp_buildings, zone_index)
+    zone_index.commit_temp_gen_buildings(building_zone, temp_buildings, highway, is_reverse)
 
 
 def _generate_buildings_along_highway(building_zone: m.BuildingZone, settlement_type: enu.SettlementType,
                                       highway: m.Highway,
                                       shared_models_list: List[m.SharedModel], is_reverse: bool,
-                                      temp_buildings: m.TempGenBuildings):
+                                      temp_buildings: m.TempGenBuildings, zone_index: _ZoneGenerationIndex):
     """
     The central assumption is that existing blocked areas incl. buildings du not need a buffer.
     The to be populated buildings all bring their own constraints with regards to distance to road, distance to other
     buildings etc.
 
+    The points along the highway are calculated in one go for all steps. The tests against the zone and blocked
+    areas use the zone_index and the grid of the temp_buildings instead of looping over all blocked areas.
+
     Returns a TempGenBuildings object with all potential new generated buildings
     """
-    travelled_along = 0
     highway_length = highway.geometry.length
     my_gen_building = m.GenBuilding(op.get_next_pseudo_osm_id(op.OSMFeatureType.building_owbb),
                                     random.choice(shared_models_list), highway.get_width(), settlement_type)
-    if not is_reverse:
-        point_on_line = highway.geometry.interpolate(0)
-    else:
-        point_on_line = highway.geometry.interpolate(highway_length)
-    while travelled_along < highway_length:
-        travelled_along += parameters.OWBB_STEP_DISTANCE
-        prev_point_on_line = point_on_line
-        if not is_reverse:
-            point_on_line = highway.geometry.interpolate(travelled_along)
-        else:
-            point_on_line = highway.geometry.interpolate(highway_length - travelled_along)
-        angle = co.calc_angle_of_line_local(prev_point_on_line.x, prev_point_on_line.y,
-                                            point_on_line.x, point_on_line.y)
+    number_of_steps = int(math.ceil(highway_length / parameters.OWBB_STEP_DISTANCE))
+    distances = np.arange(number_of_steps + 1) * float(parameters.OWBB_STEP_DISTANCE)
+    if is_reverse:
+        distances = highway_length - distances
+    points_on_line = co.calc_points_along_line_local(highway.geometry.coords, distances).tolist()
+    for index in range(1, len(points_on_line)):
+        prev_x, prev_y = points_on_line[index - 1]
+        point_on_line = co.Vec2d(points_on_line[index])
+        angle = co.calc_angle_of_line_local(prev_x, prev_y, point_on_line.x, point_on_line.y)
         buffer_polygon = my_gen_building.get_a_polygon(True, point_on_line, angle)
-        if buffer_polygon.within(building_zone.geometry):
-            valid_new_gen_building = True
-            for blocked_area in building_zone.linked_blocked_areas:
-                if buffer_polygon.intersects(blocked_area.polygon):
-                    valid_new_gen_building = False
-                    break
-            if valid_new_gen_building:
-                for blocked_area in temp_buildings.generated_blocked_areas:
-                    if buffer_polygon.intersects(blocked_area.polygon):
-                        valid_new_gen_building = False
-                        break
-            if valid_new_gen_building:
-                area_polygon = my_gen_building.get_a_polygon(False, point_on_line, angle)
-                my_gen_building.set_location(point_on_line, angle, area_polygon, buffer_polygon)
-                temp_buildings.add_generated(my_gen_building, m.BlockedArea(m.BlockedAreaType.gen_building,
-                                                                            area_polygon))
-                # prepare a new building, which might get added in the next loop
-                my_gen_building = m.GenBuilding(op.get_next_pseudo_osm_id(op.OSMFeatureType.building_owbb),
-                                                random.choice(shared_models_list), highway.get_width(), settlement_type)
+        if zone_index.prep_geom.contains(buffer_polygon):
+            if zone_index.is_blocked(buffer_polygon) or _intersects_blocked_area(buffer_polygon, temp_buildings.generated_grid):
+                continue
+            area_polygon = my_gen_building.get_a_polygon(False, point_on_line, angle)
+            my_gen_building.set_location(point_on_line, angle, area_polygon, buffer_polygon)
+            temp_buildings.add_generated(my_gen_building, m.BlockedArea(m.BlockedAreaType.gen_building,
+                                                                        area_polygon))
+            # prepare a new building, which might get added in the next loop
+            my_gen_building = m.GenBuilding(op.get_next_pseudo_osm_id(op.OSMFeatureType.building_owbb),
+                                            random.choice(shared_models_list), highway.get_width(), settlement_type)
+
+
+# The inputs common to all zones of a tile - set once per process instead of being sent with each zone
+_generation_models = None  # SharedModelsLibrary
+_generation_bounding_box = None  # Polygon
+
+
+def _set_generation_inputs(shared_models_library: m.SharedModelsLibrary, bounding_box: Polygon) -> None:
+    global _generation_models, _generation_bounding_box
+    _generation_models = shared_models_library
+    _generation_bounding_box = bounding_box
+
+
+def _init_generation_process(parameter_values: Dict[str, Any], shared_models_library: m.SharedModelsLibrary,
+                             bounding_box: Polygon) -> None:
+    """Makes sure that a worker process uses the same parameters as the process starting it (e.g. if spawned)."""
+    for key, value in parameter_values.items():
+        setattr(parameters, key, value)
+    _set_generation_inputs(shared_models_library, bounding_box)
+
+
+def _generate_extra_buildings_for_zone(building_zone: m.BuildingZone,
+                                       seed: str) -> Tuple[List[Tuple[m.GenBuilding, int]], List[m.BlockedArea]]:
+    """Generates the buildings for one building zone with its own random seed - potentially in a worker process.
+
+    In order not to send the whole zone back to the calling process, the generated buildings are returned without
+    the link to the zone but with the position of the city block they belong to (-1 for the zone itself).
+    Also the blocked areas added to the zone are returned."""
+    random.seed(seed)
+    number_blocked_areas = len(building_zone.linked_blocked_areas)
+    _generate_extra_buildings(building_zone, _generation_models, _generation_bounding_box)
+    city_block_positions = dict()  # id of CityBlock, position in linked_city_blocks
+    for position, city_block in enumerate(building_zone.linked_city_blocks):
+        city_block_positions[id(city_block)] = position
+    generated = list()
+    for gen_building in building_zone.generated_buildings:
+        generated.append((gen_building, city_block_positions.get(id(gen_building.zone), -1)))
+        gen_building.zone = None
+    return generated, building_zone.linked_blocked_areas[number_blocked_areas:]
+
+
+def _generate_extra_buildings_parallel(building_zones: List[m.BuildingZone],
+                                       shared_models_library: m.SharedModelsLibrary, bounding_box: Polygon) -> None:
+    """Generates buildings for the building zones - using a pool of processes if
+    parameters.OWBB_GENERATE_BUILDINGS_PROCESSES is larger than 1 - and merges the results back.
+
+    Each zone gets a random seed based on the tile and the zone's position in the list, such that the result does
+    not depend on the number of processes. The pseudo OSM ids of the generated buildings are re-assigned in the
+    sequence of the zones.
+    Processes in a pool cannot have their own children. Therefore the zones are processed one by one (with the same
+    seeds) if running e.g. within build_tiles with more than one process."""
+    tile_name = parameters.get_tile_cache_name()
+    numbers_blocked_areas = [len(b_zone.linked_blocked_areas) for b_zone in building_zones]
+    zone_args = [(b_zone, '{}_{}'.format(tile_name, position)) for position, b_zone in enumerate(building_zones)]
+
+    if parameters.OWBB_GENERATE_BUILDINGS_PROCESSES > 1 and mp.current_process().daemon:
+        logging.info('Generating buildings zone by zone, because already running in a pool of processes')
+    if parameters.OWBB_GENERATE_BUILDINGS_PROCESSES < 2 or mp.current_process().daemon:
+        # the seeds per zone must not change the random state of the following processing - and the pseudo ids
+        # used during generation get re-assigned below as if generated in another process
+        random_state = random.getstate()
+        pseudo_osm_id = op.PSEUDO_OSM_ID
+        _set_generation_inputs(shared_models_library, bounding_box)
+        try:
+            results = [_generate_extra_buildings_for_zone(*args) for args in zone_args]
+        finally:
+            _set_generation_inputs(None, None)
+            random.setstate(random_state)
+            op.PSEUDO_OSM_ID = pseudo_osm_id
+    else:
+        parameter_values = {key: value for key, value in vars(parameters).items() if key.isupper()}
+        with mp.Pool(processes=parameters.OWBB_GENERATE_BUILDINGS_PROCESSES, initializer=_init_generation_process,
+                     initargs=(parameter_values, shared_models_library, bounding_box)) as pool:
+            results = pool.starmap(_generate_extra_buildings_for_zone, zone_args)
+
+    # merge the results back into the zones of this process
+    for b_zone, number_blocked_areas, (generated, blocked_areas) in zip(building_zones, numbers_blocked_areas,
+                                                                          results):
+        del b_zone.linked_blocked_areas[number_blocked_areas:]
+        b_zone.linked_blocked_areas.extend(blocked_areas)
+        b_zone.generated_buildings = list()
+        for gen_building, city_block_position in generated:
+            gen_building.gen_id = op.get_next_pseudo_osm_id(op.OSMFeatureType.building_owbb)
+            if city_block_position < 0:
+                gen_building.zone = b_zone
+            else:
+                gen_building.zone = b_zone.linked_city_blocks[city_block_position]
+            b_zone.generated_buildings.append(gen_building)
 
 
 def _read_building_models_library() -> List[m.BuildingModel]:
@@ -413,8 +536,7 @@ def process(transformer: co.Transformation, building_zones: List[m.BuildingZone]
     last_time = time.time()
 
     # =========== TRY TO READ CACHED DATA FIRST =======
-    tile_index = parameters.get_tile_index()
-    cache_file = str(tile_index) + '_generated_buildings.pkl'
+    cache_file = parameters.get_tile_cache_name() + '_generated_buildings.pkl'
     if parameters.OWBB_GENERATED_BUILDINGS_CACHE:
         try:
             with open(cache_file, 'rb') as file_pickle:
@@ -488,10 +610,11 @@ def process(transformer: co.Transformation, building_zones: List[m.BuildingZone]
         b_zone.link_city_blocks_to_highways()
     last_time = time_logging("Time used in seconds for preparing building zones for building generation", last_time)
 
+    _generate_extra_buildings_parallel(used_zones, shared_models_library, bounding_box)
+
     building_zones = list()  # will be filled again with used_zones out of the parallel processes
     preliminary_buildings = list()
     for b_zone in used_zones:
-        _generate_extra_buildings(b_zone, shared_models_library, bounding_box)
         building_zones.append(b_zone)
         logging.debug("Generated %d buildings for building zone %d", len(b_zone.generated_buildings),
                       b_zone.osm_id)
@@ -503,6 +626,7 @@ def process(transformer: co.Transformation, building_zones: List[m.BuildingZone]
 
     if parameters.DEBUG_PLOT_GENBUILDINGS:
         logging.info('Start of plotting buildings')
+        from osm2city.owbb import plotting  # only imported when plotting for faster start-up
         plotting.draw_buildings(building_zones, bounds)
         time_logging("Time used in seconds for plotting", last_time)
 
@@ -522,3 +646,47 @@ def process(transformer: co.Transformation, building_zones: List[m.BuildingZone]
             logging.info("Saving of cache %s failed (%s)", cache_file, reason)
 
     return generated_buildings
+
+
+# ================ UNITTESTS =======================
+
+
+class TestGenerateBuildings(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = parameters.take_snapshot()
+
+    def tearDown(self):
+        op.set_data_source(None)
+        parameters.apply_snapshot(self.snapshot)
+
+    @staticmethod
+    def _generate(processes: int) -> Tuple[List[Tuple[int, float, float]], float]:
+        """Returns the pseudo id and position of the generated buildings as well as the next random value after
+        the processing, which must not depend on the seeds used per zone."""
+        from osm2city.benchmark import fixtures
+        import osm2city.owbb.landuse as lu
+        with tempfile.TemporaryDirectory() as work_directory:
+            fixtures.configure_parameters(work_directory, 3)
+            parameters.OWBB_GENERATE_BUILDINGS = True
+            parameters.OWBB_GENERATE_BUILDINGS_PROCESSES = processes
+            transformer = co.Transformation(parameters.get_center_global())
+            op.set_data_source(fixtures.create_town(transformer, 3, single_zone=True))
+            op.PSEUDO_OSM_ID = -1  # such that the pseudo ids do not depend on tests run before
+            random.seed(42)
+            current_directory = os.getcwd()
+            os.chdir(work_directory)
+            try:
+                fixtures.write_btg(transformer, fixtures.town_extent(3))
+                fixtures.write_textures()
+                _, _, buildings = lu.process(transformer, list())
+            finally:
+                os.chdir(current_directory)
+        generated = [(b.osm_id, round(b.polygon.centroid.x, 3), round(b.polygon.centroid.y, 3)) for b in buildings
+                     if b.is_owbb_model]
+        return generated, random.random()
+
+    def test_independent_of_processes(self):
+        sequential, random_value = self._generate(1)
+        self.assertTrue(len(sequential) > 0)
+        self.assertEqual((sequential, random_value), self._generate(2))
+        self.assertEqual((sequential, random_value), self._generate(3))
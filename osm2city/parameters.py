@@ -13,8 +13,10 @@ Ludomotico contributed a cleaner version of read_from_file().
 """
 
 import argparse
+import copy
 import logging
 import math
+import pickle
 import sys
 import traceback
 import types
@@ -44,6 +46,10 @@ BOUNDARY_WEST = 9.54
 BOUNDARY_SOUTH = 47.48
 BOUNDARY_EAST = 9.58
 BOUNDARY_NORTH = 47.50
+# The part of the tile (0 if the tile is processed as a whole) and the number of parts the tile is split into.
+# Set dynamically by build_tiles.py.
+TILE_PART = 0
+TILE_PARTS = 1
 
 AREA = ''  # Not used in the code - use it in your parameters.py for conditional parameters
 
@@ -71,6 +77,8 @@ DB_USER = "gisuser"  # The name of the user to be used to read from the database
 DB_USER_PASSWORD = "n/a"  # The password for the DB_USER.
 
 NO_ELEV = False             # -- skip elevation probing
+ELEV_PROVIDER = 'fgelev'  # how elevation is probed: 'fgelev', 'analytic' (hills for tests/previews) or 'heightmap'
+ELEV_HEIGHTMAP_FILE = None  # the .npz file used if ELEV_PROVIDER = 'heightmap'
 FG_ELEV = '"D:/Program Files/FlightGear/bin/Win64/fgelev.exe"'
 FG_ELEV_CACHE = True  # saves the elevation probing results to a file, so next rerun is faster (but uses disk space!)
 PROBE_FOR_WATER = True  # only possible with FGElev version after 9th of November 2016 / FG 2016.4.1
@@ -80,6 +88,19 @@ CLUSTER_DIMENSION = 4000
 
 WRITE_CLUSTER_STATS = False
 
+STG_WRITE_FRAGMENTS = False  # write stg-files as fragments per tile without locking and merge them at the end
+WRITE_BEHIND_THREADS = 1  # number of threads writing ac-files etc. in the background. 0 writes directly
+WRITE_BEHIND_QUEUE_SIZE = 4  # max number of files waiting to be written in the background
+WRITE_SKIP_UNCHANGED = False  # do not rewrite ac-, list- and stg-files with unchanged content; write manifests
+TILE_SPLIT_THRESHOLD_SECONDS = 3600  # build_tiles.py splits tiles which took longer in a previous run. 0 never splits
+TILE_SPLIT_THRESHOLD_WAYS = 100000  # build_tiles.py splits tiles with more buildings and highways. 0 never splits
+TILE_SPLIT_MAX_DIVISIONS = 3  # a tile is split in at most n x n parts
+PROFILE_DIRECTORY = None  # write cProfile .pstats files per tile and procedure to this directory
+PROFILE_TILES = []  # indices of the tiles to profile. An empty list profiles all tiles
+PROFILE_PROCEDURES = []  # procedures to profile (e.g. ['owbb', 'roads']). An empty list profiles all procedures
+PROFILE_MEMORY = False  # report the peak memory and top allocations per procedure with tracemalloc
+PROFILE_MEMORY_TOP = 10  # the number of source lines with the most allocated memory to report
+
 FLAG_STG_BUILDING_LIST = False  # use BUILDING_LIST in stg-files in 2019.2+ format
 FLAG_BUILDINGS_LIST_SKIP = False
 FLAG_BUILDINGS_MESH_SKIP = False
@@ -109,6 +130,7 @@ DEBUG_PLOT_OFFSETS = False
 OVERLAP_CHECK_CONVEX_HULL = True
 OVERLAP_CHECK_CH_BUFFER_STATIC = 0.0
 OVERLAP_CHECK_CH_BUFFER_SHARED = 0.0
+OVERLAP_CHECK_HULL_CACHE = True  # saves the convex hulls of referenced models to a file, so next rerun is faster
 
 OVERLAP_CHECK_CONSIDER_SHARED = True
 
@@ -384,7 +406,9 @@ OWBB_GRID_SIZE = 2000
 
 OWBB_GENERATED_BUILDINGS_CACHE = False  # has only effect if OWBB_LANDUSE_CACHE = False
 OWBB_GENERATE_BUILDINGS = False
+OWBB_GENERATE_BUILDINGS_PROCESSES = 1  # more than 1 generates the buildings of zones in parallel
 OWBB_STEP_DISTANCE = 2  # in meters
+OWBB_GENERATED_GRID_SIZE = 100  # in meters; cell size of the grid index for generated buildings
 OWBB_MIN_STREET_LENGTH = 10  # in meters
 OWBB_MIN_CITY_BLOCK_AREA = 200  # square meters
 OWBB_CITY_BLOCK_HIGHWAY_BUFFER = 3  # in metres buffer around highways to find city blocks
@@ -461,6 +485,15 @@ def get_tile_index() -> int:
     return ct.calc_tile_index((lon_lat.lon, lon_lat.lat))
 
 
+def get_tile_cache_name(tile_index: int = None) -> str:
+    """The start of the names of cache files for the current tile - includes the part if the tile is split."""
+    if tile_index is None:
+        tile_index = get_tile_index()
+    if TILE_PART:
+        return '{}_{}'.format(tile_index, TILE_PART)
+    return str(tile_index)
+
+
 def get_clipping_border():
     rect = [(BOUNDARY_WEST, BOUNDARY_SOUTH),
             (BOUNDARY_EAST, BOUNDARY_SOUTH),
@@ -623,6 +656,59 @@ def set_boundary(boundary_west: float, boundary_south: float,
     BOUNDARY_NORTH = boundary_north
 
 
+def _is_parameter(name: str, value) -> bool:
+    """Parameters are the upper case module globals - not e.g. imported modules or functions."""
+    if name.startswith('_') or name != name.upper():
+        return False
+    return not (isinstance(value, type) or isinstance(value, types.FunctionType) or
+                isinstance(value, types.ModuleType))
+
+
+class Snapshot(object):
+    """An immutable and picklable copy of all parameters, e.g. taken once in the main process after
+    read_from_file() and then applied per scenery tile in the worker processes with apply_snapshot() - instead of
+    reading and validating the parameters file again for each tile."""
+    __slots__ = ('_values',)
+
+    def __init__(self, values: typing.Dict[str, typing.Any]) -> None:
+        object.__setattr__(self, '_values', copy.deepcopy(values))
+
+    def __getattr__(self, name: str):
+        try:
+            return copy.deepcopy(self._values[name])  # a copy such that the snapshot cannot be changed by accident
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError('A parameters snapshot cannot be changed')
+
+    def __reduce__(self):
+        return Snapshot, (self._values,)
+
+    def names(self) -> typing.List[str]:
+        return sorted(self._values.keys())
+
+    def replace(self, **values) -> 'Snapshot':
+        """A copy of the snapshot with some parameters changed - e.g. to process a tile again with reduced options."""
+        for name in values:
+            if name not in self._values:
+                raise AttributeError(name)
+        changed = dict(self._values)
+        changed.update(values)
+        return Snapshot(changed)
+
+
+def take_snapshot() -> Snapshot:
+    """Takes a snapshot of the current values of all parameters."""
+    return Snapshot({k: v for k, v in globals().items() if _is_parameter(k, v)})
+
+
+def apply_snapshot(snapshot: Snapshot) -> None:
+    """Resets all parameters to the values in the snapshot.
+    Tile specific values like the boundary are applied afterwards - e.g. with set_boundary()."""
+    globals().update(copy.deepcopy(snapshot._values))
+
+
 if __name__ == "__main__":
     # Handling arguments and parameters
     parser = argparse.ArgumentParser(
@@ -666,3 +752,29 @@ class TestParameters(unittest.TestCase):
             _check_ratio_dict_parameter(my_ratio_dict, 'my_ratio_dict')
         my_ratio_dict = {1: 0.01, 2: 0.99}
         self.assertEqual(2, len(my_ratio_dict), 'Length correct and no exception')
+
+    def test_snapshot(self):
+        global PREFIX
+        global BUILDING_ROOF_SHAPE_RATIO
+        original_prefix = PREFIX
+        original_ratio = copy.deepcopy(BUILDING_ROOF_SHAPE_RATIO)
+        snapshot = pickle.loads(pickle.dumps(take_snapshot()))
+        self.assertIn('BUILDING_ROOF_SHAPE_RATIO', snapshot.names())
+        self.assertNotIn('Snapshot', snapshot.names())
+        self.assertNotIn('co', snapshot.names())
+        with self.assertRaises(AttributeError):
+            snapshot.PREFIX = 'changed'
+        snapshot.BUILDING_ROOF_SHAPE_RATIO.clear()
+        self.assertEqual(original_ratio, snapshot.BUILDING_ROOF_SHAPE_RATIO)
+
+        PREFIX = 'changed'
+        BUILDING_ROOF_SHAPE_RATIO.clear()
+        apply_snapshot(snapshot)
+        self.assertEqual(original_prefix, PREFIX)
+        self.assertEqual(original_ratio, BUILDING_ROOF_SHAPE_RATIO)
+
+        reduced = snapshot.replace(BUILDING_COMPLEX_ROOFS=False)
+        self.assertFalse(reduced.BUILDING_COMPLEX_ROOFS)
+        self.assertTrue(snapshot.BUILDING_COMPLEX_ROOFS)
+        with self.assertRaises(AttributeError):
+            snapshot.replace(NO_SUCH_PARAMETER=1)
@@ -42,7 +42,7 @@ class Pier:
         self.nodes = np.array([transform.to_local((n.lon, n.lat)) for n in self.osm_nodes])
         self.anchor = co.Vec2d(self.nodes[0])
 
-    def calc_elevation(self, fg_elev: utilities.FGElev) -> None:
+    def calc_elevation(self, fg_elev: utilities.ElevationProvider) -> None:
         """Calculates the elevation (level above sea) as a minimum of all nodes.
 
         Minimum is taken because there could be residuals from shore in FlightGear scenery.
@@ -40,6 +40,9 @@ ROOFS_DEFAULT_FILE_NAME = "roofs_default.py"
 roofs = None  # RoofManager
 facades = None  # FacadeManager
 specials = None  # SpecialManager
+# file name and modification time of the pickle file read into the managers plus the atlas file name read from it,
+# such that the pickle file is not read again for every tile processed within the same process
+_loaded_pkl_file = None
 
 # Hard-coded constants for the texture atlas. If they are changed, then maybe all sceneries in Terrasync need
 # to be recreated -> therefore not configurable. Numbers are in pixels (need to be factor 2).
@@ -141,9 +144,9 @@ def _make_per_texture_type(texture_list: List[Texture], the_atlas: atlas.Atlas,
 
         nx = int(org_size[0] * scale_x)
         ny = int(org_size[1] * scale_y)
-        tex.im = tex.im.resize((nx, ny), Image.ANTIALIAS)
+        tex.im = tex.im.resize((nx, ny), Image.LANCZOS)
         if tex.im_LM:
-            tex.im_LM = tex.im_LM.resize((nx, ny), Image.ANTIALIAS)
+            tex.im_LM = tex.im_LM.resize((nx, ny), Image.LANCZOS)
         logging.debug("scale:" + str(org_size) + str(tex.im.size))
         atlas_sy += tex.im.size[1] + pad_y
         tex.width_px, tex.height_px = tex.im.size
@@ -270,6 +273,7 @@ def init(stats: util.Stats, mode: InitMode=InitMode.read) -> None:
     global facades
     global specials
     global atlas_file_name
+    global _loaded_pkl_file
 
     atlas_file_name = os.path.join("tex", "atlas_facades")
     my_tex_prefix_src = os.path.join(parameters.PATH_TO_OSM2CITY_DATA, 'tex.src')
@@ -307,19 +311,26 @@ def init(stats: util.Stats, mode: InitMode=InitMode.read) -> None:
         pickle.dump(specials, pickle_file, -1)
         pickle.dump(params, pickle_file, -1)
         pickle_file.close()
+        _loaded_pkl_file = None
 
         logging.info(str(roofs))
         logging.info(str(facades))
         logging.info(str(specials))
     else:
-        logging.info("Loading %s", pkl_file_name)
-        pickle_file = open(pkl_file_name, 'rb')
-        roofs = pickle.load(pickle_file)
-        facades = pickle.load(pickle_file)
-        specials = pickle.load(pickle_file)
-        params = pickle.load(pickle_file)
-        atlas_file_name = params['atlas_file_name']
-        pickle_file.close()
+        pkl_file = (pkl_file_name, os.path.getmtime(pkl_file_name))
+        if _loaded_pkl_file is not None and pkl_file == _loaded_pkl_file[:2]:
+            logging.info("Reusing textures already loaded from %s", pkl_file_name)
+            atlas_file_name = _loaded_pkl_file[2]
+        else:
+            logging.info("Loading %s", pkl_file_name)
+            pickle_file = open(pkl_file_name, 'rb')
+            roofs = pickle.load(pickle_file)
+            facades = pickle.load(pickle_file)
+            specials = pickle.load(pickle_file)
+            params = pickle.load(pickle_file)
+            atlas_file_name = params['atlas_file_name']
+            pickle_file.close()
+            _loaded_pkl_file = pkl_file + (atlas_file_name,)
 
     stats.textures_total = dict((filename, 0) for filename in map((lambda x: x.filename), roofs.get_list()))
     stats.textures_total.update(dict((filename, 0) for filename in map((lambda x: x.filename), facades.get_list())))
@@ -301,7 +301,7 @@ class SharedPylon(object):
         self.needs_stg_entry = True
         self.direction_type = PylonDirectionType.normal  # correction for which direction mast looks at
 
-    def calc_global_coordinates(self, fg_elev: utilities.FGElev, my_coord_transformator) -> None:
+    def calc_global_coordinates(self, fg_elev: utilities.ElevationProvider, my_coord_transformator) -> None:
         self.lon, self.lat = my_coord_transformator.to_global((self.x, self.y))
         self.elevation = fg_elev.probe_elev((self.lon, self.lat), True)
 
@@ -372,7 +372,7 @@ class Chimney(SharedPylon):
 
 
 def _process_osm_chimneys_nodes(osm_nodes_dict: Dict[int, op.Node], coords_transform: co.Transformation,
-                                fg_elev: utilities.FGElev) -> List[Chimney]:
+                                fg_elev: utilities.ElevationProvider) -> List[Chimney]:
     chimneys = list()
 
     for key, node in osm_nodes_dict.items():
@@ -385,7 +385,7 @@ def _process_osm_chimneys_nodes(osm_nodes_dict: Dict[int, op.Node], coords_trans
 
 
 def _process_osm_chimneys_ways(nodes_dict, ways_dict, my_coord_transformator,
-                               fg_elev: utilities.FGElev) -> List[Chimney]:
+                               fg_elev: utilities.ElevationProvider) -> List[Chimney]:
     chimneys = list()
     for way in list(ways_dict.values()):
         for key in way.tags:
@@ -584,7 +584,8 @@ class WindFarm(object):
 
 
 def _process_osm_wind_turbines(osm_nodes_dict: Dict[int, op.Node], coords_transform: co.Transformation,
-                               fg_elev: utilities.FGElev, stg_entries: List[stg_io2.STGEntry]) -> List[WindTurbine]:
+                               fg_elev: utilities.ElevationProvider,
+                               stg_entries: List[stg_io2.STGEntry]) -> List[WindTurbine]:
     my_wind_turbines = list()
     wind_farms = list()
 
@@ -707,7 +708,7 @@ class StreetlampWay(LineWithoutCables):
             return False
         return True
 
-    def calc_and_map(self, fg_elev: utilities.FGElev, my_coord_transformator):
+    def calc_and_map(self, fg_elev: utilities.ElevationProvider, my_coord_transformator):
         if self.highway.is_roundabout:
             shared_pylon = SharedPylon()
             shared_pylon.pylon_model = "Models/StreetFurniture/Streetlamp3.xml"
@@ -988,7 +989,7 @@ class RailLine(Line):
         self.nodes = []  # RailNodes
         self.linear = None  # The LineaString of the line
 
-    def calc_and_map(self, fg_elev: utilities.FGElev, my_coord_transformator, rail_lines_list):
+    def calc_and_map(self, fg_elev: utilities.ElevationProvider, my_coord_transformator, rail_lines_list):
         self.shared_pylons = []  # array of RailMasts
         current_distance = 0  # the distance from the origin of the current mast
         my_length = self.linear.length  # omit recalculating length all the time
@@ -1110,7 +1111,7 @@ class RailLine(Line):
         return is_right
 
 
-def process_osm_rail_overhead(fg_elev: utilities.FGElev, my_coord_transformator) -> List[RailLine]:
+def process_osm_rail_overhead(fg_elev: utilities.ElevationProvider, my_coord_transformator) -> List[RailLine]:
     osm_way_result = op.fetch_osm_db_data_ways_keys([s.K_RAILWAY])
     nodes_dict = osm_way_result.nodes_dict
     ways_dict = osm_way_result.ways_dict
@@ -1199,7 +1200,7 @@ def process_osm_rail_overhead(fg_elev: utilities.FGElev, my_coord_transformator)
     return my_railways
 
 
-def process_osm_power_aerialway(req_keys: List[str], fg_elev: utilities.FGElev, my_coord_transformator,
+def process_osm_power_aerialway(req_keys: List[str], fg_elev: utilities.ElevationProvider, my_coord_transformator,
                                 building_refs: List[shg.Polygon]) -> Tuple[List[WayLine], List[WayLine]]:
     """
     Transforms a dict of Node and a dict of Way OSMElements from op.py to a dict of WayLine objects for
@@ -1484,8 +1485,7 @@ def write_cable_clusters(cluster_container: cluster.ClusterContainer, coords_tra
                     cable.translate_vertices_relative(cl.center.x, cl.center.y, 0)
                     ac_file_lines.append(cable.make_ac_entry(mat.Material.cable.value))
 
-            with open(os.path.join(path_to_stg, cluster_filename), 'w') as f:
-                f.write("\n".join(ac_file_lines))
+            my_stg_mgr.write_text_file("\n".join(ac_file_lines), os.path.join(path_to_stg, cluster_filename))
 
 
 def write_stg_entries_pylons_for_line(my_stg_mgr, lines_list: List[Line]) -> None:
@@ -1555,7 +1555,7 @@ def _optimize_catenary(half_distance_pylons: float, max_value: float, sag: float
     return -1, -1
 
 
-def process_osm_building_refs(my_coord_transformator, fg_elev: utilities.FGElev,
+def process_osm_building_refs(my_coord_transformator, fg_elev: utilities.ElevationProvider,
                               storage_tanks: List[StorageTank]) -> List[shg.Polygon]:
     """Takes all buildings to be used as potential blocking areas. At the same time processes storage tanks.
     Storage tanks are in OSM mapped as buildings, but with special tags. In FG use shared model.
@@ -1743,7 +1743,7 @@ def process_highways_for_streetlamps(my_highways: Dict[int, Highway], lit_areas:
     return list(my_streetlamps.values())
 
 
-def process_pylons(coords_transform: co.Transformation, fg_elev: utilities.FGElev,
+def process_pylons(coords_transform: co.Transformation, fg_elev: utilities.ElevationProvider,
                    stg_entries: List[stg_io2.STGEntry],
                    file_lock: mp.Lock = None) -> None:
     # Transform to real objects
@@ -1794,27 +1794,30 @@ def process_pylons(coords_transform: co.Transformation, fg_elev: utilities.FGEle
     stg_manager = stg_io2.STGManager(parameters.get_output_path(), stg_io2.SceneryType.pylons, PYLONS_MAGIC,
                                      parameters.PREFIX)
 
-    # Write to FlightGear
-    lmin, lmax = parameters.get_extent_local(coords_transform)
-    cluster_container = cluster.ClusterContainer(lmin, lmax, stg_io2.STGVerbType.object_building_mesh_detailed)
-
-    if parameters.C2P_PROCESS_POWERLINES:
-        distribute_way_segments_to_clusters(powerlines, cluster_container)
-        write_stg_entries_pylons_for_line(stg_manager, powerlines)
-
-    write_cable_clusters(cluster_container, coords_transform, stg_manager)
-
-    if parameters.C2P_PROCESS_WIND_TURBINES:
-        for turbine in wind_turbines:
-            turbine.make_stg_entry(stg_manager)
-    if parameters.C2P_PROCESS_STORAGE_TANKS:
-        for tank in storage_tanks:
-            tank.make_stg_entry(stg_manager)
-    if parameters.C2P_PROCESS_CHIMNEYS:
-        for chimney in chimneys:
-            chimney.make_stg_entry(stg_manager)
-
-    stg_manager.write(file_lock)
+    try:
+        # Write to FlightGear
+        lmin, lmax = parameters.get_extent_local(coords_transform)
+        cluster_container = cluster.ClusterContainer(lmin, lmax, stg_io2.STGVerbType.object_building_mesh_detailed)
+
+        if parameters.C2P_PROCESS_POWERLINES:
+            distribute_way_segments_to_clusters(powerlines, cluster_container)
+            write_stg_entries_pylons_for_line(stg_manager, powerlines)
+
+        write_cable_clusters(cluster_container, coords_transform, stg_manager)
+
+        if parameters.C2P_PROCESS_WIND_TURBINES:
+            for turbine in wind_turbines:
+                turbine.make_stg_entry(stg_manager)
+        if parameters.C2P_PROCESS_STORAGE_TANKS:
+            for tank in storage_tanks:
+                tank.make_stg_entry(stg_manager)
+        if parameters.C2P_PROCESS_CHIMNEYS:
+            for chimney in chimneys:
+                chimney.make_stg_entry(stg_manager)
+
+        stg_manager.write(file_lock)
+    finally:
+        stg_manager.cancel()
 
 # ================ UNITTESTS =======================
 
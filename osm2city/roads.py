@@ -65,7 +65,6 @@ import random
 from typing import Dict, List, MutableMapping, Optional, Tuple
 import unittest
 
-import matplotlib.pyplot as plt
 import numpy as np
 import shapely.geometry as shg
 
@@ -76,7 +75,7 @@ from osm2city.textures import materials as mat
 from osm2city.static_types import osmstrings as s
 from osm2city.static_types import enumerations as e
 import osm2city.utils.osmparser as op
-from osm2city.utils import utilities, ac3d, graph, stg_io2
+from osm2city.utils import utilities, ac3d, graph, metrics, stg_io2
 import osm2city.utils.coordinates as co
 
 OUR_MAGIC = "osm2roads"  # Used in e.g. stg files to mark our edits
@@ -419,7 +418,7 @@ class WaySegment:
 
 class Roads(object):
     def __init__(self, raw_osm_ways: List[op.Way], nodes_dict: Dict[int, op.Node],
-                 coords_transform: co.Transformation, fg_elev: utilities.FGElev) -> None:
+                 coords_transform: co.Transformation, fg_elev: utilities.ElevationProvider) -> None:
         self.transform = coords_transform
         self.fg_elev = fg_elev
         self.ways_list = raw_osm_ways  # raw ways from OSM
@@ -465,10 +464,11 @@ class Roads(object):
             if water_area.length / math.sqrt(water_area.area) < 20:
                 large_water_areas.append(water_area)
         logging.info('Reduced number of water areas from %i to %i', len(water_areas), len(large_water_areas))
-        self._check_against_blocked_areas(large_water_areas, True)
-        self._check_ways_sanity('_check_against_blocked_areas_water')
-        self._check_against_blocked_areas(blocked_areas)
-        self._check_ways_sanity('_check_against_blocked_areas')
+        with metrics.span('roads.check_blocked'):
+            self._check_against_blocked_areas(large_water_areas, True)
+            self._check_ways_sanity('_check_against_blocked_areas_water')
+            self._check_against_blocked_areas(blocked_areas)
+            self._check_ways_sanity('_check_against_blocked_areas')
 
         self._remove_short_way_segments()
         self._check_ways_sanity('_remove_short_way_segments')
@@ -506,7 +506,8 @@ class Roads(object):
             for way in self.ways_list:
                 if way.osm_id in parameters.DEBUG_PLOT_BLOCKED_AREAS_ROADS:
                     line_strings.append(self._line_string_from_way(way))
-            utilities.plot_blocked_areas_roads(merged_areas, line_strings, self.transform)
+            import osm2city.utils.plot_utilities as pu  # only imported when plotting for faster start-up
+            pu.plot_blocked_areas_roads(merged_areas, line_strings, self.transform)
 
         new_ways = list()
         for way in reversed(self.ways_list):
@@ -717,11 +718,15 @@ class Roads(object):
 
         At the end save the cache.
         """
+        valid_nodes = list()
         for the_node in list(self.nodes_dict.values()):
             if math.isnan(the_node.lon) or math.isnan(the_node.lat):
                 logging.error("NaN encountered while probing elevation")
                 continue
-            the_node.msl = self.fg_elev.probe_elev((the_node.lon, the_node.lat), is_global=True)
+            valid_nodes.append(the_node)
+        probed = self.fg_elev.probe_many([(the_node.lon, the_node.lat) for the_node in valid_nodes], is_global=True)
+        for the_node, (elev, _) in zip(valid_nodes, probed):
+            the_node.msl = elev
             the_node.v_add = 0.
 
     def _propagate_v_add_over_edge(self, ref0, ref1, args):
@@ -922,6 +927,7 @@ class Roads(object):
     def debug_plot_way(self, way, ls, lw, color=None, ends_marker='', show_label=False) -> None:
         if not parameters.DEBUG_PLOT_ROADS:
             return
+        import matplotlib.pyplot as plt  # only imported when plotting for faster start-up
         col = ['b', 'r', 'y', 'g', '0.25', 'k', 'c']
         if not color:
             color = col[random.randint(0, len(col)-1)]
@@ -936,11 +942,13 @@ class Roads(object):
             plt.text(0.5*(a[0, 0]+a[-1, 0]), 0.5*(a[0, 1]+a[-1, 1]), way.osm_id, color="b")
 
     def debug_label_node(self, ref, text=""):
+        import matplotlib.pyplot as plt  # only imported when plotting for faster start-up
         node = self.nodes_dict[ref]
         plt.plot(node.lon, node.lat, 'rs', mfc='None', ms=10)
         plt.text(node.lon+0.0001, node.lat, str(node.osm_id) + " h" + str(text))
 
     def debug_plot(self, save=False, show=False, label_nodes=None, clusters=None):
+        import matplotlib.pyplot as plt  # only imported when plotting for faster start-up
         if label_nodes is None:
             label_nodes = list()
         plt.clf()
@@ -1124,7 +1132,7 @@ def _process_osm_ways(nodes_dict: Dict[int, op.Node], ways_dict: Dict[int, op.Wa
     return my_ways
 
 
-def _process_clusters(clusters, fg_elev: utilities.FGElev,
+def _process_clusters(clusters, fg_elev: utilities.ElevationProvider,
                       stg_manager, stg_paths, do_railway,
                       coords_transform: co.Transformation, stats: utilities.Stats, is_rough_lod: bool) -> None:
     for cl in clusters:
@@ -1164,14 +1172,14 @@ def _process_clusters(clusters, fg_elev: utilities.FGElev,
                                                     parameters.get_cluster_dimension_radius(),
                                                     stg_verb_type)
         stg_paths.add(path_to_stg)
-        ac.write(os.path.join(path_to_stg, file_name + '.ac'))
+        stg_manager.write_ac_file(ac, os.path.join(path_to_stg, file_name + '.ac'))
 
         for the_way in cl.objects:
             the_way.junction0.reset()
             the_way.junction1.reset()
 
 
-def process_roads(transform: co.Transformation, fg_elev: utilities.FGElev,
+def process_roads(transform: co.Transformation, fg_elev: utilities.ElevationProvider,
                   blocked_apt_areas: List[shg.Polygon], lit_areas: List[shg.Polygon], water_areas: List[shg.Polygon],
                   stg_entries: List[stg_io2.STGEntry], file_lock: mp.Lock = None) -> None:
     random.seed(42)
@@ -1205,21 +1213,23 @@ def process_roads(transform: co.Transformation, fg_elev: utilities.FGElev,
     roads.process(extended_blocked_areas, lit_areas, water_areas, stats)  # does the heavy lifting incl. clustering
 
     stg_manager = stg_io2.STGManager(path_to_output, stg_io2.SceneryType.roads, OUR_MAGIC, parameters.PREFIX)
+    try:
+        # -- write stg
+        stg_paths = set()
 
-    # -- write stg
-    stg_paths = set()
+        _process_clusters(roads.railways_clusters, fg_elev, stg_manager, stg_paths, True,
+                          transform, stats, True)
+        _process_clusters(roads.roads_clusters, fg_elev, stg_manager, stg_paths, False,
+                          transform, stats, False)
+        _process_clusters(roads.roads_rough_clusters, fg_elev, stg_manager, stg_paths, False,
+                          transform, stats, True)
 
-    _process_clusters(roads.railways_clusters, fg_elev, stg_manager, stg_paths, True,
-                      transform, stats, True)
-    _process_clusters(roads.roads_clusters, fg_elev, stg_manager, stg_paths, False,
-                      transform, stats, False)
-    _process_clusters(roads.roads_rough_clusters, fg_elev, stg_manager, stg_paths, False,
-                      transform, stats, True)
+        if parameters.DEBUG_PLOT_ROADS:
+            roads.debug_plot(show=True, clusters=roads.roads_clusters)
 
-    if parameters.DEBUG_PLOT_ROADS:
-        roads.debug_plot(show=True, clusters=roads.roads_clusters)
-
-    stg_manager.write(file_lock)
+        stg_manager.write(file_lock)
+    finally:
+        stg_manager.cancel()
 
     utilities.troubleshoot(stats)
 
@@ -1231,7 +1241,7 @@ class TestUtilities(unittest.TestCase):
         raw_osm_ways = list()
         nodes_dict = dict()
         coords_transform = co.Transformation(parameters.get_center_global())
-        the_fg_elev = utilities.FGElev(coords_transform, 111111)
+        the_fg_elev = utilities.AnalyticElevation(coords_transform, 111111)
         way = op.Way(1)
         way.tags["hello"] = "world"
         way.refs = [1, 2, 3, 4, 5, 6]
@@ -121,7 +121,7 @@ class Texture(object):
             
         if v_cuts is not None:
             v_cuts.insert(0, 0)
-            self.v_cuts = np.array(v_cuts, dtype=np.float)
+            self.v_cuts = np.array(v_cuts, dtype=float)
             if len(self.v_cuts) > 1:
                 # FIXME: test for not type list
                 self.v_cuts /= self.v_cuts[-1]
@@ -140,7 +140,7 @@ class Texture(object):
         if len(h_cuts) == 0:
             h_cuts = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
 
-        self.h_cuts = np.array(h_cuts, dtype=np.float)
+        self.h_cuts = np.array(h_cuts, dtype=float)
 
         if h_cuts is None:
             self.h_cuts = np.array([1.])
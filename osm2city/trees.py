@@ -3,8 +3,10 @@ import math
 import multiprocessing as mp
 import os
 import random
+import unittest
 from typing import Dict, List, Set
 
+import numpy as np
 import shapely.geometry as shg
 from shapely.prepared import prep
 
@@ -38,7 +40,8 @@ class Tree:
             self.tree_type = e.TreeType.default
 
     @classmethod
-    def tree_from_node(cls, node: op.Node, coords_transform: co.Transformation, fg_elev: utilities.FGElev) -> 'Tree':
+    def tree_from_node(cls, node: op.Node, coords_transform: co.Transformation,
+                       fg_elev: utilities.ElevationProvider) -> 'Tree':
         elev = fg_elev.probe_elev((node.lon, node.lat), True)
         x, y = coords_transform.to_local((node.lon, node.lat))
         tree = Tree(node.osm_id, x, y, elev)
@@ -47,7 +50,7 @@ class Tree:
 
 
 def _process_osm_trees_nodes(osm_nodes_dict: Dict[int, op.Node], coords_transform: co.Transformation,
-                             fg_elev: utilities.FGElev) -> List[Tree]:
+                             fg_elev: utilities.ElevationProvider) -> List[Tree]:
     """Uses trees directly mapped in OSM."""
     trees = list()
 
@@ -57,7 +60,7 @@ def _process_osm_trees_nodes(osm_nodes_dict: Dict[int, op.Node], coords_transfor
 
 
 def _process_osm_trees_parks(parks: List[shg.Polygon], trees: List[Tree], city_blocks: Set[CityBlock],
-                             fg_elev: utilities.FGElev) -> None:
+                             fg_elev: utilities.ElevationProvider) -> None:
     """Additional trees based on specific land-use (not woods) in urban areas.
 
     NB: extends the existing list of trees from the input parameter.
@@ -65,34 +68,28 @@ def _process_osm_trees_parks(parks: List[shg.Polygon], trees: List[Tree], city_b
     additional_trees = list()  # not directly adding to trees due to spatial comparison
     mapped_factor = math.pow(parameters.C2P_TREES_DIST_BETWEEN_TREES_PARK_MAPPED, 2)
     logging.info('Number of area polygons for process for trees: %i', len(parks))
-    tree_points_to_check = list()
-    for tree in trees:
-        tree_points_to_check.append(shg.Point(tree.x, tree.y))
+    tree_points_to_check = np.array([(tree.x, tree.y) for tree in trees], dtype=float).reshape(-1, 2)
     for my_geometry in parks:
-        trees_contained = 0
         prep_geom = prep(my_geometry)
         # check whether any of the existing manually mapped trees is within the area.
         # if yes, then most probably all trees where manually mapped
-        for tree_point in tree_points_to_check:
-            if prep_geom.contains(tree_point):
-                trees_contained += 1
-                # not removing from to be checked as probably takes more time to remove than check again
+        trees_contained = int(np.count_nonzero(utilities.points_in_polygon(tree_points_to_check, my_geometry)))
         if trees_contained == 0 or (my_geometry.area / trees_contained) > mapped_factor:
             # we are good to try to add more trees
             points = _random_trees_in_area(my_geometry, prep_geom,
                                            city_blocks,
                                            parameters.C2P_TREES_DIST_BETWEEN_TREES_PARK,
                                            parameters.C2P_TREES_SKIP_RATE_TREES_PARK)
-            for point in points:
-                elev = fg_elev.probe_elev((point.x, point.y), False)
+            for x, y in points.tolist():
+                elev = fg_elev.probe_elev((x, y), False)
                 additional_trees.append(Tree(op.get_next_pseudo_osm_id(op.OSMFeatureType.generic_node),
-                                             point.x, point.y, elev))
+                                             x, y, elev))
     logging.info('Number of trees added in areas: %i', len(additional_trees))
     trees.extend(additional_trees)
 
 
 def _process_osm_trees_gardens(city_blocks: Set[CityBlock], parks: List[shg.Polygon],
-                               fg_elev: utilities.FGElev) -> Dict[e.TreeType, List[Tree]]:
+                               fg_elev: utilities.ElevationProvider) -> Dict[e.TreeType, List[Tree]]:
     suburban_trees = list()
     town_trees = list()
     urban_trees = list()
@@ -100,29 +97,27 @@ def _process_osm_trees_gardens(city_blocks: Set[CityBlock], parks: List[shg.Poly
         tree_type = e.map_tree_type_from_settlement_type_garden(city_block.settlement_type)
         if city_block.type_ is e.BuildingZoneType.special_processing:
             continue
-        prep_geom = prep(city_block.geometry)
-        my_random_points = _generate_random_tree_points_in_polygon(city_block.geometry, prep_geom,
+        my_random_points = _generate_random_tree_points_in_polygon(city_block.geometry,
                                                                    parameters.C2P_TREES_DIST_BETWEEN_TREES_GARDEN,
                                                                    parameters.C2P_TREES_SKIP_RATE_TREES_GARDEN)
-
-        for point in my_random_points:
-            exclude = False
-            for park in parks:  # need to check for parks
-                if point.within(park):
-                    exclude = True
-                    break
-            if exclude:
+        block_bounds = city_block.geometry.bounds
+        for park in parks:  # need to check for parks
+            if len(my_random_points) == 0:
+                break
+            if co.disjoint_bounds(block_bounds, park.bounds):
                 continue
-            if not _test_point_in_building(point, {city_block}, 2.0):
-                elev = fg_elev.probe_elev((point.x, point.y), False)
-                my_tree = Tree(op.get_next_pseudo_osm_id(op.OSMFeatureType.generic_node),
-                               point.x, point.y, elev)
-                if tree_type is e.TreeType.suburban:
-                    suburban_trees.append(my_tree)
-                elif tree_type is e.TreeType.town:
-                    town_trees.append(my_tree)
-                else:
-                    urban_trees.append(my_tree)
+            my_random_points = my_random_points[np.logical_not(utilities.points_in_polygon(my_random_points, park))]
+        my_random_points = _filter_points_in_buildings(my_random_points, {city_block}, 2.0)
+
+        for x, y in my_random_points.tolist():
+            elev = fg_elev.probe_elev((x, y), False)
+            my_tree = Tree(op.get_next_pseudo_osm_id(op.OSMFeatureType.generic_node), x, y, elev)
+            if tree_type is e.TreeType.suburban:
+                suburban_trees.append(my_tree)
+            elif tree_type is e.TreeType.town:
+                town_trees.append(my_tree)
+            else:
+                urban_trees.append(my_tree)
 
     garden_trees = dict()
     if suburban_trees:
@@ -135,38 +130,40 @@ def _process_osm_trees_gardens(city_blocks: Set[CityBlock], parks: List[shg.Poly
     return garden_trees
 
 
-def _generate_random_tree_points_in_polygon(my_polygon: shg.Polygon, prep_geom,
-                                            default_distance: int, skip_rate: float) -> List[shg.Point]:
+def _generate_random_tree_points_in_polygon(my_polygon: shg.Polygon,
+                                            default_distance: int, skip_rate: float) -> np.ndarray:
     """Creates a random set of points for trees within a polygon based on an average distance and a skip rate.
 
-    This is not a very efficient algorithm, but it should be enough to give an ok distribution."""
-    my_random_points = list()
+    The points are randomly moved from a regular grid and returned as an array of shape (n, 2). The grid is
+    generated and tested against the polygon with NumPy in one go instead of point by point."""
     my_bounds = my_polygon.bounds
     max_x = int((my_bounds[2] - my_bounds[0]) // default_distance)
     max_y = int((my_bounds[3] - my_bounds[1]) // default_distance)
-    for i in range(max_x):
-        for j in range(max_y):
-            if random.random() < skip_rate:
-                continue
-            x = my_bounds[0] + i * default_distance + random.uniform(-default_distance/3., default_distance/3.)
-            y = my_bounds[1] + j * default_distance + random.uniform(-default_distance/3., default_distance/3.)
-            my_point = shg.Point(x, y)
-            if prep_geom.contains(my_point):
-                my_random_points.append(my_point)
-    return my_random_points
+    if max_x <= 0 or max_y <= 0:
+        return np.zeros((0, 2))
+    rng = np.random.default_rng(random.getrandbits(32))  # depends on the seed of the random module
+    grid_i, grid_j = np.meshgrid(np.arange(max_x), np.arange(max_y), indexing='ij')
+    kept = rng.random((max_x, max_y)) >= skip_rate
+    number_kept = int(np.count_nonzero(kept))
+    points = np.empty((number_kept, 2))
+    points[:, 0] = my_bounds[0] + grid_i[kept] * default_distance + rng.uniform(-default_distance / 3.,
+                                                                                default_distance / 3., number_kept)
+    points[:, 1] = my_bounds[1] + grid_j[kept] * default_distance + rng.uniform(-default_distance / 3.,
+                                                                                default_distance / 3., number_kept)
+    return points[utilities.points_in_polygon(points, my_polygon)]
 
 
 def _random_trees_in_area(my_polygon: shg.Polygon, prep_geom, city_blocks: Set[CityBlock],
-                          default_distance: int, skip_rate: float) -> List[shg.Point]:
+                          default_distance: int, skip_rate: float) -> np.ndarray:
     """Creates random trees in an area respecting the presence of buildings.
 
     The trees are geometrically tested against the boundary box of buildings (not the whole tree, just the centre).
     NB: in parks trees are often around open spaces and not just randomly distributed - this heuristic does
     not take such things into account.
     """
-    my_random_points = _generate_random_tree_points_in_polygon(my_polygon, prep_geom, default_distance, skip_rate)
+    my_random_points = _generate_random_tree_points_in_polygon(my_polygon, default_distance, skip_rate)
     # now check against buildings
-    if not my_random_points:
+    if len(my_random_points) == 0:
         return my_random_points
 
     # find the city blocks, which might have buildings which could interfere
@@ -174,15 +171,11 @@ def _random_trees_in_area(my_polygon: shg.Polygon, prep_geom, city_blocks: Set[C
     for city_block in city_blocks:
         if not prep_geom.disjoint(city_block.geometry):
             test_list.add(city_block)
-    final_points = list()
-    for point in my_random_points:
-        if not _test_point_in_building(point, test_list, 3.0):
-            final_points.append(point)
-    return final_points
+    return _filter_points_in_buildings(my_random_points, test_list, 3.0)
 
 
 def _process_osm_tree_row(nodes_dict, ways_dict, trees: List[Tree], coords_transform: co.Transformation,
-                          fg_elev: utilities.FGElev) -> None:
+                          fg_elev: utilities.ElevationProvider) -> None:
     """Trees in a row as mapped in OSM (natural=tree_row).
 
     NB: extends the existing list of trees from the input parameter.
@@ -208,7 +201,7 @@ def _process_osm_tree_row(nodes_dict, ways_dict, trees: List[Tree], coords_trans
 
 
 def _process_osm_trees_lined(nodes_dict, ways_dict, trees: List[Tree], coords_transform: co.Transformation,
-                             fg_elev: utilities.FGElev) -> None:
+                             fg_elev: utilities.ElevationProvider) -> None:
     """Trees in a line as mapped in OSM (tree_lined=*).
 
     NB: extends the existing list of trees from the input parameter.
@@ -262,29 +255,48 @@ def _write_trees_in_list(coords_transform: co.Transformation, material_name: str
                          trees: List[Tree], stg_manager: stg_io2.STGManager) -> None:
     file_shader = stg_manager.prefix + "_" + material_name + "_trees_shader.txt"
     path_to_stg = stg_manager.add_tree_list(file_shader, material_name, coords_transform.anchor, 0.)
-    try:
-        with open(os.path.join(path_to_stg, file_shader), 'w') as shader:
-            for t in trees:
-                line = '{:.1f} {:.1f} {:.1f}'.format(-t.y, t.x, t.elev)
-                shader.write(line)
-                shader.write('\n')
-    except IOError as exc:
-        logging.warning('Could not write trees in list to file %s', exc)
+    lines = ['{:.1f} {:.1f} {:.1f}\n'.format(-t.y, t.x, t.elev) for t in trees]
+    stg_manager.write_text_file(''.join(lines), os.path.join(path_to_stg, file_shader))
     logging.info("Total number of shader trees written to a tree_list: %d", len(trees))
 
 
-def _test_point_in_building(point: shg.Point, city_blocks: Set[CityBlock], min_dist: float) -> bool:
-    """Tests whether a point is within a building respectively not at least min_distance away.
-    The use of CityBlocks should speed up the process considerably by using fewer geometric calculations."""
+MAX_POINTS_TIMES_BUILDINGS = 1000000  # limits the size of the arrays when testing points against buildings
+
+
+def _filter_points_in_buildings(points: np.ndarray, city_blocks: Set[CityBlock], min_dist: float) -> np.ndarray:
+    """Returns those points, which are not within a building respectively at least min_dist away.
+
+    Only buildings of city blocks are tested, within which bounds a point is. Like before only the bounds of the
+    buildings are used, however as arrays for all points at once instead of point by point."""
+    if len(points) == 0:
+        return points
+    points_bounds = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    # per building: the bounds extended by min_dist, but limited to the bounds of the city block
+    limits = list()
     for city_block in city_blocks:
-        if city_block.geometry.bounds[0] < point.x < city_block.geometry.bounds[2] and \
-                city_block.geometry.bounds[1] < point.y < city_block.geometry.bounds[3]:
-            # point is within bounds of city block - now check each building of city block
-            for b in city_block.osm_buildings:
-                if b.geometry.bounds[0] - min_dist < point.x < b.geometry.bounds[2] + min_dist and \
-                        b.geometry.bounds[1] - min_dist < point.y < b.geometry.bounds[3] + min_dist:
-                    return True  # return immediately
-    return False
+        block_bounds = city_block.geometry.bounds
+        if co.disjoint_bounds(block_bounds, points_bounds):
+            continue
+        for b in city_block.osm_buildings:
+            b_bounds = b.geometry.bounds
+            limits.append((max(b_bounds[0] - min_dist, block_bounds[0]), max(b_bounds[1] - min_dist, block_bounds[1]),
+                           min(b_bounds[2] + min_dist, block_bounds[2]), min(b_bounds[3] + min_dist, block_bounds[3])))
+    if not limits:
+        return points
+    limits = np.array(limits)
+    limits = limits[(limits[:, 0] < points_bounds[2]) & (limits[:, 2] > points_bounds[0]) &
+                    (limits[:, 1] < points_bounds[3]) & (limits[:, 3] > points_bounds[1])]
+    if len(limits) == 0:
+        return points
+
+    in_building = np.zeros(len(points), dtype=bool)
+    chunk_size = max(1, MAX_POINTS_TIMES_BUILDINGS // len(limits))
+    for start in range(0, len(points), chunk_size):
+        x = points[start:start + chunk_size, 0:1]
+        y = points[start:start + chunk_size, 1:2]
+        in_building[start:start + chunk_size] = np.any((limits[:, 0] < x) & (x < limits[:, 2]) &
+                                                       (limits[:, 1] < y) & (y < limits[:, 3]), axis=1)
+    return points[np.logical_not(in_building)]
 
 
 def _prepare_city_blocks(the_buildings: List[bl.Building], coords_transform: co.Transformation) -> Set[CityBlock]:
@@ -311,8 +323,8 @@ def _prepare_city_blocks(the_buildings: List[bl.Building], coords_transform: co.
     return city_blocks
 
 
-def process_trees(coords_transform: co.Transformation, fg_elev: utilities.FGElev, the_buildings: List[bl.Building],
-                  file_lock: mp.Lock = None):
+def process_trees(coords_transform: co.Transformation, fg_elev: utilities.ElevationProvider,
+                  the_buildings: List[bl.Building], file_lock: mp.Lock = None):
     if parameters.C2P_PROCESS_TREES and parameters.FLAG_AFTER_2020_3:
         city_blocks = _prepare_city_blocks(the_buildings, coords_transform)
         logging.info("Working with %i city blocks", len(city_blocks))
@@ -354,11 +366,77 @@ def process_trees(coords_transform: co.Transformation, fg_elev: utilities.FGElev
 
         stg_manager = stg_io2.STGManager(parameters.get_output_path(), stg_io2.SceneryType.trees, TREES_MAGIC,
                                          parameters.PREFIX)
-        if trees:
-            _write_trees_in_list(coords_transform, e.TreeType.default.value, trees, stg_manager)
-        for tree_type, tree_list in garden_trees.items():
-            _write_trees_in_list(coords_transform, tree_type.value, tree_list, stg_manager)
-
-        stg_manager.write(file_lock)
+        try:
+            if trees:
+                _write_trees_in_list(coords_transform, e.TreeType.default.value, trees, stg_manager)
+            for tree_type, tree_list in garden_trees.items():
+                _write_trees_in_list(coords_transform, tree_type.value, tree_list, stg_manager)
+
+            stg_manager.write(file_lock)
+        finally:
+            stg_manager.cancel()
     else:
         logging.info('No trees generated due to parameter setup')
+
+
+# ================ UNITTESTS =======================
+
+
+class TestTreePoints(unittest.TestCase):
+    @staticmethod
+    def _old_test_point_in_building(x: float, y: float, city_blocks: Set[CityBlock], min_dist: float) -> bool:
+        """The per-point test of bounds before the test was done with arrays."""
+        for city_block in city_blocks:
+            if city_block.geometry.bounds[0] < x < city_block.geometry.bounds[2] and \
+                    city_block.geometry.bounds[1] < y < city_block.geometry.bounds[3]:
+                for b in city_block.osm_buildings:
+                    if b.geometry.bounds[0] - min_dist < x < b.geometry.bounds[2] + min_dist and \
+                            b.geometry.bounds[1] - min_dist < y < b.geometry.bounds[3] + min_dist:
+                        return True
+        return False
+
+    def test_filter_points_in_buildings(self):
+        global MAX_POINTS_TIMES_BUILDINGS
+        random.seed(42)
+        city_blocks = set()
+        osm_id = 0
+        for block_x in range(3):
+            for block_y in range(2):
+                block = CityBlock(block_x * 10 + block_y, shg.box(block_x * 100., block_y * 100.,
+                                                                  block_x * 100. + 90., block_y * 100. + 90.),
+                                  e.BuildingZoneType.residential)
+                for _ in range(8):
+                    osm_id += 1
+                    x = block_x * 100. + random.uniform(-5., 85.)  # some buildings are partly outside the block
+                    y = block_y * 100. + random.uniform(-5., 85.)
+                    ring = shg.LinearRing([(x, y), (x + 10., y), (x + 10., y + 8.), (x, y + 8.)])
+                    block.relate_building(bl.Building(osm_id, {s.K_BUILDING: s.V_YES}, ring, None))
+                city_blocks.add(block)
+        points = np.array([(random.uniform(-10., 300.), random.uniform(-10., 200.)) for _ in range(2000)])
+        expected = [[x, y] for x, y in points.tolist()
+                    if not self._old_test_point_in_building(x, y, city_blocks, 3.)]
+        self.assertTrue(0 < len(expected) < len(points))
+
+        self.assertEqual(expected, _filter_points_in_buildings(points, city_blocks, 3.).tolist())
+        original_max = MAX_POINTS_TIMES_BUILDINGS
+        try:
+            MAX_POINTS_TIMES_BUILDINGS = 1000  # less than a chunk per point and building
+            self.assertEqual(expected, _filter_points_in_buildings(points, city_blocks, 3.).tolist())
+        finally:
+            MAX_POINTS_TIMES_BUILDINGS = original_max
+        self.assertEqual(0, len(_filter_points_in_buildings(np.zeros((0, 2)), city_blocks, 3.)))
+
+    def test_generate_random_tree_points_in_polygon(self):
+        polygon = shg.Polygon([(0., 0.), (200., 0.), (200., 200.), (100., 100.), (0., 200.)])  # concave
+        random.seed(7)
+        points = _generate_random_tree_points_in_polygon(polygon, 10, 0.3)
+        random.seed(7)
+        self.assertEqual(points.tolist(), _generate_random_tree_points_in_polygon(polygon, 10, 0.3).tolist())
+        self.assertTrue(len(points) > 0)
+        prep_polygon = prep(polygon)
+        for x, y in points.tolist():
+            self.assertTrue(prep_polygon.contains(shg.Point(x, y)))
+            # jittered by at most a third of the distance from a grid position
+            self.assertLessEqual(abs(x - round(x / 10) * 10), 10 / 3.)
+            self.assertLessEqual(abs(y - round(y / 10) * 10), 10 / 3.)
+        self.assertEqual(0, len(_generate_random_tree_points_in_polygon(shg.box(0., 0., 5., 5.), 10, 0.3)))
@@ -1,45 +1,54 @@
 import logging
-from typing import List, Optional
+import os
+import tempfile
+from typing import Iterator, List, Optional
+import unittest
 
-import matplotlib.pyplot as plt
 import numpy as np
-from pyparsing import Literal, Word, alphas, Optional, OneOrMore, \
-    Group, nums, Regex, alphanums, LineEnd, Each, ZeroOrMore
 
 import osm2city.textures.materials as mat
 
 fmt_node = '%g'
 fmt_surf = '%1.4g'
 
+# number of vertices resp. faces formatted in one go when writing an Object
+CHUNK_SIZE = 10000
 
-class Node(object):
-    def __init__(self, x, y, z):
-        self.x = x
-        self.y = y
-        self.z = z
 
-    def __str__(self):
-        return (fmt_node + ' ' + fmt_node + ' ' + fmt_node + '\n') % (self.x, self.y, self.z)
+class _GrowableArray(object):
+    """A NumPy array with amortised appends of rows, similar to a list."""
+    __slots__ = ('_data', '_size')
 
+    def __init__(self, columns: int, dtype, capacity: int = 64) -> None:
+        self._data = np.empty((capacity, columns), dtype=dtype)
+        self._size = 0
 
-class Face(object):
-    """if our texture is rotated in texture_atlas, set swap_uv=True"""
-    def __init__(self, nodes_uv_list, typ, mat_idx: int, swap_uv):
-        assert len(nodes_uv_list) >= 2
-        for n in nodes_uv_list:
-            assert len(n) == 3
-        if swap_uv:
-            nodes_uv_list = [(n[0], n[2], n[1]) for n in nodes_uv_list]
-        self.nodes_uv_list = nodes_uv_list
-        self.typ = typ
-        self.mat_idx = mat_idx
+    def __len__(self) -> int:
+        return self._size
 
-    def __str__(self):
-        s = "SURF %s\n" % self.typ
-        s += "mat %i\n" % self.mat_idx
-        s += "refs %i\n" % len(self.nodes_uv_list)
-        s += "".join([("%i " + fmt_surf + " " + fmt_surf + "\n") % (n[0], n[1], n[2]) for n in self.nodes_uv_list])
-        return s
+    def _reserve(self, size: int) -> None:
+        if size > len(self._data):
+            new_data = np.empty((max(size, 2 * len(self._data)), self._data.shape[1]), dtype=self._data.dtype)
+            new_data[:self._size] = self._data[:self._size]
+            self._data = new_data
+
+    def append(self, row) -> int:
+        """Append one row and return its index."""
+        if self._size == len(self._data):
+            self._reserve(self._size + 1)
+        self._data[self._size] = row
+        self._size += 1
+        return self._size - 1
+
+    def extend(self, rows: np.ndarray) -> None:
+        self._reserve(self._size + len(rows))
+        self._data[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    @property
+    def data(self) -> np.ndarray:
+        """A view on the filled part of the array."""
+        return self._data[:self._size]
 
 
 class Object(object):
@@ -49,12 +58,17 @@ class Object(object):
          0x20: two-sided poly
          0x00: single-sided poly
     The default_mat 0 is for unlit objects and 1 is for lit objects -> cf. File.__str__
+
+    Nodes are kept in a NumPy array (x, y, z). Faces are kept in a flat array of refs (node index, u, v) plus
+    an array with one row per face (index into surf_types, material index, number of refs).
     """
     def __init__(self, name=None, stats=None, texture=None, texrep=None, texoff=None, rot=None, loc=None, crease=None,
                  url=None, default_type=0x00, default_mat_idx: int = mat.Material.default.value,
                  default_swap_uv: bool = False, kids: int = 0) -> None:
-        self._nodes = []
-        self._faces = []
+        self._nodes = _GrowableArray(3, np.float64)
+        self._face_refs = _GrowableArray(3, np.float64)
+        self._faces = _GrowableArray(3, np.int64)
+        self._surf_types = list()  # the distinct SURF types used by faces in order of first usage
         self.name = name
         self.stats = stats
         self.texture = texture
@@ -74,14 +88,22 @@ class Object(object):
 
     def node(self, x, y, z) -> int:
         """Add new node. Return its index."""
-        self._nodes.append(Node(x, y, z))
+        index = self._nodes.append((x, y, z))
         if self.stats:
             self.stats.vertices += 1
-        return len(self._nodes) - 1
+        return index
+
+    def add_nodes(self, coords: np.ndarray) -> int:
+        """Add new nodes from an array of (x, y, z). Return the index of the first added node."""
+        index = len(self._nodes)
+        self._nodes.extend(coords)
+        if self.stats:
+            self.stats.vertices += len(coords)
+        return index
 
     def nodes_as_array(self):
         """return all nodes as a numpy array"""
-        return np.array([(n.x, n.y, n.z) for n in self._nodes])
+        return self._nodes.data.copy()
 
     def next_node_index(self):
         return len(self._nodes)
@@ -93,23 +115,51 @@ class Object(object):
         return len(self._faces)
 
     def face(self, nodes_uv_list, typ=None, mat_idx=None, swap_uv=None) -> int:
-        """Add new face. Return its index."""
+        """Add new face. Return its index.
+        nodes_uv_list is a sequence of (node index, u, v). If our texture is rotated in texture_atlas,
+        then set swap_uv=True"""
         if not typ:
             typ = self.default_type
         if mat_idx is None:
             mat_idx = self.default_mat_ix
         if not swap_uv:
             swap_uv = self.default_swap_uv
-        my_face = Face(nodes_uv_list, typ, mat_idx, swap_uv)
-        self._faces.append(my_face)
+        refs = np.array(nodes_uv_list, dtype=np.float64)
+        assert refs.ndim == 2 and len(refs) >= 2 and refs.shape[1] == 3
+        if swap_uv:
+            refs = refs[:, (0, 2, 1)]
+        try:
+            type_idx = self._surf_types.index(typ)
+        except ValueError:
+            self._surf_types.append(typ)
+            type_idx = len(self._surf_types) - 1
+        self._face_refs.extend(refs)
+        index = self._faces.append((type_idx, mat_idx, len(refs)))
         if self.stats:
             self.stats.surfaces += 1
-        return len(self._faces) - 1
+        return index
+
+    def add_faces(self, refs: np.ndarray, refs_counts: List[int], typs: List, mat_idxs: List[Optional[int]]) -> None:
+        """Add many faces at once, e.g. when reading a file. refs are the (node index, u, v) of all faces and
+        refs_counts the number of refs per face. Defaults are used for typ resp. mat_idx if they are None."""
+        faces = np.empty((len(refs_counts), 3), dtype=np.int64)
+        for i, (typ, mat_idx) in enumerate(zip(typs, mat_idxs)):
+            if not typ:
+                typ = self.default_type
+            if typ not in self._surf_types:
+                self._surf_types.append(typ)
+            faces[i, 0] = self._surf_types.index(typ)
+            faces[i, 1] = self.default_mat_ix if mat_idx is None else mat_idx
+        faces[:, 2] = refs_counts
+        self._face_refs.extend(refs)
+        self._faces.extend(faces)
+        if self.stats:
+            self.stats.surfaces += len(refs_counts)
 
     def is_empty(self):
-        return not self._nodes
+        return len(self._nodes) == 0
 
-    def __str__(self):
+    def _header(self) -> str:
         s = 'OBJECT poly\n'
         if self.name is not None:
             s += 'name "%s"\n' % self.name
@@ -127,24 +177,70 @@ class Object(object):
             s += 'url %s\n' % self.url
         if self.texture:
             s += 'texture "%s"\n' % self.texture
-        s += 'numvert %i\n' % len(self._nodes)
-        s += "".join([str(n) for n in self._nodes])
-        s += 'numsurf %i\n' % len(self._faces)
-        s += "".join([str(f) for f in self._faces])
-        s += 'kids %i\n' % self.kids
         return s
 
+    def _node_chunks(self) -> Iterator[str]:
+        nodes = self._nodes.data
+        row_format = fmt_node + ' ' + fmt_node + ' ' + fmt_node + '\n'
+        for start in range(0, len(nodes), CHUNK_SIZE):
+            chunk = nodes[start:start + CHUNK_SIZE]
+            yield (row_format * len(chunk)) % tuple(chunk.ravel().tolist())
+
+    def _face_chunks(self) -> Iterator[str]:
+        """Formats a chunk of faces with one string formatting operation.
+        The format of a face only depends on its SURF type and number of refs and is therefore cached."""
+        faces = self._faces.data
+        refs = self._face_refs.data
+        ref_starts = np.zeros(len(faces) + 1, dtype=np.int64)
+        np.cumsum(faces[:, 2], out=ref_starts[1:])
+        surf_lines = ['SURF %s\n' % typ for typ in self._surf_types]
+        ref_format = '%i ' + fmt_surf + ' ' + fmt_surf + '\n'
+        face_formats = dict()
+        for start in range(0, len(faces), CHUNK_SIZE):
+            chunk = faces[start:start + CHUNK_SIZE].tolist()
+            first_ref = ref_starts[start]
+            chunk_refs = refs[first_ref:ref_starts[start + len(chunk)]].ravel().tolist()
+            formats = list()
+            values = list()
+            ref_pos = 0
+            for type_idx, mat_idx, num_refs in chunk:
+                key = (type_idx, num_refs)
+                face_format = face_formats.get(key)
+                if face_format is None:
+                    face_format = surf_lines[type_idx].replace('%', '%%') + 'mat %i\nrefs %i\n' + ref_format * num_refs
+                    face_formats[key] = face_format
+                formats.append(face_format)
+                values.append(mat_idx)
+                values.append(num_refs)
+                values.extend(chunk_refs[ref_pos:ref_pos + 3 * num_refs])
+                ref_pos += 3 * num_refs
+            yield ''.join(formats) % tuple(values)
+
+    def text_chunks(self) -> Iterator[str]:
+        """The AC3D representation of this object as a sequence of strings."""
+        yield self._header() + 'numvert %i\n' % len(self._nodes)
+        yield from self._node_chunks()
+        yield 'numsurf %i\n' % len(self._faces)
+        yield from self._face_chunks()
+        yield 'kids %i\n' % self.kids
+
+    def __str__(self):
+        return ''.join(self.text_chunks())
+
     def plot(self):
         """note: here, Z is height."""
-        for f in self._faces:
-            X = [self._nodes[n[0]].x for n in f.nodes_uv_list]
-            Y = [self._nodes[n[0]].z for n in f.nodes_uv_list]
-            Z = [self._nodes[n[0]].y for n in f.nodes_uv_list]
-            X.append(self._nodes[f.nodes_uv_list[0][0]].x)
-            Y.append(self._nodes[f.nodes_uv_list[0][0]].z)
-            #Z.append(self._nodes[f.nodes_uv_list[0][0]].y)
-            #if max(Z) > 1.: break
-            #print "MAX", max(Z)
+        import matplotlib.pyplot as plt  # only imported when plotting for faster start-up
+        nodes = self._nodes.data
+        refs = self._face_refs.data
+        ref_start = 0
+        for num_refs in self._faces.data[:, 2].tolist():
+            indices = refs[ref_start:ref_start + num_refs, 0].astype(np.int64)
+            ref_start += num_refs
+            X = nodes[indices, 0].tolist()
+            Y = nodes[indices, 2].tolist()
+            Z = nodes[indices, 1].tolist()
+            X.append(X[0])
+            Y.append(Y[0])
             plt.plot(X, Y, '-o')
             for i in range(len(X)-1):
                 x = 0.5*(X[i] + X[i+1])
@@ -236,22 +332,10 @@ class File(object):
 
     def center(self):
         """translate all nodes such that the average is zero"""
-        sum_x = sum_y = sum_z = n = 0
-        for obj in self.objects:
-            for node in obj._nodes:
-                sum_x += node.x
-                sum_y += node.y
-                sum_z += node.z
-                n += 1
-
-        cx = float(sum_x) / n
-        cy = float(sum_y) / n
-        cz = float(sum_z) / n
-        for obj in self.objects:
-            for node in obj._nodes:
-                node.x -= cx
-                node.y -= cy
-                node.z -= cz
+        non_empty = [o for o in self.objects if not o.is_empty()]
+        centre = self.nodes_as_array().mean(axis=0)
+        for obj in non_empty:
+            obj._nodes.data[:] -= centre
 
     def total_nodes(self):
         """return total number of nodes of all objects"""
@@ -271,7 +355,8 @@ class File(object):
             the_nodes = np.vstack((the_nodes, a))
         return the_nodes
 
-    def __str__(self) -> str:
+    def text_chunks(self) -> Iterator[str]:
+        """The AC3D representation of the file as a sequence of strings, such that it can be streamed."""
         s = 'AC3Db\n'
         if not self.materials_list:
             self.materials_list = mat.create_materials_list()
@@ -279,13 +364,17 @@ class File(object):
         non_empty = [o for o in self.objects if not o.is_empty()]
         # FIXME: this doesn't handle nested kids properly
         s += 'OBJECT world\nkids %i\n' % len(non_empty)
-        s += "".join([str(o) for o in non_empty])
-        return s
+        yield s
+        for o in non_empty:
+            yield from o.text_chunks()
+
+    def __str__(self) -> str:
+        return ''.join(self.text_chunks())
 
     def write(self, file_name: str) -> None:
-        f = open(file_name, 'w')
-        f.write(str(self))
-        f.close()
+        """Writes the file chunk by chunk instead of creating the whole content in memory first."""
+        with open(file_name, 'w') as f:
+            f.writelines(self.text_chunks())
 
     def plot(self):
         non_empty = [o for o in self.objects if not o.is_empty()]
@@ -294,107 +383,143 @@ class File(object):
 
     def read(self, file_name):
         """read an ac3d file. TODO: groups, nested kids"""
-#        def convertObject(tokens):
-#            pass
-        def convertLMaterial(tokens):
-            self.materials_list.append(tokens[1])
-
-        def convertLObj(tokens):
-            self.new_object("", "")
-            self._current_object._type = tokens[1]
-
-        def convertLKids(tokens):
-            self._current_object.kids = int(tokens[1])
-
-        def convertLData(tokens):
-            pass
-
-        def convertLName(tokens):
-            self._current_object.name = tokens[1].strip('"\'')
-
-        def convertLTexture(tokens):
-            self._current_object.texture = tokens[1].strip('"\'')
-
-        def _token2array(tokens, num):
-            return np.array([float(item) for item in tokens[1:num + 1]])
-
-        def convertLTexrep(tokens):
-            self._current_object.texrep = _token2array(tokens, 2)
-
-        def convertLTexoff(tokens):
-            self._current_object.texoff = _token2array(tokens, 2)
-
-        def convertLRot(tokens):
-            self._current_object.rot = _token2array(tokens, 9)
-
-        def convertLCrease(tokens):
-            self._current_object.crease = tokens[1]
-
-        def convertLLoc(tokens):
-            self._current_object.loc = _token2array(tokens, 3)
-
-        def convertLUrl(tokens):
-            self._current_object.url = tokens[1]
-
-        def convertLVertex(tokens):
-            self._current_object.node(tokens[0], tokens[1], tokens[2])
-
-        def convertSurf(tokens):
-            assert(tokens[0] == 'SURF')
-            assert(tokens[2] == 'mat')
-            assert(tokens[4] == 'refs')
-            self._current_object.face(nodes_uv_list=tokens[6], typ=tokens[1], mat_idx=tokens[3])
-
-        def convertIntegers(tokens):
-            return int(tokens[0])
-
-        def convertFloats(tokens):
-            try:
-                return float(tokens[0])
-            except ValueError:
-                logging.error(tokens[0])
-
-        integer = Word(nums).setParseAction(convertIntegers)
-        string = Regex(r'"[^"]*"')
-        floatNumber = Regex(r'[+-]?(\d+(\.\d*)?|(\.\d*))([eE][+-]\d+)?').setParseAction(convertFloats)
-        anything = Regex(r'.*')
-
-        debug = False
-
-#       Relaxed see Tor_Ness_Lighthouse.xml
-        lHeader = Regex('AC3Db[S]*') + LineEnd()
-        lMaterial = (Literal('MATERIAL') + anything + LineEnd()).setParseAction(convertLMaterial).setDebug(debug)
-        lObject = (Literal('OBJECT') + Word(alphas)).setParseAction(convertLObj).setDebug(debug)
-        lKids = (Literal('kids') + integer).setParseAction(convertLKids).setDebug(debug)
-        lName = (Literal('name') + string).setParseAction(convertLName).setDebug(debug)
-        lData = (Literal('data') + integer + LineEnd() + anything + LineEnd()).setParseAction(convertLData).setDebug(debug)
-        lTexture = (Literal('texture') + string ).setParseAction(convertLTexture).setDebug(debug)
-        lTexrep = (Literal('texrep') + floatNumber + floatNumber ).setParseAction(convertLTexrep).setDebug(debug)
-        lTexoff = (Literal('texoff') + floatNumber + floatNumber ).setParseAction(convertLTexoff).setDebug(debug)
-        lRot = (Literal('rot') + floatNumber + floatNumber + floatNumber + floatNumber + floatNumber + floatNumber + floatNumber + floatNumber + floatNumber).setParseAction(convertLRot).setDebug(debug)
-        lLoc = (Literal('loc') + floatNumber + floatNumber + floatNumber).setParseAction(convertLLoc)
-        lCrease = (Literal('crease') + floatNumber).setParseAction(convertLCrease).setDebug(debug)
-        lUrl = (Literal('url') + string).setParseAction(convertLUrl).setDebug(debug)
-        lNumvert = Literal('numvert') + Word(nums)
-        lVertex = (floatNumber + floatNumber + floatNumber).setParseAction(convertLVertex)
-        lNumsurf = Literal('numsurf') + Word(nums)
-        lSurf = Literal('SURF') + Word(alphanums)
-        lMat = Literal('mat') + integer
-        lRefs = Literal('refs') + integer
-        lNodes = Group(integer + floatNumber + floatNumber)
-
-        pObjectWorld = Group(lObject + Optional(lName) + lKids)
-        pSurf = (lSurf + Optional(lMat) + lRefs + Group(OneOrMore(lNodes))).setParseAction( convertSurf )
-        pObjectHeader = Group(lObject + Each([Optional(lName), Optional(lData), Optional(lTexture), Optional(lTexrep),
-                              Optional(lTexoff), Optional(lRot), Optional(lLoc), Optional(lUrl), Optional(lCrease)]))
-        pObject = Group(pObjectHeader + Optional(lNumvert + Group(ZeroOrMore(lVertex))
-                        + Optional(lNumsurf + Group(ZeroOrMore(pSurf))))
-                        + lKids)  # .setParseAction( convertObject )
-
-        pFile = lHeader + Group(OneOrMore(lMaterial)) + pObjectWorld \
-          + Group(OneOrMore(pObject))
-
         try:
-            self.p = pFile.parseFile(file_name)
+            with open(file_name, 'r') as my_file:
+                _read_lines(self, my_file)
         except IOError as e:
             logging.warning(e)
+
+
+def _parse_rows(lines: List[str], columns: int) -> np.ndarray:
+    """Parses lines of numbers into an array using the first columns values of each line."""
+    values = ' '.join(lines).split()
+    if len(values) != columns * len(lines):  # e.g. vertices with normals
+        values = [value for line in lines for value in line.split()[:columns]]
+    return np.array(values, dtype=np.float64).reshape(len(lines), columns)
+
+
+def _read_surfaces(obj: Object, lines: Iterator[str], numsurf: int, skip_surfaces: bool) -> None:
+    """Reads numsurf SURF blocks and adds them as faces to the object in one go."""
+    typs = list()
+    mat_idxs = list()
+    refs_counts = list()
+    ref_lines = list()
+    for _ in range(numsurf):
+        typ = None
+        mat_idx = None
+        while True:
+            tokens = next(lines).split()
+            if not tokens:
+                continue
+            if tokens[0] == 'SURF':
+                typ = tokens[1]
+            elif tokens[0] == 'mat':
+                mat_idx = int(tokens[1])
+            elif tokens[0] == 'refs':
+                break
+            else:
+                raise ValueError('Unexpected line in SURF block: %s' % ' '.join(tokens))
+        refs_count = int(tokens[1])
+        block = [next(lines) for _ in range(refs_count)]
+        if skip_surfaces:
+            continue
+        typs.append(typ)
+        mat_idxs.append(mat_idx)
+        refs_counts.append(refs_count)
+        ref_lines.extend(block)
+    if not skip_surfaces:
+        obj.add_faces(_parse_rows(ref_lines, 3), refs_counts, typs, mat_idxs)
+
+
+def _read_lines(ac_file: File, lines: Iterator[str], skip_surfaces: bool = False) -> None:
+    """Reads the lines of an ac3d file line by line into the objects of an ac3d.File.
+    Vertices and surfaces are collected per block and then converted to arrays in one go.
+    Nested kids are added as flat objects in the order they appear."""
+    lines = iter(lines)
+    obj = None
+    for line in lines:
+        tokens = line.split(None, 1)
+        if not tokens:
+            continue
+        keyword = tokens[0]
+        rest = tokens[1].strip() if len(tokens) > 1 else ''
+        if keyword.startswith('AC3D'):
+            continue
+        elif keyword == 'MATERIAL':
+            ac_file.materials_list.append(line.strip())
+        elif keyword == 'OBJECT':
+            obj = ac_file.new_object('', '')
+            obj._type = rest
+        elif obj is None:
+            raise ValueError('Unexpected line before first OBJECT: %s' % line.strip())
+        elif keyword == 'name':
+            obj.name = rest.strip('"\'')
+        elif keyword == 'data':
+            length = int(rest)
+            consumed = 0
+            while consumed < length:
+                consumed += len(next(lines))
+        elif keyword == 'texture':
+            obj.texture = rest.strip('"\'')
+        elif keyword == 'texrep':
+            obj.texrep = np.array(rest.split()[:2], dtype=np.float64)
+        elif keyword == 'texoff':
+            obj.texoff = np.array(rest.split()[:2], dtype=np.float64)
+        elif keyword == 'rot':
+            obj.rot = np.array(rest.split()[:9], dtype=np.float64)
+        elif keyword == 'loc':
+            obj.loc = np.array(rest.split()[:3], dtype=np.float64)
+        elif keyword == 'crease':
+            obj.crease = float(rest)
+        elif keyword == 'url':
+            obj.url = rest
+        elif keyword == 'numvert':
+            numvert = int(rest)
+            obj.add_nodes(_parse_rows([next(lines) for _ in range(numvert)], 3))
+        elif keyword == 'numsurf':
+            _read_surfaces(obj, lines, int(rest), skip_surfaces)
+        elif keyword == 'kids':
+            obj.kids = int(rest)
+        else:
+            logging.debug('Ignoring line in ac-file: %s', line.strip())
+
+
+def read_nodes(file_name: str) -> np.ndarray:
+    """Reads all nodes of all objects in an ac3d file as a numpy array (x, y, z) - surfaces are not parsed.
+    Contrary to File.read an IOError is raised if the file cannot be read."""
+    ac_file = File()
+    with open(file_name, 'r') as my_file:
+        _read_lines(ac_file, my_file, skip_surfaces=True)
+    return ac_file.nodes_as_array()
+
+
+# ================ UNITTESTS =======================
+
+
+class TestAC3D(unittest.TestCase):
+    def test_object_str(self):
+        obj = Object('test', texture='tex.png', default_mat_idx=1)
+        for i in range(3):
+            self.assertEqual(i, obj.node(i, 0.5, -2))
+        self.assertEqual(0, obj.face([(0, 0., 0.), (1, 1., 0.), (2, 0.25, 1.)]))
+        self.assertEqual(1, obj.face([(2, 0., 0.5), (1, 1., 0.)], typ=0x20, mat_idx=2, swap_uv=True))
+        expected = ('OBJECT poly\nname "test"\ntexture "tex.png"\nnumvert 3\n0 0.5 -2\n1 0.5 -2\n2 0.5 -2\n'
+                    'numsurf 2\nSURF 0\nmat 1\nrefs 3\n0 0 0\n1 1 0\n2 0.25 1\n'
+                    'SURF 32\nmat 2\nrefs 2\n2 0.5 0\n1 0 1\nkids 0\n')
+        self.assertEqual(expected, str(obj))
+        self.assertEqual(3, obj.total_nodes())
+        self.assertEqual(2, obj.total_faces())
+
+    def test_read_written_file(self):
+        ac_file = File()
+        obj = ac_file.new_object('test', 'tex.png', default_mat_idx=1, loc=(1, 2, 3))
+        for i in range(4):
+            obj.node(i, 0.5, -2)
+        obj.face([(0, 0., 0.), (1, 1., 0.), (2, 0.25, 1.)])
+        obj.face([(3, 0., 0.5), (2, 1., 0.), (1, 0.5, 0.5)], typ=0x20, mat_idx=2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'test.ac')
+            ac_file.write(file_name)
+            read_file = File(file_name)
+            self.assertEqual(str(ac_file), str(read_file))
+            self.assertTrue(np.array_equal(obj.nodes_as_array(), read_nodes(file_name)))
@@ -455,6 +455,29 @@ def disjoint_bounds(bounds_1: Tuple[float, float, float, float], bounds_2: Tuple
         return True
 
 
+def calc_points_along_line_local(line_coords, distances: np.ndarray) -> np.ndarray:
+    """Returns the points at the given distances along a line as an array of shape (n, 2) in local coordinates.
+
+    The same as Shapely's interpolate() for each distance, however all in one go. Like in Shapely negative distances
+    are measured from the end of the line, and the arithmetic is done in the same sequence, such that the
+    results are the same.
+    """
+    coords = np.asarray(line_coords, dtype=float)[:, :2]
+    deltas = np.diff(coords, axis=0)
+    segment_lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+    cumulated = np.concatenate(([0.], np.cumsum(segment_lengths)))
+    total_length = cumulated[-1]
+    forward = np.where(distances < 0, total_length + distances, distances)
+    forward = np.clip(forward, 0., total_length)
+    indices = np.clip(np.searchsorted(cumulated, forward, side='right') - 1, 0, len(segment_lengths) - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = (forward - cumulated[indices]) / segment_lengths[indices]
+    fractions = np.nan_to_num(fractions)
+    points = coords[indices] + fractions[:, np.newaxis] * deltas[indices]
+    points[forward >= total_length] = coords[-1]
+    return points
+
+
 def calc_horizon_elev(distance_1: float, distance_2) -> float:
     """Calculates how much a given pint a distance away is elevated over the round world.
     The distance_1 and distance_2 are right-angled in a cartesian coordinate system."""
@@ -599,6 +622,14 @@ class TestCoordinates(unittest.TestCase):
         self.assertAlmostEqual(0, x)
         self.assertAlmostEqual(-1., y)
 
+    def test_calc_points_along_line_local(self):
+        points = calc_points_along_line_local([(0, 0), (10, 0), (10, 10)], np.array([-1., -30., 0., 5., 15., 25.]))
+        self.assertEqual((6, 2), points.shape)
+        expected = [(10, 9), (0, 0), (0, 0), (5, 0), (10, 5), (10, 10)]
+        for i in range(len(expected)):
+            self.assertAlmostEqual(expected[i][0], points[i][0], 6)
+            self.assertAlmostEqual(expected[i][1], points[i][1], 6)
+
     def test_calc_horizon_elev(self):
         elev_1 = calc_horizon_elev(2000, 2000)
         elev_2 = calc_horizon_elev(2000, 0)
@@ -1,4 +1,6 @@
+import json
 import logging
+import os
 
 
 def log_level_info_or_lower():
@@ -7,3 +9,13 @@ def log_level_info_or_lower():
 
 def log_level_debug_or_lower():
     return logging.getLogger().level <= logging.DEBUG
+
+
+def append_json_record(file_name: str, record: dict) -> None:
+    """Appends a record as one JSON line with one write call, such that lines from different processes do not mix."""
+    line = json.dumps(record, sort_keys=True) + '\n'
+    fd = os.open(file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
@@ -0,0 +1,199 @@
+"""
+Lightweight instrumentation of the processing of scenery tiles: named spans (e.g. 'db.fetch') with the number of
+calls plus the wall and CPU time in seconds, and counters (e.g. 'fgelev.cache_hits').
+
+The values are collected per process and reset at the start of each tile. When a tile is finished, they are appended
+as one JSON record to a JSONL file (like the journal in tile_journal.py), such that build_tiles.py can aggregate a
+summary across all tiles of a batch run (e.g. p50/p95 per span and the slowest tiles).
+"""
+from contextlib import contextmanager
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional
+import unittest
+
+import osm2city.utils.log_helper as ulog
+
+
+METRICS_FILE_NAME = 'osm2city-metrics.jsonl'
+
+_spans = dict()  # key: name, value: list of number of calls, wall time and CPU time
+_counters = dict()  # key: name, value: int
+
+
+def reset() -> None:
+    _spans.clear()
+    _counters.clear()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Adds the wall and CPU time used within the context to the span with the given name - also if an exception
+    is raised."""
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        values = _spans.setdefault(name, [0, 0., 0.])
+        values[0] += 1
+        values[1] += time.perf_counter() - wall_start
+        values[2] += time.process_time() - cpu_start
+
+
+def count(name: str, increment: int = 1) -> None:
+    _counters[name] = _counters.get(name, 0) + increment
+
+
+def memory_usage_mb() -> Optional[float]:
+    """The resident set size (RSS) of the current process in MB. Read from /proc on Linux - otherwise the peak RSS
+    of the process is used as an upper bound. None if neither is available (e.g. on Windows)."""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024  # in bytes instead of KB
+    return peak / 1024
+
+
+def collect() -> Dict[str, dict]:
+    """The values collected since the last reset() - e.g. to be merged into the metrics of another process."""
+    return dict(spans={name: dict(calls=calls, wall=round(wall, 4), cpu=round(cpu, 4))
+                       for name, (calls, wall, cpu) in _spans.items()},
+                counters=dict(_counters))
+
+
+def merge(metrics: Dict[str, dict]) -> None:
+    """Adds values collected in another process (cf. collect())."""
+    for name, values in metrics['spans'].items():
+        current = _spans.setdefault(name, [0, 0., 0.])
+        current[0] += values['calls']
+        current[1] += values['wall']
+        current[2] += values['cpu']
+    for name, increment in metrics['counters'].items():
+        count(name, increment)
+
+
+def write_tile_metrics(file_name: Optional[str], tile_index: int, prefix: str, procedure: str, status: str,
+                       duration: float) -> None:
+    """Appends the values collected for a tile (or part of a tile) as one record. If file_name is None, then
+    nothing is written."""
+    if file_name is None:
+        return
+    record = dict(tile=tile_index, prefix=prefix, procedure=procedure, status=status, duration=round(duration, 3),
+                  time=round(time.time(), 3), pid=os.getpid())
+    record.update(collect())
+    try:
+        ulog.append_json_record(file_name, record)
+    except IOError:
+        logging.exception('Unable to write to the metrics file %s', file_name)
+
+
+def read_tile_metrics(file_name: str, since: float = 0.) -> List[dict]:
+    """Reads the records written at or after a given time (e.g. the start of a batch run)."""
+    records = list()
+    if not os.path.isfile(file_name):
+        return records
+    with open(file_name, 'r') as metrics_file:
+        for line in metrics_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning('Ignoring invalid line in metrics file: %s', line.strip())
+                continue
+            if record.get('time', 0.) >= since:
+                records.append(record)
+    return records
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of a sorted non-empty list."""
+    rank = max(0, math.ceil(percent / 100. * len(sorted_values)) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(records: List[dict], slowest: int = 5) -> Dict[str, object]:
+    """Aggregates the records of tiles to p50/p95 of the wall time per span, the totals of the counters and the
+    slowest tiles."""
+    wall_times = dict()  # key: span name, value: list of wall times per tile
+    cpu_totals = dict()
+    counters = dict()
+    for record in records:
+        for name, values in record.get('spans', dict()).items():
+            wall_times.setdefault(name, list()).append(values['wall'])
+            cpu_totals[name] = cpu_totals.get(name, 0.) + values['cpu']
+        for name, value in record.get('counters', dict()).items():
+            counters[name] = counters.get(name, 0) + value
+    spans = dict()
+    for name, values in wall_times.items():
+        values.sort()
+        spans[name] = dict(tiles=len(values), p50=_percentile(values, 50), p95=_percentile(values, 95),
+                           wall=round(sum(values), 3), cpu=round(cpu_totals[name], 3))
+    slowest_tiles = sorted(records, key=lambda r: r.get('duration', 0.), reverse=True)[:slowest]
+    return dict(tiles=len(records), spans=spans, counters=counters,
+                slowest=[(r['prefix'], r.get('duration', 0.)) for r in slowest_tiles])
+
+
+def log_summary(summary: Dict[str, object]) -> None:
+    logging.info('Metrics of %i tiles - wall time in seconds per tile:', summary['tiles'])
+    for name, values in sorted(summary['spans'].items()):
+        logging.info('  %-30s tiles: %5i  p50: %9.3f  p95: %9.3f  total wall: %10.1f  total cpu: %10.1f', name,
+                     values['tiles'], values['p50'], values['p95'], values['wall'], values['cpu'])
+    for name, value in sorted(summary['counters'].items()):
+        logging.info('  %-30s %i', name, value)
+    for prefix, duration in summary['slowest']:
+        logging.info('  Slow tile %s: %.1f seconds', prefix, duration)
+
+
+# ================ UNITTESTS =======================
+
+
+class TestMetrics(unittest.TestCase):
+    def test_span_and_merge(self):
+        reset()
+        for _ in range(2):
+            with span('db.fetch'):
+                pass
+        with self.assertRaises(ValueError):
+            with span('roads.check_blocked'):
+                raise ValueError('test')
+        count('db.rows', 10)
+        other = collect()
+        merge(other)
+        metrics = collect()
+        self.assertEqual(4, metrics['spans']['db.fetch']['calls'])
+        self.assertEqual(2, metrics['spans']['roads.check_blocked']['calls'])
+        self.assertEqual({'db.rows': 20}, metrics['counters'])
+        reset()
+        self.assertEqual(dict(spans=dict(), counters=dict()), collect())
+
+    def test_summarize(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, METRICS_FILE_NAME)
+            for index in range(1, 21):
+                reset()
+                _spans['fgelev.probe'] = [index, float(index), index / 2]
+                count('fgelev.probes', 100)
+                write_tile_metrics(file_name, index, 'e011n47_%i' % index, 'all', 'ok', float(index))
+            reset()
+            records = read_tile_metrics(file_name)
+            self.assertEqual(20, len(records))
+            self.assertEqual([], read_tile_metrics(file_name, time.time() + 10))
+            summary = summarize(records, 2)
+            self.assertEqual(10., summary['spans']['fgelev.probe']['p50'])
+            self.assertEqual(19., summary['spans']['fgelev.probe']['p95'])
+            self.assertEqual(105., summary['spans']['fgelev.probe']['cpu'])
+            self.assertEqual({'fgelev.probes': 2000}, summary['counters'])
+            self.assertEqual([('e011n47_20', 20.), ('e011n47_19', 19.)], summary['slowest'])
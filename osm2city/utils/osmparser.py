@@ -20,6 +20,7 @@ import psycopg2
 import shapely.geometry as shg
 
 from osm2city import parameters
+from osm2city.utils import metrics
 from osm2city.utils.coordinates import Transformation
 
 
@@ -483,6 +484,8 @@ def fetch_db_nodes_for_way(req_way_keys: List[str], req_way_key_values: List[str
 
 def fetch_db_nodes_isolated(req_node_keys: List[str], req_node_key_values: List[str]) -> Dict[int, Node]:
     """Fetches Node objects isolated without relation to way etc."""
+    if _data_source is not None:
+        return _data_source.fetch_nodes_isolated(req_node_keys, req_node_key_values)
     start_time = time.time()
 
     db_connection = make_db_connection()
@@ -515,14 +518,19 @@ def fetch_db_nodes_isolated(req_node_keys: List[str], req_node_key_values: List[
 
 def fetch_all_query_into_tuple(query: str, db_connection) -> List[Tuple]:
     """Given a query string and a db connection execute fetch all and return the result as a list of tuples"""
-    cur = db_connection.cursor()
-    logging.debug("Query string for execution in database: " + query)
-    cur.execute(query)
-    return cur.fetchall()
+    with metrics.span('db.fetch'):
+        cur = db_connection.cursor()
+        logging.debug("Query string for execution in database: " + query)
+        cur.execute(query)
+        result = cur.fetchall()
+    metrics.count('db.rows', len(result))
+    return result
 
 
 def _fetch_osm_db_data_ways(required: List[str], is_key_values: bool = False) -> OSMReadResult:
     """Given a list of required keys or key/value pairs get the ways plus the linked nodes from an OSM database."""
+    if _data_source is not None:
+        return _data_source.fetch_ways(required, is_key_values)
     start_time = time.time()
 
     db_connection = make_db_connection()
@@ -553,6 +561,8 @@ def fetch_osm_db_data_ways_keys(req_keys: List[str]) -> OSMReadResult:
 def fetch_osm_db_data_relations_keys(input_read_result: OSMReadResult, first_part: str,
                                      relation_debug_string: str) -> OSMReadResult:
     """Updates an OSMReadResult with relation data based on required keys"""
+    if _data_source is not None:
+        return _data_source.fetch_relations(input_read_result, relation_debug_string)
     start_time = time.time()
 
     db_connection = make_db_connection()
@@ -648,6 +658,88 @@ def fetch_osm_db_data_relations_routes(input_read_result: OSMReadResult) -> OSMR
     return fetch_osm_db_data_relations_keys(input_read_result, first_part, 'ferry_route')
 
 
+class InMemoryDataSource(object):
+    """OSM data held in memory instead of being read from the database - e.g. synthetic data for benchmarks.
+    Applies the same constraints as the database queries: tag keys resp. key/value pairs and the boundary in
+    parameters. Relations are registered per kind as used in the fetch_osm_db_data_relations_* functions
+    (e.g. 'buildings', 'places').
+    Like the database, each fetch returns new objects, as the processing changes e.g. the refs of ways. Nodes of ways
+    have no tags."""
+    def __init__(self, nodes_dict: Dict[int, Node], ways_dict: Dict[int, Way]) -> None:
+        self.nodes_dict = nodes_dict
+        self.ways_dict = ways_dict
+        self.relations = dict()  # key: kind of relation, value: relations_dict, rel_ways_dict
+
+    def add_relations(self, kind: str, relations_dict: Dict[int, Relation], rel_ways_dict: Dict[int, Way]) -> None:
+        self.relations[kind] = (relations_dict, rel_ways_dict)
+
+    @staticmethod
+    def _matches(tags: Dict[str, str], req_keys: List[str], req_key_values: List[str]) -> bool:
+        if req_keys and any(key in tags for key in req_keys):
+            return True
+        return bool(req_key_values) and any(create_key_value_pair(key, value) in req_key_values
+                                            for key, value in tags.items())
+
+    @staticmethod
+    def _in_boundary(node: Node) -> bool:
+        return parameters.BOUNDARY_WEST <= node.lon <= parameters.BOUNDARY_EAST and \
+            parameters.BOUNDARY_SOUTH <= node.lat <= parameters.BOUNDARY_NORTH
+
+    def _intersects_boundary(self, way: Way) -> bool:
+        lons = [self.nodes_dict[ref].lon for ref in way.refs]
+        lats = [self.nodes_dict[ref].lat for ref in way.refs]
+        return not (max(lons) < parameters.BOUNDARY_WEST or min(lons) > parameters.BOUNDARY_EAST or
+                    max(lats) < parameters.BOUNDARY_SOUTH or min(lats) > parameters.BOUNDARY_NORTH)
+
+    @staticmethod
+    def _copy_way(way: Way) -> Way:
+        my_way = Way(way.osm_id)
+        my_way.tags = dict(way.tags)
+        my_way.refs = list(way.refs)
+        return my_way
+
+    @staticmethod
+    def _copy_node(node: Node, with_tags: bool) -> Node:
+        my_node = Node(node.osm_id, node.lat, node.lon)
+        if with_tags:
+            my_node.tags = dict(node.tags)
+        return my_node
+
+    def _nodes_for_ways(self, ways_dict: Dict[int, Way]) -> Dict[int, Node]:
+        return {ref: self._copy_node(self.nodes_dict[ref], False) for way in ways_dict.values() for ref in way.refs}
+
+    def fetch_ways(self, required: List[str], is_key_values: bool) -> OSMReadResult:
+        req_keys, req_key_values = (list(), required) if is_key_values else (required, list())
+        ways_dict = {osm_id: self._copy_way(way) for osm_id, way in self.ways_dict.items()
+                     if self._matches(way.tags, req_keys, req_key_values) and self._intersects_boundary(way)}
+        return OSMReadResult(nodes_dict=self._nodes_for_ways(ways_dict), ways_dict=ways_dict,
+                             relations_dict=None, rel_nodes_dict=None, rel_ways_dict=None)
+
+    def fetch_nodes_isolated(self, req_node_keys: List[str], req_node_key_values: List[str]) -> Dict[int, Node]:
+        return {osm_id: self._copy_node(node, True) for osm_id, node in self.nodes_dict.items()
+                if node.tags and self._matches(node.tags, req_node_keys, req_node_key_values) and
+                self._in_boundary(node)}
+
+    def fetch_relations(self, input_read_result: OSMReadResult, kind: str) -> OSMReadResult:
+        relations_dict, rel_ways_dict = self.relations.get(kind, (dict(), dict()))
+        rel_ways_dict = {osm_id: self._copy_way(way) for osm_id, way in rel_ways_dict.items()
+                         if self._intersects_boundary(way)}
+        relations_dict = {osm_id: relation for osm_id, relation in relations_dict.items()
+                          if any(member.ref in rel_ways_dict for member in relation.members)}
+        return OSMReadResult(nodes_dict=input_read_result.nodes_dict, ways_dict=input_read_result.ways_dict,
+                             relations_dict=relations_dict, rel_nodes_dict=self._nodes_for_ways(rel_ways_dict),
+                             rel_ways_dict=rel_ways_dict)
+
+
+# If not None, then OSM data is read from this InMemoryDataSource instead of from the database
+_data_source = None
+
+
+def set_data_source(data_source: Optional[InMemoryDataSource]) -> None:
+    global _data_source
+    _data_source = data_source
+
+
 def make_db_connection():
     """"Create connection to the database based on parameters."""
     connection = psycopg2.connect(database=parameters.DB_NAME, host=parameters.DB_HOST, port=parameters.DB_PORT,
@@ -657,14 +749,27 @@ def make_db_connection():
 
 def construct_intersect_bbox_query(is_way: bool = True) -> str:
     """Constructs the part of a sql where clause, which constrains to bounding box."""
-    query_part = "ST_Intersects("
-    if is_way:
-        query_part += "w.bbox"
-    else:
-        query_part += "n.geom"
+    return _construct_intersect_query("w.bbox" if is_way else "n.geom",
+                                      parameters.BOUNDARY_WEST, parameters.BOUNDARY_SOUTH,
+                                      parameters.BOUNDARY_EAST, parameters.BOUNDARY_NORTH)
+
+
+def _construct_intersect_query(column: str, west: float, south: float, east: float, north: float) -> str:
+    query_part = "ST_Intersects(" + column
     query_part += ", ST_SetSRID(ST_MakeBox2D(ST_Point({}, {}), ST_Point({}, {})), 4326))"
-    return query_part.format(parameters.BOUNDARY_WEST, parameters.BOUNDARY_SOUTH,
-                             parameters.BOUNDARY_EAST, parameters.BOUNDARY_NORTH)
+    return query_part.format(west, south, east, north)
+
+
+def count_db_ways(req_way_keys: List[str], west: float, south: float, east: float, north: float,
+                  db_connection) -> int:
+    """Counts the ways with at least one of the required tag keys within a boundary without fetching them.
+    E.g. used to estimate the work for a tile in advance."""
+    query = "SELECT count(*) FROM ways AS w WHERE "
+    query += construct_tags_query(req_way_keys, list())
+    query += " AND "
+    query += _construct_intersect_query("w.bbox", west, south, east, north)
+    query += ";"
+    return fetch_all_query_into_tuple(query, db_connection)[0][0]
 
 
 def construct_tags_query(req_tag_keys: List[str], req_tag_key_values: List[str], table_alias: str = "w") -> str:
@@ -842,3 +947,33 @@ class TestOSMParser(unittest.TestCase):
         second_dict = {'3': '99', '4': '4'}
         combined_tags = combine_tags(first_dict, second_dict)
         self.assertEqual(4, len(combined_tags))
+
+    def test_in_memory_data_source(self):
+        original_boundary = (parameters.BOUNDARY_WEST, parameters.BOUNDARY_SOUTH, parameters.BOUNDARY_EAST,
+                             parameters.BOUNDARY_NORTH)
+        parameters.BOUNDARY_WEST, parameters.BOUNDARY_SOUTH = 8., 47.
+        parameters.BOUNDARY_EAST, parameters.BOUNDARY_NORTH = 8.1, 47.1
+        nodes_dict = dict()
+        for osm_id, lon in [(1, 8.01), (2, 8.02), (3, 8.2), (4, 8.3)]:
+            nodes_dict[osm_id] = Node(osm_id, 47.05, lon)
+            nodes_dict[osm_id].tags = {'natural': 'tree'}
+        ways_dict = dict()
+        for osm_id, refs, tags in [(11, [1, 2], {'highway': 'primary'}), (12, [2, 3], {'highway': 'service'}),
+                                   (13, [3, 4], {'highway': 'primary'}), (14, [1, 2], {'railway': 'rail'})]:
+            ways_dict[osm_id] = Way(osm_id)
+            ways_dict[osm_id].refs = refs
+            ways_dict[osm_id].tags = tags
+        set_data_source(InMemoryDataSource(nodes_dict, ways_dict))
+        try:
+            result = fetch_osm_db_data_ways_keys(['highway'])
+            self.assertEqual([11, 12], sorted(result.ways_dict.keys()))
+            self.assertEqual([1, 2, 3], sorted(result.nodes_dict.keys()))
+            self.assertEqual(dict(), result.nodes_dict[1].tags)
+            result.ways_dict[11].refs.append(3)
+            result = fetch_osm_db_data_ways_key_values(['highway=>primary'])
+            self.assertEqual([1, 2], result.ways_dict[11].refs)
+            self.assertEqual([1, 2], sorted(fetch_db_nodes_isolated(list(), ['natural=>tree']).keys()))
+        finally:
+            set_data_source(None)
+            (parameters.BOUNDARY_WEST, parameters.BOUNDARY_SOUTH, parameters.BOUNDARY_EAST,
+             parameters.BOUNDARY_NORTH) = original_boundary
@@ -1,12 +1,14 @@
 """Utilities to plot for visual debugging purposes to pdf-files using matplotlib."""
 
 import datetime
+from time import sleep
 from typing import List, Tuple
 
 from descartes import PolygonPatch
 
 from matplotlib import axes as maxs
 from matplotlib import figure as mfig
+from matplotlib import patches as pat
 from matplotlib import pyplot as plt
 
 from matplotlib.backends.backend_pdf import PdfPages
@@ -15,6 +17,7 @@ import shapely.geometry as shg
 
 import osm2city.parameters as p
 import osm2city.utils.coordinates as co
+import osm2city.utils.utilities as u
 
 
 def create_a4_landscape_figure() -> mfig.Figure:
@@ -74,3 +77,101 @@ def add_list_of_polygons(ax: maxs.Axes, polygons: List[shg.Polygon], face_color:
         if isinstance(poly, shg.Polygon) or isinstance(poly, shg.MultiPolygon):
             patch = PolygonPatch(poly, facecolor=face_color, edgecolor=edge_color)
             ax.add_patch(patch)
+
+
+def plot_fit_offsets(hull: shg.Polygon, box_minus: shg.Polygon, box_plus: shg.Polygon,
+                     angle: float,
+                     model_length_largest: bool,
+                     centroid_x: float, centroid_y: float,
+                     model_name: str, osm_id: int) -> None:
+    pdf_pages = create_pdf_pages('fit_offset_' + str(osm_id))
+
+    my_figure = create_a4_landscape_figure()
+    title = 'osm_id={},\n model={},\n angle={},\n length_largest={}'.format(osm_id, model_name, angle,
+                                                                            model_length_largest)
+    my_figure.suptitle(title)
+
+    ax = my_figure.add_subplot(111)
+
+    patch = PolygonPatch(hull, facecolor='none', edgecolor="black")
+    ax.add_patch(patch)
+    patch = PolygonPatch(box_minus, facecolor='none', edgecolor="green")
+    ax.add_patch(patch)
+    patch = PolygonPatch(box_plus, facecolor='none', edgecolor="red")
+    ax.add_patch(patch)
+    ax.add_patch(pat.Circle((centroid_x, centroid_y), radius=0.4, linewidth=2,
+                            color='blue', fill=False))
+    bounds = u.bounds_from_list([box_minus.bounds, box_plus.bounds])
+    set_ax_limits_bounds(ax, bounds)
+
+    pdf_pages.savefig(my_figure)
+
+    pdf_pages.close()
+
+    sleep(2)  # to make sure we have not several files in same second
+
+
+def plot_blocked_areas_roads(blocked_areas: List[shg.Polygon], ways: List[shg.LineString],
+                             transform: co.Transformation) -> None:
+    pdf_pages = create_pdf_pages('blocked_areas_roads')
+
+    # Generated buildings
+    my_figure = create_a3_landscape_figure()
+    my_figure.suptitle("Blocked Areas")
+    ax = my_figure.add_subplot(111)
+
+    # first blocked areas
+    add_list_of_polygons(ax, blocked_areas, 'magenta', 'black')
+
+    # then the lines
+    for line in ways:
+        plot_line(ax, line, 'green', 1)
+
+    set_ax_limits_from_tile(ax, transform)
+    pdf_pages.savefig(my_figure)
+
+    pdf_pages.close()
+    plt.close("all")
+
+
+def plot_blocked_areas_and_stg_entries(blocked_areas: List[shg.Polygon], static_objects: List[shg.Polygon],
+                                       shared_objects: List[shg.Polygon], before: List[shg.Polygon],
+                                       after: List[shg.Polygon], transform: co.Transformation) -> None:
+    pdf_pages = create_pdf_pages('blocked_apt_areas_incl_stg_objects')
+
+    # Blocked areas
+    my_figure = create_large_figure()
+    my_figure.suptitle('Blocked Areas for airports (magenta) as well as static (green) and shared (cyan) stg entries\
+and buildings (yellow)')
+    ax = my_figure.add_subplot(111)
+
+    # first blocked areas
+    add_list_of_polygons(ax, blocked_areas, 'magenta', 'magenta')
+    # then the static stg entries
+    add_list_of_polygons(ax, static_objects, 'green', 'green')
+    # then the shared stg entries
+    add_list_of_polygons(ax, shared_objects, 'cyan', 'cyan')
+    # and finally the shared stg entries
+    add_list_of_polygons(ax, before, 'yellow', 'yellow')
+    set_ax_limits_from_tile(ax, transform)
+    pdf_pages.savefig(my_figure)
+
+    my_figure = create_large_figure()
+    my_figure.suptitle('Before buildings (red) and after buildings (yellow)')
+    ax = my_figure.add_subplot(111)
+    add_list_of_polygons(ax, before, 'red', 'red')
+    add_list_of_polygons(ax, after, 'yellow', 'yellow')
+    set_ax_limits_from_tile(ax, transform)
+    pdf_pages.savefig(my_figure)
+
+    my_figure = create_large_figure()
+    my_figure.suptitle('Only blocked areas')
+    ax = my_figure.add_subplot(111)
+    add_list_of_polygons(ax, blocked_areas, 'magenta', 'magenta')
+    add_list_of_polygons(ax, static_objects, 'green', 'green')
+    add_list_of_polygons(ax, shared_objects, 'cyan', 'cyan')
+    set_ax_limits_from_tile(ax, transform)
+    pdf_pages.savefig(my_figure)
+
+    pdf_pages.close()
+    plt.close("all")
@@ -0,0 +1,100 @@
+"""
+Optional profiling of selected scenery tiles and procedures in production runs - also within the worker processes
+of build_tiles.py, as the settings are read from the parameters (cf. PROFILE_* in parameters.py).
+
+* cProfile statistics are written per tile (resp. part of a tile) and procedure to <prefix>_<procedure>.pstats.
+* With tracemalloc the peak memory and the source lines with the most allocated memory are reported per procedure.
+"""
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import tempfile
+import tracemalloc
+from typing import Iterator
+import unittest
+
+from osm2city import parameters
+
+
+def _is_selected(tile_index: int, procedure: str) -> bool:
+    if parameters.PROFILE_DIRECTORY is None and not parameters.PROFILE_MEMORY:
+        return False
+    if parameters.PROFILE_TILES and tile_index not in parameters.PROFILE_TILES:
+        return False
+    if parameters.PROFILE_PROCEDURES and procedure not in parameters.PROFILE_PROCEDURES:
+        return False
+    return True
+
+
+def _report_memory(prefix: str, procedure: str, peak: int, snapshot: tracemalloc.Snapshot) -> None:
+    lines = ['Peak memory traced in {} for {}: {:.1f} MB'.format(procedure, prefix, peak / 1024 / 1024)]
+    for stat in snapshot.statistics('lineno')[:parameters.PROFILE_MEMORY_TOP]:
+        lines.append('  {}'.format(stat))
+    logging.info('\n'.join(lines))
+    if parameters.PROFILE_DIRECTORY is not None:
+        file_name = os.path.join(parameters.PROFILE_DIRECTORY, '{}_{}_memory.txt'.format(prefix, procedure))
+        with open(file_name, 'w') as report:
+            report.write('\n'.join(lines) + '\n')
+
+
+@contextmanager
+def profile(tile_index: int, prefix: str, procedure: str) -> Iterator[None]:
+    """Profiles the code run within the context if the tile and procedure are selected in the parameters.
+    The results are also written if an exception is raised."""
+    if not _is_selected(tile_index, procedure):
+        yield
+        return
+
+    profiler = None
+    if parameters.PROFILE_DIRECTORY is not None:
+        os.makedirs(parameters.PROFILE_DIRECTORY, exist_ok=True)
+        profiler = cProfile.Profile()
+    if parameters.PROFILE_MEMORY:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        if parameters.PROFILE_MEMORY:  # before writing the profile, such that its allocations are not reported
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            tracemalloc.stop()
+            _report_memory(prefix, procedure, peak, snapshot)
+        if profiler:
+            file_name = os.path.join(parameters.PROFILE_DIRECTORY, '{}_{}.pstats'.format(prefix, procedure))
+            profiler.dump_stats(file_name)
+            logging.info('Written profile of %s for %s to %s', procedure, prefix, file_name)
+
+
+# ================ UNITTESTS =======================
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.original = (parameters.PROFILE_DIRECTORY, parameters.PROFILE_TILES, parameters.PROFILE_PROCEDURES,
+                         parameters.PROFILE_MEMORY)
+
+    def tearDown(self):
+        (parameters.PROFILE_DIRECTORY, parameters.PROFILE_TILES, parameters.PROFILE_PROCEDURES,
+         parameters.PROFILE_MEMORY) = self.original
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parameters.PROFILE_DIRECTORY = tmp_dir
+            parameters.PROFILE_TILES = [1]
+            parameters.PROFILE_PROCEDURES = ['roads']
+            parameters.PROFILE_MEMORY = True
+            for tile_index, procedure in [(1, 'roads'), (1, 'buildings'), (2, 'roads')]:
+                with profile(tile_index, 'e011n47_%i' % tile_index, procedure):
+                    _ = [str(i) for i in range(1000)]
+            self.assertEqual(['e011n47_1_roads.pstats', 'e011n47_1_roads_memory.txt'], sorted(os.listdir(tmp_dir)))
+            self.assertFalse(tracemalloc.is_tracing())
+
+    def test_not_selected(self):
+        parameters.PROFILE_DIRECTORY = None
+        parameters.PROFILE_MEMORY = False
+        self.assertFalse(_is_selected(1, 'roads'))
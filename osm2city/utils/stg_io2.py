@@ -11,21 +11,45 @@ STG_file represents an .stg file. Usually you don't deal with them directly,
 
 @author: tom
 """
+from concurrent.futures import ThreadPoolExecutor
 import enum
+import hashlib
+import json
 import logging
 import multiprocessing as mp
 import os
+import pickle
+import tempfile
+import threading
 import time
-from typing import List, Optional, Tuple
+from typing import Callable, Iterable, List, Optional, Tuple
+import unittest
 
+try:
+    import fcntl
+except ImportError:  # e.g. on Windows, where the lock for all processes is used
+    fcntl = None
+
+import numpy as np
 from shapely import affinity
 import shapely.geometry as shg
 
 from osm2city import parameters
-from osm2city.utils import calc_tile
+from osm2city.utils import ac3d, calc_tile, metrics
 from osm2city.utils.coordinates import Transformation, Vec2d
 
 
+HULL_CACHE_FILE_NAME = 'overlap_check_hulls.pkl'
+LOCKING_PER_STG_FILE = fcntl is not None
+STG_FRAGMENT_SUFFIX = '.fragment'
+STG_LOCK_DIRECTORY = 'stg_locks'  # in the working directory, such that no lock-files end up in the scenery
+STG_LOCK_SUFFIX = '.lock'
+STG_TEMP_SUFFIX = '.tmp'
+_LAST_WRITTEN = '# Last Written '
+_TILE_PART = '# Tile part '
+MANIFESTS_DIRECTORY = 'manifests'
+
+
 @enum.unique
 class LOD(enum.IntEnum):
     rough = 0
@@ -78,6 +102,7 @@ class STGFile(object):
         """Read all lines from stg to memory.
            Store our/other lines in two separate lists."""
         scenery_name = scenery_directory_name(scenery_type)
+        self.path_to_scenery = path_to_scenery
         self.path_to_stg = calc_tile.construct_path_to_files(path_to_scenery, scenery_name, (lon_lat.lon, lon_lat.lat))
         tile_index = calc_tile.calc_tile_index((lon_lat.lon, lon_lat.lat))
         self.file_name = os.path.join(self.path_to_stg, calc_tile.construct_stg_file_name_from_tile_index(tile_index))
@@ -88,36 +113,18 @@ class STGFile(object):
         self.our_magic_start = _make_delimiter_string(magic, prefix, True)
         self.our_magic_end = _make_delimiter_string(magic, prefix, False)
 
-    def _read(self) -> None:
-        """read others and ours from file"""
+    def _read(self) -> List[str]:
+        """read others and ours from file. Returns all lines read."""
         try:
             stg = open(self.file_name, 'r')
             lines = stg.readlines()
             stg.close()
         except IOError as ioe:
             logging.debug("Error reading %s as it might not exist yet: %s", self.file_name, ioe)
-            return
-
-        self.other_list = []
-        # if our magic is not present, then use the whole file content
-        if lines.count(self.our_magic_start) == 0:
-            self.other_list = lines
-            return
-        # otherwise handle the possibility for several sections
-        while lines.count(self.our_magic_start) > 0:
-            try:
-                ours_start = lines.index(self.our_magic_start)
-            except ValueError:
-                self.other_list = lines
-                break
-
-            try:
-                ours_end = lines.index(self.our_magic_end)
-            except ValueError:
-                ours_end = len(lines)
+            return list()
 
-            self.other_list = self.other_list + lines[:ours_start]
-            lines = lines[ours_end + 1:]
+        self.other_list = _remove_sections(lines, self.our_magic_start, self.our_magic_end)
+        return lines
 
     def add_object(self, stg_verb: str, ac_file_name: str, lon_lat, elev: float, hdg: float,
                    radius: Optional[float]) -> str:
@@ -141,30 +148,221 @@ class STGFile(object):
         _make_path_to_stg(self.path_to_stg)
         return self.path_to_stg
 
+    def _our_section(self) -> List[str]:
+        """The lines of our section including the magic delimiters."""
+        section = [self.our_magic_start, "# do not edit below this line\n",
+                   _LAST_WRITTEN + "%s\n" % time.strftime("%c")]
+        if parameters.TILE_PART:
+            section.append(_TILE_PART + "%i of %i\n" % (parameters.TILE_PART, parameters.TILE_PARTS))
+        section.append("#\n")
+        section.extend(self.our_list)
+        section.append(self.our_magic_end)
+        return section
+
     def write(self) -> None:
         """write stg-objects from other procedures (e.g. piers.py) and our procedure (e.g. pylons.py) to file.
         Other stuff is read if the file already exists.
         Our stuff was added through the add_object(...) method.
+        If available, an exclusive advisory lock is held on a lock-file in STG_LOCK_DIRECTORY while reading and
+        writing, such that processes writing to other stg-files are never blocked. The stg-file is replaced
+        atomically, so it is never seen partly written - and the lock is not lost when replacing the file.
         """
-        # Read the current content if it already exists
-        self._read()
-        # Write the content
-        stg = open(self.file_name, 'w')
-        logging.info("Writing %d other lines" % len(self.other_list))
-        for line in self.other_list:
-            stg.write(line)
+        _output_files.append(self.file_name)
+        if fcntl is None:
+            self._read_and_replace()
+            return
 
+        lock_file_name = os.path.join(STG_LOCK_DIRECTORY,
+                                      os.path.relpath(self.file_name, self.path_to_scenery) + STG_LOCK_SUFFIX)
+        _make_path_to_stg(os.path.dirname(lock_file_name))
+        with open(lock_file_name, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)  # released when the file is closed
+            self._read_and_replace()
+
+    def _read_and_replace(self) -> None:
+        """Reads the current content if it already exists and replaces the file unless unchanged."""
+        old_lines = self._read()
+        self.other_list = _remove_stale_part_sections(self.other_list, self.our_magic_start,
+                                                      parameters.TILE_PART, parameters.TILE_PARTS)
+        new_lines = self._new_lines()
+        if not _is_unchanged(old_lines, new_lines):
+            temp_file_name = _temp_file_name(self.file_name)
+            with open(temp_file_name, 'w') as stg:
+                stg.writelines(new_lines)
+            os.replace(temp_file_name, self.file_name)
+
+    def _new_lines(self) -> List[str]:
+        """The lines of the stg-file: other lines plus our section if there is anything in it."""
+        logging.info("Writing %d other lines" % len(self.other_list))
+        new_lines = list(self.other_list)
         if self.our_list:
             logging.info("Writing %d lines" % len(self.our_list))
-            stg.write(self.our_magic_start)
-            stg.write("# do not edit below this line\n")
-            stg.write("# Last Written %s\n#\n" % time.strftime("%c"))
-            for line in self.our_list:
-                logging.debug(line.strip())
-                stg.write(line)
-            stg.write(self.our_magic_end)
+            new_lines.extend(self._our_section())
+        return new_lines
+
+    def write_fragment(self) -> None:
+        """Writes only our section to a fragment file next to the stg-file without reading the stg-file.
+        The fragments get merged into the stg-file by merge_stg_fragments(...) - an empty fragment makes
+        sure that an old section of ours gets removed.
+        The file name contains the magic and prefix, so no other process writes to the same fragment."""
+        fragment_name = '{}.{}{}'.format(self.file_name, self.our_magic_start[2:].strip(), STG_FRAGMENT_SUFFIX)
+        logging.info("Writing %d lines to fragment %s", len(self.our_list), fragment_name)
+        _output_files.append(fragment_name)
+        # replaced atomically, such that a merge never sees a partly written fragment
+        temp_file_name = _temp_file_name(fragment_name)
+        with open(temp_file_name, 'w') as fragment:
+            fragment.writelines(self._our_section())
+        os.replace(temp_file_name, fragment_name)
+
+
+def _temp_file_name(file_name: str) -> str:
+    """The file written before replacing file_name. Left behind if the process gets killed in between -
+    cf. remove_temporary_files(...)."""
+    return '{}.{}{}'.format(file_name, os.getpid(), STG_TEMP_SUFFIX)
+
+
+def remove_temporary_files(path_to_output: str) -> int:
+    """Removes the temporary stg and fragment files below the path, which a killed process has left behind.
+    Must only be called when no process is writing. Returns the number of removed files."""
+    number_of_files = 0
+    for dir_path, _, file_names in os.walk(path_to_output):
+        for file_name in file_names:
+            if '.stg.' in file_name and file_name.endswith(STG_TEMP_SUFFIX):
+                os.remove(os.path.join(dir_path, file_name))
+                number_of_files += 1
+    if number_of_files:
+        logging.info('Removed %i temporary stg files left behind', number_of_files)
+    return number_of_files
+
+
+def _is_unchanged(old_lines: List[str], new_lines: List[str]) -> bool:
+    """Whether an stg-file would not change except for the time stamps in the sections -
+    only checked if parameters.WRITE_SKIP_UNCHANGED is True."""
+    if not parameters.WRITE_SKIP_UNCHANGED or len(old_lines) != len(new_lines):
+        return False
+    for old_line, new_line in zip(old_lines, new_lines):
+        if old_line != new_line and not (old_line.startswith(_LAST_WRITTEN) and new_line.startswith(_LAST_WRITTEN)):
+            return False
+    logging.info('Skipping writing of unchanged stg-file')
+    return True
+
+
+def _remove_sections(lines: List[str], our_magic_start: str, our_magic_end: str) -> List[str]:
+    """Returns the lines of an stg-file without the (maybe several) sections within our delimiters."""
+    # if our magic is not present, then use the whole file content
+    if lines.count(our_magic_start) == 0:
+        return lines
+    other_list = []
+    # otherwise handle the possibility for several sections
+    while lines.count(our_magic_start) > 0:
+        try:
+            ours_start = lines.index(our_magic_start)
+        except ValueError:
+            other_list = lines
+            break
 
-        stg.close()
+        try:
+            ours_end = lines.index(our_magic_end)
+        except ValueError:
+            ours_end = len(lines)
+
+        other_list = other_list + lines[:ours_start]
+        lines = lines[ours_end + 1:]
+    return other_list + lines  # keep e.g. sections of other prefixes written after ours
+
+
+def _remove_stale_part_sections(lines: List[str], our_magic_start: str, part: int, parts: int) -> List[str]:
+    """Removes the sections written in an earlier run, in which the tile was split differently into parts
+    (cf. parameters.TILE_PART). Otherwise objects would be in the stg-file twice.
+    If the tile is processed as a whole, then all sections of parts are removed. Otherwise the section of the
+    whole tile and of parts beyond the number of parts are removed - but not the ones of the other current parts."""
+    start_without_part = our_magic_start.rstrip('\n')
+    stale_starts = list()
+    first_stale_part = 1
+    if part:
+        start_without_part = start_without_part[:start_without_part.rindex('_')]
+        stale_starts.append(start_without_part + '\n')
+        first_stale_part = parts + 1
+    prefix_of_parts = start_without_part + '_'
+    for line in lines:
+        if line.startswith(prefix_of_parts) and line[len(prefix_of_parts):-1].isdigit():
+            if int(line[len(prefix_of_parts):-1]) >= first_stale_part:
+                stale_starts.append(line)
+    for stale_start in stale_starts:
+        lines = _remove_sections(lines, stale_start, '# END ' + stale_start[2:])
+    return lines
+
+
+def _parse_tile_part(section: List[str]) -> Tuple[int, int]:
+    """The part and number of parts written by _our_section() - or (0, 1) for a whole tile."""
+    for line in section:
+        if line.startswith(_TILE_PART):
+            part, parts = line[len(_TILE_PART):].split(' of ')
+            return int(part), int(parts)
+    return 0, 1
+
+
+def _is_valid_section(section: List[str]) -> bool:
+    """Whether the lines of a fragment start with a start delimiter and end with the matching end delimiter."""
+    if len(section) < 2 or not section[0].startswith('# ') or section[0].startswith('# END '):
+        return False
+    return section[-1] == '# END ' + section[0][2:]
+
+
+def merge_stg_fragments(path_to_output: str) -> int:
+    """Merges all stg fragment files below the path into their stg-files and removes the fragments.
+    Cf. STGFile.write_fragment(). Must only be called when no process is writing anymore.
+    Fragments, which are empty or not delimited like a section (e.g. truncated), are skipped and kept.
+    Temporary files left behind by killed processes are removed. Returns the number of merged fragments."""
+    remove_temporary_files(path_to_output)
+    number_of_fragments = 0
+    for dir_path, _, file_names in os.walk(path_to_output):
+        fragments_per_stg = dict()  # key: stg file name, value: list of fragment file names
+        for file_name in sorted(file_names):
+            if file_name.endswith(STG_FRAGMENT_SUFFIX):
+                stg_file_name = file_name[:file_name.index('.stg.') + 4]
+                fragments_per_stg.setdefault(stg_file_name, list()).append(file_name)
+        for stg_file_name, fragment_names in fragments_per_stg.items():
+            stg_path = os.path.join(dir_path, stg_file_name)
+            lines = list()
+            if os.path.isfile(stg_path):
+                with open(stg_path, 'r') as stg:
+                    lines = stg.readlines()
+            sections = list()
+            merged_names = list()
+            for fragment_name in fragment_names:
+                with open(os.path.join(dir_path, fragment_name), 'r') as fragment:
+                    section = fragment.readlines()
+                if not _is_valid_section(section):
+                    logging.warning('Skipping stg fragment %s, which is empty or not properly delimited',
+                                    os.path.join(dir_path, fragment_name))
+                    continue
+                lines = _remove_sections(lines, section[0], section[-1])
+                lines = _remove_stale_part_sections(lines, section[0], *_parse_tile_part(section))
+                if any(not line.startswith('#') for line in section):  # not only the delimiters and comments
+                    sections.extend(section)
+                merged_names.append(fragment_name)
+            if not merged_names:
+                continue
+            with open(stg_path, 'w') as stg:
+                stg.writelines(lines)
+                stg.writelines(sections)
+            for fragment_name in merged_names:
+                os.remove(os.path.join(dir_path, fragment_name))
+            number_of_fragments += len(merged_names)
+    logging.info('Merged %i stg fragments', number_of_fragments)
+    return number_of_fragments
+
+
+_output_files = list()  # the files written in this process since the last call of pop_output_files()
+
+
+def pop_output_files() -> List[str]:
+    """The files written (or skipped because unchanged) through STGManager and STGFile since the last call."""
+    global _output_files
+    output_files = _output_files
+    _output_files = list()
+    return output_files
 
 
 def _make_path_to_stg(path_to_stg: str) -> None:
@@ -176,6 +374,96 @@ def _make_path_to_stg(path_to_stg: str) -> None:
             raise e
 
 
+class _BackgroundFileWriter(object):
+    """Writes files in background threads, such that e.g. the next cluster can be built while the
+    previous one is written to disk. At most parameters.WRITE_BEHIND_QUEUE_SIZE files wait to be written,
+    such that not too many of them are kept in memory.
+    If parameters.WRITE_BEHIND_THREADS is 0, then the files are written directly."""
+    __slots__ = ('_executor', '_futures', '_free_slots')
+
+    def __init__(self) -> None:
+        self._executor = None
+        self._futures = list()
+        self._free_slots = None
+
+    def submit(self, write_function: Callable, *args) -> None:
+        if parameters.WRITE_BEHIND_THREADS < 1:
+            write_function(*args)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=parameters.WRITE_BEHIND_THREADS,
+                                                thread_name_prefix='file_writer')
+            self._free_slots = threading.BoundedSemaphore(parameters.WRITE_BEHIND_THREADS +
+                                                          max(0, parameters.WRITE_BEHIND_QUEUE_SIZE))
+        self._free_slots.acquire()  # blocks if the queue is full
+        future = self._executor.submit(write_function, *args)
+        future.add_done_callback(lambda _: self._free_slots.release())
+        self._futures.append(future)
+
+    def flush(self) -> None:
+        """Waits until all submitted files are written. Raises the first exception from writing a file."""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        futures = self._futures
+        self._futures = list()
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def cancel(self) -> None:
+        """Abandons the files not yet being written and waits for the ones being written - e.g. if the processing
+        failed before flush(). Exceptions from writing are only logged."""
+        if self._executor is None:
+            return
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        futures = self._futures
+        self._futures = list()
+        for future in futures:
+            if not future.cancelled() and future.exception() is not None:
+                logging.warning('Writing a file failed after cancelling: %s', future.exception())
+
+
+def _write_text_file(text: str, file_name: str) -> None:
+    with open(file_name, 'w') as text_file:
+        text_file.write(text)
+
+
+def _write_chunks_if_changed(chunks: Iterable[str], file_name: str) -> Tuple[bool, str, int]:
+    """Writes the chunks of text to a file unless the file already has exactly the same content.
+    The existing content is compared chunk by chunk while streaming, such that the new content is never
+    kept in memory as a whole. From the first difference on the rest gets written.
+    Returns whether the file was (re-)written, the SHA-1 hex digest of the content and its size in bytes."""
+    sha1 = hashlib.sha1()
+    size = 0
+    written = False
+    try:
+        out_file = open(file_name, 'r+b')
+    except FileNotFoundError:
+        out_file = open(file_name, 'wb')
+        written = True
+    with out_file:
+        for chunk in chunks:
+            data = chunk.encode()
+            sha1.update(data)
+            size += len(data)
+            if not written:
+                position = out_file.tell()
+                if out_file.read(len(data)) == data:
+                    continue
+                out_file.seek(position)
+                written = True
+            out_file.write(data)
+        if out_file.tell() != os.fstat(out_file.fileno()).st_size:  # old content was longer
+            out_file.truncate()
+            written = True
+    return written, sha1.hexdigest(), size
+
+
 class STGManager(object):
     """manages STG objects. Knows about scenery path.
        prefix separates different writers to work around two PREFIX areas interleaving 
@@ -186,6 +474,8 @@ class STGManager(object):
         self.magic = magic
         self.prefix = prefix
         self.scenery_type = scenery_type
+        self._file_writer = _BackgroundFileWriter()
+        self._manifest = dict()  # key: file name, value: (SHA-1, size, written) if parameters.WRITE_SKIP_UNCHANGED
 
     def _find_create_stg_file(self, lon_lat: Vec2d) -> STGFile:
         """Finds an STGFile for a given coordinate. If not yet registered, then new one created."""
@@ -222,11 +512,68 @@ class STGManager(object):
                                                       lon_lat.lon, lon_lat.lat, elev)
         return the_stg_file.add_line(line)
 
+    def write_ac_file(self, ac_file: ac3d.File, file_name: str) -> None:
+        """Writes an ac-file referenced in the stg-files - in the background if configured. Cf. write()."""
+        _output_files.append(file_name)
+        metrics.count('ac3d.vertices', int(ac_file.total_nodes()))
+        metrics.count('ac3d.faces', int(ac_file.total_faces()))
+        if parameters.WRITE_SKIP_UNCHANGED:
+            self._file_writer.submit(self._write_chunks, ac_file.text_chunks(), file_name)
+        else:
+            self._file_writer.submit(ac_file.write, file_name)
+
+    def write_text_file(self, text: str, file_name: str) -> None:
+        """Writes a text file (e.g. an ac-file as text or a list of shader buildings) referenced in the stg-files -
+        in the background if configured. Cf. write()."""
+        _output_files.append(file_name)
+        if parameters.WRITE_SKIP_UNCHANGED:
+            self._file_writer.submit(self._write_chunks, [text], file_name)
+        else:
+            self._file_writer.submit(_write_text_file, text, file_name)
+
+    def _write_chunks(self, chunks: Iterable[str], file_name: str) -> None:
+        written, sha1, size = _write_chunks_if_changed(chunks, file_name)
+        if not written:
+            logging.debug('Skipped writing unchanged file %s', file_name)
+        self._manifest[file_name] = (sha1, size, written)
+
+    def _write_manifest(self) -> None:
+        """Writes the SHA-1 and size of all files written through this manager to a JSON manifest per prefix
+        (i.e. per tile) in a 'manifests' directory of the scenery type. Paths are relative to the scenery type."""
+        if not self._manifest or self.prefix is None:
+            return
+        path_to_type = os.path.join(self.path_to_scenery, scenery_directory_name(self.scenery_type))
+        path_to_manifests = os.path.join(path_to_type, MANIFESTS_DIRECTORY)
+        _make_path_to_stg(path_to_manifests)
+        files = dict()
+        for file_name, (sha1, size, written) in sorted(self._manifest.items()):
+            files[os.path.relpath(file_name, path_to_type)] = dict(sha1=sha1, size=size, written=written)
+        with open(os.path.join(path_to_manifests, self.prefix + '.json'), 'w') as manifest:
+            json.dump(dict(magic=self.magic, prefix=self.prefix, files=files), manifest, indent=1)
+        self._manifest = dict()
+
+    def cancel(self) -> None:
+        """Abandons the files from write_ac_file(...) and write_text_file(...), which are not yet written.
+        To be called in a finally block after write(...), such that no writes are left pending in the background
+        if the processing fails. Does nothing if write(...) has already been called."""
+        self._file_writer.cancel()
+
     def write(self, file_lock: mp.Lock = None):
         """Writes all new scenery objects including the already existing back to stg-files.
+        First waits until all files written through write_ac_file(...) and write_text_file(...) are on disk.
         The file_lock object makes sure that only the current process is reading and writing stg-files in order
-        to avoid conflicts.
+        to avoid conflicts. It is only used if locking per stg-file is not available (cf. STGFile.write()).
+        If parameters.STG_WRITE_FRAGMENTS is True, then fragments are written instead without locking.
+        If parameters.WRITE_SKIP_UNCHANGED is True, then unchanged files are not rewritten and a manifest is written.
         """
+        self._file_writer.flush()
+        self._write_manifest()
+        if parameters.STG_WRITE_FRAGMENTS:  # no lock needed as each process writes to its own files
+            for the_stg in self.stg_dict.values():
+                the_stg.write_fragment()
+            return
+        if fcntl is not None:
+            file_lock = None
         if file_lock is not None:
             file_lock.acquire()
         for key, the_stg in self.stg_dict.items():
@@ -338,12 +685,13 @@ def read_stg_entries(stg_path_and_name: str, our_magic: str = "",
     return entries
 
 
-def read_stg_entries_in_boundary(transform: Transformation, for_roads: bool) -> List[STGEntry]:
+def read_stg_entries_in_tile(transform: Transformation) -> List[STGEntry]:
     """Returns a list of all STGEntries within the boundary according to parameters.
     Adds all tiles bordering the chosen tile in order to make sure that objects crossing tile borders but
     maybe located outside also are taken into account.
     It uses the PATH_TO_SCENERY and PATH_TO_SCENERY_OPT (which are static), not PATH_TO_OUTPUT.
-    If my_cord_transform is set, then for each entry the convex hull is calculated in local coordinates.
+    For each entry the convex hull is calculated in local coordinates.
+    Exclude areas are not applied - cf. read_stg_entries_in_boundary(...).
     """
     bucket_span = calc_tile.bucket_span(parameters.BOUNDARY_NORTH - (
             parameters.BOUNDARY_NORTH - parameters.BOUNDARY_SOUTH) / 2)
@@ -377,6 +725,21 @@ def read_stg_entries_in_boundary(transform: Transformation, for_roads: bool) ->
     tile_box = shg.box(south_west[0], south_west[1], north_east[0], north_east[1])
 
     _parse_stg_entries_for_convex_hull(stg_entries, transform, tile_box)
+    _model_hull_cache.save()
+    return stg_entries
+
+
+def read_stg_entries_in_boundary(transform: Transformation, for_roads: bool,
+                                 stg_entries_in_tile: List[STGEntry] = None) -> List[STGEntry]:
+    """Returns a list of all STGEntries within the boundary according to parameters plus fake entries for the
+    exclude areas of either roads or buildings.
+    The entries from read_stg_entries_in_tile(...) can be passed in, such that the stg-files only need to be
+    read once per tile - the passed list itself is not changed.
+    """
+    if stg_entries_in_tile is None:
+        stg_entries = read_stg_entries_in_tile(transform)
+    else:
+        stg_entries = list(stg_entries_in_tile)
 
     # after having all original stg-entries, lets check for exclude areas
     if for_roads:
@@ -443,11 +806,10 @@ def _parse_stg_entries_for_convex_hull(stg_entries: List[STGEntry], my_coord_tra
             try:
                 ac_filename = entry.obj_filename
                 if ac_filename.endswith(".xml"):
-                    entry.overwrite_filename(_extract_ac_from_xml(entry.get_obj_path_and_name(),
-                                                                  entry.get_obj_path_and_name(
-                                                                      parameters.PATH_TO_SCENERY)))
-                boundary_polygon = _extract_boundary(entry.get_obj_path_and_name(),
-                                                     entry.get_obj_path_and_name(parameters.PATH_TO_SCENERY))
+                    entry.overwrite_filename(_model_hull_cache.ac_filename_from_xml(
+                        entry.get_obj_path_and_name(), entry.get_obj_path_and_name(parameters.PATH_TO_SCENERY)))
+                boundary_polygon = _model_hull_cache.boundary(entry.get_obj_path_and_name(),
+                                                              entry.get_obj_path_and_name(parameters.PATH_TO_SCENERY))
                 rotated_polygon = affinity.rotate(boundary_polygon, entry.hdg - 90, (0, 0))
                 x_y_point = my_coord_transformation.to_local((entry.lon, entry.lat))
                 translated_polygon = affinity.translate(rotated_polygon, x_y_point[0], x_y_point[1])
@@ -475,28 +837,120 @@ def _parse_stg_entries_for_convex_hull(stg_entries: List[STGEntry], my_coord_tra
                 stg_entries.remove(entry)
 
 
+class _ModelHullCache(object):
+    """Caches the convex hull of ac-files in model space and the ac-file referenced in xml-files.
+
+    The same shared models (pylons, houses, lights etc.) are referenced thousands of times. Therefore the values are
+    cached per resolved file path together with the file's modification time - i.e. a changed file gets read again.
+    The cache is kept in memory per process and if parameters.OVERLAP_CHECK_HULL_CACHE is True also on disk across
+    runs in HULL_CACHE_FILE_NAME in the working directory (like the fgelev cache).
+    """
+    __slots__ = ('_boundaries', '_ac_filenames', '_loaded', '_changed')
+
+    def __init__(self) -> None:
+        self._boundaries = dict()  # key: absolute path to ac-file, value: tuple (mtime, convex hull)
+        self._ac_filenames = dict()  # key: absolute path to xml-file, value: tuple (mtime, ac-file name or None)
+        self._loaded = False
+        self._changed = False
+
+    @staticmethod
+    def _read_file() -> Optional[Tuple[dict, dict]]:
+        try:
+            with open(HULL_CACHE_FILE_NAME, 'rb') as file_pickle:
+                return pickle.load(file_pickle)
+        except (IOError, EOFError, pickle.UnpicklingError) as reason:
+            logging.debug('Loading convex hull cache failed (%s)', reason)
+            return None
+
+    def _load(self) -> None:
+        self._loaded = True
+        if not parameters.OVERLAP_CHECK_HULL_CACHE:
+            return
+        cached = self._read_file()
+        if cached is not None:
+            for key, value in cached[0].items():
+                self._boundaries.setdefault(key, value)
+            for key, value in cached[1].items():
+                self._ac_filenames.setdefault(key, value)
+            logging.info('Loaded %i convex hulls from cache', len(cached[0]))
+
+    def _lookup(self, my_cache: dict, file_name: str) -> Tuple[str, float, Optional[tuple]]:
+        if not self._loaded:
+            self._load()
+        key = os.path.abspath(file_name)
+        mtime = os.path.getmtime(key)  # raises OSError (IOError) if the file does not exist
+        cached = my_cache.get(key)
+        if cached is not None and cached[0] == mtime:
+            return key, mtime, cached
+        return key, mtime, None
+
+    def boundary(self, ac_filename: str, alternative_ac_filename: str = None) -> shg.Polygon:
+        """Same as _extract_boundary(...), but cached."""
+        key, mtime, cached = self._lookup(self._boundaries, _checked_file_name(ac_filename, alternative_ac_filename))
+        if cached is not None:
+            return cached[1]
+        hull_polygon = _extract_boundary(key)
+        self._boundaries[key] = (mtime, hull_polygon)
+        self._changed = True
+        return hull_polygon
+
+    def ac_filename_from_xml(self, xml_filename: str, alternative_xml_filename: str = None) -> str:
+        """Same as _extract_ac_from_xml(...), but cached. Also a missing ac-file reference is cached."""
+        key, mtime, cached = self._lookup(self._ac_filenames,
+                                          _checked_file_name(xml_filename, alternative_xml_filename))
+        if cached is None:
+            try:
+                ac_filename = _extract_ac_from_xml(key)
+            except ValueError:
+                ac_filename = None
+            cached = (mtime, ac_filename)
+            self._ac_filenames[key] = cached
+            self._changed = True
+        if cached[1] is None:
+            raise ValueError('No ac-file referenced in xml-file %s' % key)
+        return cached[1]
+
+    def save(self) -> None:
+        """Merges the new values into the cache file on disk.
+        The file is replaced atomically, so parallel processes at most lose some values of each other."""
+        if not (self._changed and parameters.OVERLAP_CHECK_HULL_CACHE):
+            return
+        boundaries = dict()
+        ac_filenames = dict()
+        cached = self._read_file()
+        if cached is not None:
+            boundaries.update(cached[0])
+            ac_filenames.update(cached[1])
+        boundaries.update(self._boundaries)
+        ac_filenames.update(self._ac_filenames)
+        temp_file_name = '{}.{}'.format(HULL_CACHE_FILE_NAME, os.getpid())
+        try:
+            with open(temp_file_name, 'wb') as file_pickle:
+                pickle.dump((boundaries, ac_filenames), file_pickle, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file_name, HULL_CACHE_FILE_NAME)
+            self._changed = False
+        except IOError as reason:
+            logging.warning('Saving convex hull cache failed (%s)', reason)
+
+
+_model_hull_cache = _ModelHullCache()
+
+
+def _checked_file_name(file_name: str, alternative_file_name: Optional[str]) -> str:
+    """Returns the alternative file name if the file does not exist and there is an alternative."""
+    if not os.path.isfile(file_name) and alternative_file_name is not None:
+        return alternative_file_name
+    return file_name
+
+
 def _extract_boundary(ac_filename: str, alternative_ac_filename: str = None) -> shg.Polygon:
     """Reads an ac-file and constructs a convex hull as a proxy to the real boundary.
     No attempt is made to follow rotations and translations.
     Returns a tuple (x_min, y_min, x_max, y_max) in meters.
     An alternative path is tried, if the first path is not successful"""
-    numvert = 0
-    points = list()
-    try:
-        checked_filename = ac_filename
-        if not os.path.isfile(checked_filename) and alternative_ac_filename is not None:
-            checked_filename = alternative_ac_filename
-        with open(checked_filename, 'r') as my_file:
-            for my_line in my_file:
-                if 0 == my_line.find("numvert"):
-                    numvert = int(my_line.split()[1])
-                elif numvert > 0:
-                    vertex_values = my_line.split()
-                    # minus factor in y-axis due to ac3d coordinate system. Switch of y_min and y_max for same reason
-                    points.append((float(vertex_values[0]), -1 * float(vertex_values[2])))
-                    numvert -= 1
-    except IOError as e:
-        raise e
+    nodes = ac3d.read_nodes(_checked_file_name(ac_filename, alternative_ac_filename))
+    # minus factor in y-axis due to ac3d coordinate system
+    points = np.column_stack((nodes[:, 0], -1 * nodes[:, 2])).tolist()
 
     hull_polygon = shg.MultiPoint(points).convex_hull
     return hull_polygon
@@ -515,10 +969,7 @@ def _parse_ac_file_name(xml_string: str) -> str:
 
 def _extract_ac_from_xml(xml_filename: str, alternative_xml_filename: str = None) -> str:
     """Reads the *.ac filename out of an xml-file"""
-    checked_filename = xml_filename
-    if not os.path.isfile(checked_filename) and alternative_xml_filename is not None:
-        checked_filename = alternative_xml_filename
-    with open(checked_filename, 'r') as f:
+    with open(_checked_file_name(xml_filename, alternative_xml_filename), 'r') as f:
         xml_data = f.read()
         ac_filename = _parse_ac_file_name(xml_data)
         return ac_filename
@@ -557,3 +1008,285 @@ def _make_delimiter_string(our_magic: Optional[str], prefix: Optional[str], is_s
         return delimiter + magic + '\n'
     else:
         return delimiter + magic + '_' + prefix + '\n'
+
+
+# ================ UNITTESTS =======================
+
+
+class TestModelHullCache(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = parameters.take_snapshot()
+        parameters.OVERLAP_CHECK_HULL_CACHE = False
+
+    def tearDown(self):
+        parameters.apply_snapshot(self.snapshot)
+
+    @staticmethod
+    def _write_square_ac(file_name: str, size: float, mtime: float) -> None:
+        ac_file = ac3d.File()
+        obj = ac_file.new_object('square', 'tex.png')
+        for x, z in ((0., 0.), (size, 0.), (size, size), (0., size)):
+            obj.node(x, 0., z)
+        obj.face([(0, 0., 0.), (1, 1., 0.), (2, 1., 1.), (3, 0., 1.)])
+        ac_file.write(file_name)
+        os.utime(file_name, (mtime, mtime))
+
+    def test_boundary_invalidated_by_mtime(self):
+        cache = _ModelHullCache()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ac_file_name = os.path.join(tmp_dir, 'model.ac')
+            self._write_square_ac(ac_file_name, 2., 1000.)
+            self.assertAlmostEqual(4., cache.boundary(ac_file_name).area)
+
+            self._write_square_ac(ac_file_name, 3., 1000.)  # same mtime: still the cached hull
+            self.assertAlmostEqual(4., cache.boundary(ac_file_name).area)
+            self._write_square_ac(ac_file_name, 3., 2000.)
+            self.assertAlmostEqual(9., cache.boundary(ac_file_name).area)
+            self.assertAlmostEqual(9., cache.boundary(os.path.join(tmp_dir, 'missing.ac'), ac_file_name).area)
+
+            with self.assertRaises(IOError):
+                cache.boundary(os.path.join(tmp_dir, 'missing.ac'))
+
+    def test_missing_ac_reference_cached(self):
+        cache = _ModelHullCache()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            xml_file_name = os.path.join(tmp_dir, 'model.xml')
+            with open(xml_file_name, 'w') as xml_file:
+                xml_file.write('<PropertyList></PropertyList>')
+            os.utime(xml_file_name, (1000., 1000.))
+            with self.assertRaises(ValueError):
+                cache.ac_filename_from_xml(xml_file_name)
+
+            with open(xml_file_name, 'w') as xml_file:
+                xml_file.write('<PropertyList><path>model.ac</path></PropertyList>')
+            os.utime(xml_file_name, (1000., 1000.))  # same mtime: the missing reference is still cached
+            with self.assertRaises(ValueError):
+                cache.ac_filename_from_xml(xml_file_name)
+            os.utime(xml_file_name, (2000., 2000.))
+            self.assertEqual('model.ac', cache.ac_filename_from_xml(xml_file_name))
+
+
+class TestSTGFragments(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = parameters.take_snapshot()
+        parameters.TILE_PART = 0
+        parameters.TILE_PARTS = 1
+
+    def tearDown(self):
+        parameters.apply_snapshot(self.snapshot)
+
+    def test_merge_stg_fragments(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stg_path = os.path.join(tmp_dir, '3138112.stg')
+            with open(stg_path, 'w') as stg:
+                stg.writelines(['OBJECT_SHARED other.ac 1 2 3 0\n',
+                                '# osm2city_buildings_a\n', 'OBJECT_STATIC old_a.ac 1 2 3 0\n',
+                                '# END osm2city_buildings_a\n',
+                                '# osm2city_buildings_b\n', 'OBJECT_STATIC old_b.ac 1 2 3 0\n',
+                                '# END osm2city_buildings_b\n',
+                                '# osm2city_buildings_c\n', 'OBJECT_STATIC old_c.ac 1 2 3 0\n',
+                                '# END osm2city_buildings_c\n'])
+            fragments = dict(a=['# osm2city_buildings_a\n', '#\n', 'OBJECT_STATIC new_a.ac 1 2 3 0\n',
+                                '# END osm2city_buildings_a\n'],
+                             b=list(),  # empty
+                             c=['# osm2city_buildings_c\n', '#\n', 'OBJECT_STATIC new_c.ac 1 2 3 0\n'])  # truncated
+            for key, lines in fragments.items():
+                with open('{}.osm2city_buildings_{}{}'.format(stg_path, key, STG_FRAGMENT_SUFFIX), 'w') as fragment:
+                    fragment.writelines(lines)
+
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(1, merge_stg_fragments(tmp_dir))
+            with open(stg_path, 'r') as stg:
+                lines = stg.readlines()
+            self.assertEqual(['OBJECT_SHARED other.ac 1 2 3 0\n',
+                              '# osm2city_buildings_b\n', 'OBJECT_STATIC old_b.ac 1 2 3 0\n',
+                              '# END osm2city_buildings_b\n',
+                              '# osm2city_buildings_c\n', 'OBJECT_STATIC old_c.ac 1 2 3 0\n',
+                              '# END osm2city_buildings_c\n',
+                              '# osm2city_buildings_a\n', '#\n', 'OBJECT_STATIC new_a.ac 1 2 3 0\n',
+                              '# END osm2city_buildings_a\n'], lines)
+            self.assertEqual(['3138112.stg', '3138112.stg.osm2city_buildings_b' + STG_FRAGMENT_SUFFIX,
+                              '3138112.stg.osm2city_buildings_c' + STG_FRAGMENT_SUFFIX], sorted(os.listdir(tmp_dir)))
+
+    def test_write_fragment(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stg_file = STGFile(Vec2d(13.7, 51.05), tmp_dir, SceneryType.buildings, 'osm2city_buildings', 'a')
+            stg_file.add_object('OBJECT_STATIC', 'a.ac', Vec2d(13.7, 51.05), 100., 0., None)
+            stg_file.write_fragment()
+            file_names = os.listdir(stg_file.path_to_stg)
+            self.assertEqual(1, len(file_names))  # no temporary file left
+            self.assertTrue(file_names[0].endswith(STG_FRAGMENT_SUFFIX))
+
+            self.assertEqual(1, merge_stg_fragments(tmp_dir))
+            with open(stg_file.file_name, 'r') as stg:
+                lines = stg.readlines()
+            self.assertEqual(stg_file.our_magic_start, lines[0])
+            self.assertEqual(stg_file.our_magic_end, lines[-1])
+            self.assertTrue(lines[-2].startswith('OBJECT_STATIC a.ac '))
+
+
+class TestBackgroundFileWriter(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = parameters.take_snapshot()
+        parameters.WRITE_BEHIND_THREADS = 1
+        parameters.WRITE_BEHIND_QUEUE_SIZE = 1
+
+    def tearDown(self):
+        parameters.apply_snapshot(self.snapshot)
+
+    def test_flush_raises(self):
+        def failing_write(file_name: str) -> None:
+            raise IOError('Cannot write ' + file_name)
+
+        written = list()
+        writer = _BackgroundFileWriter()
+        writer.submit(written.append, 'a')
+        writer.submit(failing_write, 'b')
+        writer.submit(written.append, 'c')
+        with self.assertRaises(IOError):
+            writer.flush()
+        self.assertEqual(['a', 'c'], written)
+        writer.flush()  # nothing left to raise
+
+    def test_queue_bound_blocks(self):
+        release = threading.Event()
+        written = list()
+
+        def blocked_write(file_name: str) -> None:
+            release.wait(10)
+            written.append(file_name)
+
+        writer = _BackgroundFileWriter()
+        writer.submit(blocked_write, 'a')  # being written
+        writer.submit(blocked_write, 'b')  # waiting in the queue
+        submitter = threading.Thread(target=writer.submit, args=(blocked_write, 'c'))
+        submitter.start()
+        submitter.join(0.2)
+        self.assertTrue(submitter.is_alive())  # blocked, because the queue is full
+        release.set()
+        submitter.join(10)
+        self.assertFalse(submitter.is_alive())
+        writer.flush()
+        self.assertEqual(['a', 'b', 'c'], written)
+
+    def test_cancel(self):
+        started = threading.Event()
+        release = threading.Event()
+        written = list()
+
+        def blocked_write(file_name: str) -> None:
+            started.set()
+            release.wait(10)
+            written.append(file_name)
+
+        writer = _BackgroundFileWriter()
+        writer.submit(blocked_write, 'a')
+        writer.submit(blocked_write, 'b')
+        self.assertTrue(started.wait(10))
+        threading.Timer(0.1, release.set).start()
+        writer.cancel()
+        self.assertEqual(['a'], written)  # only the file being written when cancelling
+        writer.flush()
+
+
+class TestWriteChunks(unittest.TestCase):
+    def _check(self, file_name: str, chunks: List[str], expected_written: bool) -> None:
+        written, sha1, size = _write_chunks_if_changed(chunks, file_name)
+        text = ''.join(chunks)
+        self.assertEqual(expected_written, written)
+        self.assertEqual(hashlib.sha1(text.encode()).hexdigest(), sha1)
+        self.assertEqual(len(text.encode()), size)
+        with open(file_name, 'r') as written_file:
+            self.assertEqual(text, written_file.read())
+
+    def test_write_chunks_if_changed(self):
+        chunks = ['first line\n', 'second line\n', 'third line äöü\n']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'test.ac')
+            self._check(file_name, chunks, True)  # new file
+            self._check(file_name, chunks, False)  # identical
+            self._check(file_name, ['first line\nsecond', ' line\n', 'third line äöü\n'], False)  # other chunks
+            self._check(file_name, ['first line\n', 'middle line\n', 'third line äöü\n'], True)  # same size
+            self._check(file_name, chunks + ['fourth line\n'], True)  # longer
+            self._check(file_name, chunks[:2], True)  # shorter
+            self._check(file_name, ['first line\n', 'other line\n'], True)  # different in the middle
+            self._check(file_name, list(), True)  # empty
+
+
+class TestStalePartSections(unittest.TestCase):
+    @staticmethod
+    def _sections(prefixes: List[str]) -> List[str]:
+        lines = list()
+        for prefix in prefixes:
+            lines.extend([_make_delimiter_string('osm2city', prefix, True),
+                          'OBJECT_STATIC {}.ac 1 2 3 0\n'.format(prefix),
+                          _make_delimiter_string('osm2city', prefix, False)])
+        return lines
+
+    def _check(self, existing: List[str], prefix: str, part: int, parts: int, expected: List[str]) -> None:
+        lines = ['OBJECT_SHARED other.ac 1 2 3 0\n'] + self._sections(existing)
+        start = _make_delimiter_string('osm2city', prefix, True)
+        self.assertEqual(['OBJECT_SHARED other.ac 1 2 3 0\n'] + self._sections(expected),
+                         _remove_stale_part_sections(lines, start, part, parts))
+
+    def test_remove_stale_part_sections(self):
+        tile = 'e013n51_3138112'
+        parts_2x2 = ['{}_{}'.format(tile, part) for part in range(1, 5)]
+        parts_3x3 = ['{}_{}'.format(tile, part) for part in range(1, 10)]
+        neighbours = ['e013n51_3138113', 'e013n51_3138113_2', 'e013n51_31381120_1']
+        # whole tile after parts: all parts are removed, the own section is left to _remove_sections
+        self._check([tile] + parts_2x2 + neighbours, tile, 0, 1, [tile] + neighbours)
+        # 2x2 to 3x3: the whole tile is removed, the other current parts are kept
+        self._check([tile] + parts_2x2 + neighbours, parts_3x3[4], 5, 9, parts_2x2 + neighbours)
+        # 3x3 to 2x2: parts beyond the current number of parts are removed
+        self._check(parts_3x3 + neighbours, parts_2x2[1], 2, 4, parts_2x2 + neighbours)
+
+
+class TestSTGFile(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = parameters.take_snapshot()
+        parameters.TILE_PART = 0
+        parameters.TILE_PARTS = 1
+        parameters.WRITE_SKIP_UNCHANGED = False
+
+    def tearDown(self):
+        parameters.apply_snapshot(self.snapshot)
+
+    def test_write(self):
+        working_dir = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)  # the lock directory is in the working directory
+            try:
+                self._check_write(os.path.join(tmp_dir, 'scenery'))
+            finally:
+                os.chdir(working_dir)
+
+    def _check_write(self, path_to_scenery: str) -> None:
+        stg_file = STGFile(Vec2d(13.7, 51.05), path_to_scenery, SceneryType.buildings, 'osm2city_buildings', 'a')
+        stg_file.add_object('OBJECT_STATIC', 'a.ac', Vec2d(13.7, 51.05), 100., 0., None)
+        with open(stg_file.file_name, 'w') as stg:
+            stg.writelines(['OBJECT_SHARED other.ac 1 2 3 0\n', stg_file.our_magic_start,
+                            'OBJECT_STATIC old.ac 1 2 3 0\n', stg_file.our_magic_end])
+        stg_file.write()
+        stg_file.write()  # our section is replaced, not added again
+        with open(stg_file.file_name, 'r') as stg:
+            lines = stg.readlines()
+        self.assertEqual(['OBJECT_SHARED other.ac 1 2 3 0\n', stg_file.our_magic_start], lines[:2])
+        self.assertEqual(1, lines.count(stg_file.our_magic_start))
+        self.assertFalse(any(line.startswith('OBJECT_STATIC old.ac') for line in lines))
+        self.assertTrue(lines[-2].startswith('OBJECT_STATIC a.ac '))
+        # no temporary file and no lock-file in the scenery
+        self.assertEqual([os.path.basename(stg_file.file_name)], os.listdir(stg_file.path_to_stg))
+        if fcntl is not None:
+            relative_stg_path = os.path.relpath(stg_file.file_name, path_to_scenery)
+            self.assertTrue(os.path.isfile(os.path.join(STG_LOCK_DIRECTORY, relative_stg_path + STG_LOCK_SUFFIX)))
+
+    def test_remove_temporary_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_names = ['3138112.stg', '3138112.stg.4711' + STG_TEMP_SUFFIX,
+                          '3138112.stg.osm2city_buildings_a{}.4711{}'.format(STG_FRAGMENT_SUFFIX, STG_TEMP_SUFFIX),
+                          'other' + STG_TEMP_SUFFIX]
+            for file_name in file_names:
+                open(os.path.join(tmp_dir, file_name), 'w').close()
+            self.assertEqual(0, merge_stg_fragments(tmp_dir))
+            self.assertEqual(['3138112.stg', 'other' + STG_TEMP_SUFFIX], sorted(os.listdir(tmp_dir)))
@@ -0,0 +1,222 @@
+"""
+Journal of processed scenery tiles, such that a batch run of build_tiles.py can be resumed resp. only the failed
+tiles can be processed again.
+
+The journal is a JSONL file: one JSON record per line, appended by all processes. A record has a "tile", a "prefix"
+(unique per part if a tile is split into "parts"), a "scope" and a "procedure": with scope "tile" the procedure
+requested on the command line for the whole tile, with scope "procedure" a single procedure run within the tile.
+Plus an "event" (start / finish), the "status" when finished, the "duration" in seconds and the files written by a
+procedure ("outputs"). The resident memory of the
+process in MB ("rss_mb") is recorded after each procedure - and the peak of these for the whole tile.
+"""
+from contextlib import contextmanager
+from enum import IntEnum, unique
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional
+import unittest
+
+from osm2city.utils import metrics, stg_io2
+import osm2city.utils.log_helper as ulog
+
+
+JOURNAL_FILE_NAME = 'osm2city-journal.jsonl'
+SCOPE_TILE = 'tile'
+SCOPE_PROCEDURE = 'procedure'
+
+
+@unique
+class TileStatus(IntEnum):
+    started = 0  # no finish record - e.g. because the process was killed
+    ok = 1
+    failed = 2
+    timed_out = 3  # the process was killed by build_tiles.py after the time limit per tile
+
+
+class TileJournal(object):
+    """Writes the records of one scenery tile processed with a given procedure (e.g. 'all')."""
+    __slots__ = ('file_name', 'tile_index', 'prefix', 'parts', 'run_procedure', 'peak_rss_mb', '_start_time')
+
+    def __init__(self, file_name: Optional[str], tile_index: int, prefix: str, run_procedure: str,
+                 parts: int = 1) -> None:
+        self.file_name = file_name  # if None, then nothing is written
+        self.tile_index = tile_index
+        self.prefix = prefix
+        self.parts = parts
+        self.run_procedure = run_procedure
+        self.peak_rss_mb = None  # the largest resident memory in MB after a procedure of the tile
+        self._start_time = time.time()
+
+    def _write(self, scope: str, procedure: str, event: str, **kwargs) -> None:
+        if self.file_name is None:
+            return
+        record = dict(tile=self.tile_index, prefix=self.prefix, parts=self.parts, scope=scope, procedure=procedure,
+                      event=event, time=round(time.time(), 3), pid=os.getpid())
+        record.update(kwargs)
+        try:
+            ulog.append_json_record(self.file_name, record)
+        except IOError:
+            logging.exception('Unable to write to the tile journal %s', self.file_name)
+
+    def start(self) -> None:
+        self._start_time = time.time()
+        self.peak_rss_mb = None
+        self._write(SCOPE_TILE, self.run_procedure, 'start')
+
+    def finish(self, status: TileStatus) -> None:
+        self._write(SCOPE_TILE, self.run_procedure, 'finish', status=status.name,
+                    duration=round(time.time() - self._start_time, 3), rss_mb=self.peak_rss_mb)
+
+    def _sample_memory(self) -> Optional[float]:
+        rss_mb = metrics.memory_usage_mb()
+        if rss_mb is None:
+            return None
+        rss_mb = round(rss_mb, 1)
+        if self.peak_rss_mb is None or rss_mb > self.peak_rss_mb:
+            self.peak_rss_mb = rss_mb
+        return rss_mb
+
+    @contextmanager
+    def procedure(self, procedure: str) -> Iterator[None]:
+        """Records the start and finish of a procedure within the tile incl. the files it has written.
+        Exceptions are recorded as failed and then re-raised."""
+        stg_io2.pop_output_files()  # only the files written within the procedure
+        start_time = time.time()
+        self._write(SCOPE_PROCEDURE, procedure, 'start')
+        status = TileStatus.failed
+        try:
+            yield
+            status = TileStatus.ok
+        finally:
+            self._write(SCOPE_PROCEDURE, procedure, 'finish', status=status.name,
+                        duration=round(time.time() - start_time, 3),
+                        outputs=sorted(set(stg_io2.pop_output_files())), rss_mb=self._sample_memory())
+
+
+def _read_records(file_name: str, run_procedure: str) -> Iterator[dict]:
+    """The records of whole tiles processed with a given procedure (e.g. 'all') in the order written - not the
+    records of the procedures run within a tile. Records without scope (older journals) are taken as tile records.
+    Lines which cannot be parsed (e.g. the last line written by a killed process) are ignored."""
+    if not os.path.isfile(file_name):
+        logging.info('No tile journal found in %s', file_name)
+        return
+    with open(file_name, 'r') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning('Ignoring invalid line in tile journal: %s', line.strip())
+                continue
+            if record.get('procedure') == run_procedure and record.get('scope', SCOPE_TILE) == SCOPE_TILE:
+                yield record
+
+
+def read_tile_states(file_name: str, run_procedure: str) -> Dict[str, TileStatus]:
+    """Reads the latest status per prefix for tiles (or parts of tiles) processed with a given procedure
+    (e.g. 'all')."""
+    states = dict()
+    for record in _read_records(file_name, run_procedure):
+        if record.get('event') == 'start':
+            states[record['prefix']] = TileStatus.started
+        elif record.get('event') == 'finish':
+            states[record['prefix']] = TileStatus[record['status']]
+    return states
+
+
+def read_tile_durations(file_name: str, run_procedure: str) -> Dict[int, float]:
+    """Reads the latest duration in seconds per tile index of tiles processed ok with a given procedure.
+    If a tile was split into parts, then the durations of the parts of the latest split are added up."""
+    durations_per_tile = dict()  # key: tile index, value: (number of parts, dict of durations per prefix)
+    for record in _read_records(file_name, run_procedure):
+        if record.get('event') == 'finish' and record.get('status') == TileStatus.ok.name:
+            parts = record.get('parts', 1)
+            if record['tile'] not in durations_per_tile or durations_per_tile[record['tile']][0] != parts:
+                durations_per_tile[record['tile']] = (parts, dict())
+            durations_per_tile[record['tile']][1][record['prefix']] = record['duration']
+    return {index: sum(durations.values()) for index, (_, durations) in durations_per_tile.items()}
+
+
+def select_prefixes(prefixes: List[str], states: Dict[str, TileStatus], retry_failed: bool) -> List[str]:
+    """The tiles (or parts of tiles) to process when resuming: either all not yet processed ok or only the ones
+    which failed (incl. the ones started but never finished or timed out)."""
+    if retry_failed:
+        return [prefix for prefix in prefixes if states.get(prefix) in (TileStatus.failed, TileStatus.started,
+                                                                          TileStatus.timed_out)]
+    return [prefix for prefix in prefixes if states.get(prefix) is not TileStatus.ok]
+
+
+# ================ UNITTESTS =======================
+
+
+class TestTileJournal(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, JOURNAL_FILE_NAME)
+            for index, status in [(1, TileStatus.ok), (2, TileStatus.failed), (4, TileStatus.failed)]:
+                journal = TileJournal(file_name, index, 'e011n47_%i' % index, 'all')
+                journal.start()
+                with journal.procedure('buildings'):
+                    pass
+                journal.finish(status)
+            TileJournal(file_name, 3, 'e011n47_3', 'all').start()  # e.g. killed
+            journal = TileJournal(file_name, 4, 'e011n47_4', 'all')
+            journal.start()
+            journal.finish(TileStatus.ok)
+            TileJournal(file_name, 2, 'e011n47_2', 'roads').finish(TileStatus.ok)
+            TileJournal(file_name, 6, 'e011n47_6', 'all').finish(TileStatus.timed_out)
+            with open(file_name, 'a') as f:
+                f.write('{"tile": 5, "proce')
+
+            states = read_tile_states(file_name, 'all')
+            self.assertEqual({'e011n47_1': TileStatus.ok, 'e011n47_2': TileStatus.failed,
+                              'e011n47_3': TileStatus.started, 'e011n47_4': TileStatus.ok,
+                              'e011n47_6': TileStatus.timed_out}, states)
+            prefixes = ['e011n47_%i' % index for index in range(1, 7)]
+            self.assertEqual(['e011n47_2', 'e011n47_3', 'e011n47_5', 'e011n47_6'],
+                             select_prefixes(prefixes, states, False))
+            self.assertEqual(['e011n47_2', 'e011n47_3', 'e011n47_6'], select_prefixes(prefixes, states, True))
+            self.assertEqual([1, 4], sorted(read_tile_durations(file_name, 'all').keys()))
+
+    def test_durations_of_parts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, JOURNAL_FILE_NAME)
+            for prefix, parts, duration in [('e011n47_1', 1, 100.), ('e011n47_1_1', 4, 30.),
+                                            ('e011n47_1_2', 4, 40.), ('e011n47_1_1', 4, 20.)]:
+                ulog.append_json_record(file_name, dict(tile=1, prefix=prefix, parts=parts, procedure='all',
+                                                        event='finish', status='ok', duration=duration))
+            self.assertEqual({1: 60.}, read_tile_durations(file_name, 'all'))
+
+    def test_procedure_failed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, JOURNAL_FILE_NAME)
+            journal = TileJournal(file_name, 1, 'e011n47_1', 'all')
+            with self.assertRaises(ValueError):
+                with journal.procedure('roads'):
+                    raise ValueError('test')
+            with open(file_name, 'r') as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(2, len(records))
+            self.assertEqual('failed', records[1]['status'])
+            self.assertEqual([], records[1]['outputs'])
+            if metrics.memory_usage_mb() is not None:
+                self.assertGreater(records[1]['rss_mb'], 0.)
+                self.assertEqual(records[1]['rss_mb'], journal.peak_rss_mb)
+
+    def test_procedure_records_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, JOURNAL_FILE_NAME)
+            journal = TileJournal(file_name, 1, 'e011n47_1', 'all')
+            journal.start()
+            with journal.procedure('buildings'):
+                pass
+            with self.assertRaises(ValueError):
+                with journal.procedure('roads'):
+                    raise ValueError('test')
+            journal.finish(TileStatus.failed)
+
+            self.assertEqual({'e011n47_1': TileStatus.failed}, read_tile_states(file_name, 'all'))
+            self.assertEqual(dict(), read_tile_states(file_name, 'buildings'))
+            self.assertEqual(dict(), read_tile_durations(file_name, 'buildings'))
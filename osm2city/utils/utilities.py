@@ -2,9 +2,11 @@
 Diverse utility methods used throughout osm2city and not having a clear other home.
 """
 
+import abc
 from collections import defaultdict
 import datetime
 import enum
+import itertools
 import logging
 import math
 import os
@@ -13,19 +15,23 @@ import pickle
 import random
 import subprocess
 import sys
+import tempfile
 import textwrap
 import time
 from typing import Any, Dict, List, Optional, Set, Tuple
 import unittest
+import warnings
 
 import numpy as np
 from shapely import affinity
 import shapely.geometry as shg
 from shapely.geometry import Polygon
 from shapely.ops import unary_union
+from shapely.strtree import STRtree
 
 import osm2city.utils.coordinates as co
 import osm2city.utils.log_helper as ulog
+from osm2city.utils import metrics
 import osm2city.utils.osmparser as op
 from osm2city import parameters
 
@@ -322,29 +328,29 @@ def troubleshoot(stats):
         logging.warning("We've detected %i problem(s):\n\n%s" % (t.n_problems, msg))
 
 
-class FGElev(object):
-    """Probes elevation and ground solidness via fgelev.
-       By default, queries are cached. Call save_cache() to
-       save the cache to disk before freeing the object.
+class ElevationProvider(abc.ABC):
+    """Probes elevation and ground solidness at positions in local coordinates or global lon/lat.
+
+    Implementations only probe global positions in _probe_global() and can probe several positions at once in
+    _probe_many_global(). Skipping the probing (parameter NO_ELEV), the cache and the metrics are handled here.
+    Only providers with expensive probing use a cache (cf. uses_cache), which is read from and saved to a file
+    per tile if parameter FG_ELEV_CACHE is True.
     """
+    uses_cache = False
+
     def __init__(self, coords_transform: Optional[co.Transformation], tile_index: int,
                  auto_save_every: int = 50000) -> None:
-        """Open pipe to fgelev.
-           Unless disabled by cache=False, initialize the cache and try to read
-           it from disk. Automatically save the cache to disk every auto_save_every misses.
-           If fake=True, never do any probing and return 0 on all queries.
+        """Unless the cache is disabled, initialize it and try to read it from disk.
+        Automatically save the cache to disk every auto_save_every misses (0 means never).
         """
         self.auto_save_every = auto_save_every
-        self.h_offset = 0
-        self.fgelev_pipe = None
-        self.record = 0
         self.coords_transform = coords_transform
 
         self._cache = None  # dictionary of tuple of float for elevation and boolean for is_solid
 
         self.pkl_fname = None
-        if parameters.FG_ELEV_CACHE and not parameters.NO_ELEV:
-            self.pkl_fname = str(tile_index) + '_elev.pkl'
+        if self.uses_cache and parameters.FG_ELEV_CACHE and not parameters.NO_ELEV:
+            self.pkl_fname = parameters.get_tile_cache_name(tile_index) + '_elev.pkl'
             try:
                 logging.info("Loading %s", self.pkl_fname)
                 fpickle = open(self.pkl_fname, 'rb')
@@ -354,34 +360,42 @@ class FGElev(object):
             except (IOError, EOFError) as reason:
                 logging.info("Loading elev cache failed (%s)", reason)
                 self._cache = {}
+        self._loaded_cache_size = 0 if self._cache is None else len(self._cache)
 
-    def _open_fgelev(self) -> None:
-        logging.info("Spawning fgelev")
-        fgelev_args = [parameters.FG_ELEV]
-        if parameters.PROBE_FOR_WATER:
-            fgelev_args.append('--print-solidness')
-        fgelev_args.append('--expire')
-        fgelev_args.append(str(1000000))
-        fgelev_args.append('--fg-scenery')
-        fgelev_args.append(parameters.PATH_TO_SCENERY)
-        self.fgelev_pipe = subprocess.Popen(fgelev_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                            bufsize=1, universal_newlines=True)
+    @abc.abstractmethod
+    def _probe_global(self, position: co.Vec2d) -> Tuple[float, bool]:
+        pass
 
-    def close(self) -> None:
-        try:
-            if self.fgelev_pipe is not None:
-                self.fgelev_pipe.kill()
+    def _probe_many_global(self, positions: List[co.Vec2d]) -> List[Tuple[float, bool]]:
+        return [self._probe_global(position) for position in positions]
+
+    def close(self, save_cache: bool = True) -> None:
+        if save_cache:
             self._save_cache()
-        except:
-            logging.warning('Unable to close FGElev process. You might have to kill it manually at the very end.')
+
+    def cache_additions(self) -> Dict[Tuple[float, float], Tuple[float, bool]]:
+        """The entries probed since the cache was loaded - e.g. to be merged into the cache of another process
+        with update_cache(...), such that only one process writes the cache file."""
+        if self._cache is None:
+            return dict()
+        return dict(itertools.islice(self._cache.items(), self._loaded_cache_size, None))
+
+    def update_cache(self, entries: Dict[Tuple[float, float], Tuple[float, bool]]) -> None:
+        if self._cache is not None:
+            self._cache.update(entries)
 
     def _save_cache(self) -> None:
-        if parameters.NO_ELEV or not parameters.FG_ELEV_CACHE:
+        if self._cache is None:
             return
         fpickle = open(self.pkl_fname, 'wb')
         pickle.dump(self._cache, fpickle, -1)
         fpickle.close()
 
+    def _to_global(self, position: Tuple[float, float], is_global: bool) -> co.Vec2d:
+        if is_global:
+            return co.Vec2d(position[0], position[1])
+        return co.Vec2d(self.coords_transform.to_global(position))
+
     def probe_elev(self, position: Tuple[float, float], is_global: bool = False) -> float:
         elev_is_solid_tuple = self.probe(position, is_global)
         return elev_is_solid_tuple[0]
@@ -391,73 +405,59 @@ class FGElev(object):
         return elev_is_solid_tuple[1]
 
     def probe(self, position: Tuple[float, float], is_global: bool = False) -> Tuple[float, bool]:
-        """Return elevation and ground solidness at (x,y). We try our cache first. Failing that, call Fgelev.
+        """Return elevation and ground solidness at (x,y). We try our cache first. Failing that, probe for real.
         Elevation is in meters as float. Solid is True, in water is False
         """
-        def really_probe(a_position: co.Vec2d) -> Tuple[float, bool]:
-            if not self.fgelev_pipe:
-                self._open_fgelev()
-            if math.isnan(a_position.lon) or math.isnan(a_position.lat):
-                logging.error("Nan encountered while probing elevation")
-                return -9999, True
-
-            try:
-                self.fgelev_pipe.stdin.write("%i %1.10f %1.10f\r\n" % (self.record, a_position.lon, a_position.lat))
-            except IOError as reason:
-                logging.error(reason)
-
-            empty_lines = 0
-            line = ""
-            try:
-                while line == "" and empty_lines < 20:
-                    empty_lines += 1
-                    line = self.fgelev_pipe.stdout.readline().strip()
-                    if line.startswith('Now checking') or line.startswith('osg::Registry::addImageProcessor') or \
-                            line.startswith('Loaded plug-in'):  # New in FG Git version end of Dec 20188
-                        line = ""
-                parts = line.split()
-                elev = float(parts[1]) + self.h_offset
-                is_solid = True
-                if parameters.PROBE_FOR_WATER:
-                    if len(parts) == 3:
-                        if parts[2] == '-':
-                            is_solid = False
-                    else:
-                        logging.debug('ERROR: Probing for water with fgelev missed to return value for water: %s', line)
-            except IndexError as reason:
-                self.close()
-                if empty_lines > 1:
-                    logging.fatal("Skipped %i lines" % empty_lines)
-                logging.fatal("%i %g %g" % (self.record, a_position.lon, a_position.lat))
-                logging.fatal("fgelev returned <%s>, resulting in %s. Did fgelev start OK (Record : %i)?",
-                              line, reason, self.record)
-                raise RuntimeError("fgelev errors are fatal.")
-            return elev, is_solid
-
         if parameters.NO_ELEV:
             return 0, True
 
-        if not is_global:
-            position = co.Vec2d(self.coords_transform.to_global(position))
-        else:
-            position = co.Vec2d(position[0], position[1])
-
-        self.record += 1
+        position = self._to_global(position, is_global)
+        metrics.count('fgelev.probes')
         if self._cache is None:
-            return really_probe(position)
+            with metrics.span('fgelev.probe'):
+                return self._probe_global(position)
 
         key = (position.lon, position.lat)
         try:
             elev_is_solid_tuple = self._cache[key]
+            metrics.count('fgelev.cache_hits')
             return elev_is_solid_tuple
         except KeyError:
-            elev_is_solid_tuple = really_probe(position)
+            with metrics.span('fgelev.probe'):
+                elev_is_solid_tuple = self._probe_global(position)
             self._cache[key] = elev_is_solid_tuple
 
             if self.auto_save_every and len(self._cache) % self.auto_save_every == 0:
                 self._save_cache()
             return elev_is_solid_tuple
 
+    def probe_many(self, positions: List[Tuple[float, float]], is_global: bool = False) -> List[Tuple[float, bool]]:
+        """Same as probe(...) for a list of positions. Positions not in the cache are probed at once, which is
+        faster for providers using a separate process."""
+        if parameters.NO_ELEV:
+            return [(0, True)] * len(positions)
+
+        global_positions = [self._to_global(position, is_global) for position in positions]
+        metrics.count('fgelev.probes', len(global_positions))
+        if self._cache is None:
+            with metrics.span('fgelev.probe'):
+                return self._probe_many_global(global_positions)
+
+        keys = [(position.lon, position.lat) for position in global_positions]
+        missing = dict()  # key: key in cache, value: position - each position only probed once
+        for key, position in zip(keys, global_positions):
+            if key not in self._cache:
+                missing[key] = position
+        metrics.count('fgelev.cache_hits', len(keys) - len(missing))
+        if missing:
+            cache_size_before = len(self._cache)
+            with metrics.span('fgelev.probe'):
+                self._cache.update(zip(missing.keys(), self._probe_many_global(list(missing.values()))))
+            if self.auto_save_every and \
+                    len(self._cache) // self.auto_save_every > cache_size_before // self.auto_save_every:
+                self._save_cache()
+        return [self._cache[key] for key in keys]
+
     def probe_list_of_points(self, points: List[Tuple[float, float]]) -> (float, float):
         """Get the elevation of the node lowest node of a list of points.
         If a node is in water or at -9999, then return -9999
@@ -466,8 +466,7 @@ class FGElev(object):
         elev_water_ok = True
         min_ground_elev = 9999
         max_ground_elev = -999
-        for point in points:
-            elev_is_solid_tuple = self.probe(point)
+        for elev_is_solid_tuple in self.probe_many(points):
             if elev_is_solid_tuple[0] == -9999:
                 logging.debug("-9999")
                 elev_water_ok = False
@@ -485,6 +484,173 @@ class FGElev(object):
         return min_ground_elev, max_ground_elev - min_ground_elev
 
 
+class FGElev(ElevationProvider):
+    """Probes elevation and ground solidness via fgelev in the scenery of PATH_TO_SCENERY.
+       By default, queries are cached. Call close() to save the cache to disk before freeing the object.
+    """
+    uses_cache = True
+    _PIPELINE_CHUNK = 200  # the number of positions written to fgelev before reading the results
+
+    def __init__(self, coords_transform: Optional[co.Transformation], tile_index: int,
+                 auto_save_every: int = 50000) -> None:
+        super().__init__(coords_transform, tile_index, auto_save_every)
+        self.h_offset = 0
+        self.fgelev_pipe = None
+        self.record = 0
+
+    def _open_fgelev(self) -> None:
+        logging.info("Spawning fgelev")
+        fgelev_args = [parameters.FG_ELEV]
+        if parameters.PROBE_FOR_WATER:
+            fgelev_args.append('--print-solidness')
+        fgelev_args.append('--expire')
+        fgelev_args.append(str(1000000))
+        fgelev_args.append('--fg-scenery')
+        fgelev_args.append(parameters.PATH_TO_SCENERY)
+        self.fgelev_pipe = subprocess.Popen(fgelev_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            bufsize=1, universal_newlines=True)
+
+    def close(self, save_cache: bool = True) -> None:
+        try:
+            if self.fgelev_pipe is not None:
+                self.fgelev_pipe.kill()
+            if save_cache:
+                self._save_cache()
+        except:
+            logging.warning('Unable to close FGElev process. You might have to kill it manually at the very end.')
+
+    def _write_position(self, a_position: co.Vec2d) -> None:
+        self.record += 1
+        try:
+            self.fgelev_pipe.stdin.write("%i %1.10f %1.10f\r\n" % (self.record, a_position.lon, a_position.lat))
+        except IOError as reason:
+            logging.error(reason)
+
+    def _read_result(self, a_position: co.Vec2d) -> Tuple[float, bool]:
+        empty_lines = 0
+        line = ""
+        try:
+            while line == "" and empty_lines < 20:
+                empty_lines += 1
+                line = self.fgelev_pipe.stdout.readline().strip()
+                if line.startswith('Now checking') or line.startswith('osg::Registry::addImageProcessor') or \
+                        line.startswith('Loaded plug-in'):  # New in FG Git version end of Dec 20188
+                    line = ""
+            parts = line.split()
+            elev = float(parts[1]) + self.h_offset
+            is_solid = True
+            if parameters.PROBE_FOR_WATER:
+                if len(parts) == 3:
+                    if parts[2] == '-':
+                        is_solid = False
+                else:
+                    logging.debug('ERROR: Probing for water with fgelev missed to return value for water: %s', line)
+        except IndexError as reason:
+            self.close()
+            if empty_lines > 1:
+                logging.fatal("Skipped %i lines" % empty_lines)
+            logging.fatal("%i %g %g" % (self.record, a_position.lon, a_position.lat))
+            logging.fatal("fgelev returned <%s>, resulting in %s. Did fgelev start OK (Record : %i)?",
+                          line, reason, self.record)
+            raise RuntimeError("fgelev errors are fatal.")
+        return elev, is_solid
+
+    def _probe_global(self, position: co.Vec2d) -> Tuple[float, bool]:
+        return self._probe_many_global([position])[0]
+
+    def _probe_many_global(self, positions: List[co.Vec2d]) -> List[Tuple[float, bool]]:
+        """Writes chunks of positions to fgelev before reading the results, such that there is not a round trip
+        per position. The chunks are small enough for the results not to fill the pipe while writing."""
+        if not self.fgelev_pipe:
+            self._open_fgelev()
+        results = list()
+        for start in range(0, len(positions), self._PIPELINE_CHUNK):
+            chunk = positions[start:start + self._PIPELINE_CHUNK]
+            valid = [not (math.isnan(a_position.lon) or math.isnan(a_position.lat)) for a_position in chunk]
+            for a_position, is_valid in zip(chunk, valid):
+                if is_valid:
+                    self._write_position(a_position)
+            for a_position, is_valid in zip(chunk, valid):
+                if is_valid:
+                    results.append(self._read_result(a_position))
+                else:
+                    logging.error("Nan encountered while probing elevation")
+                    results.append((-9999, True))
+        return results
+
+
+class AnalyticElevation(ElevationProvider):
+    """A smooth terrain of gentle hills on solid ground computed from lon/lat - deterministic and fast without any
+    scenery. E.g. for benchmarks, tests and quick previews."""
+    BASE = 500.  # metres above sea level
+    AMPLITUDE_LON = 20.
+    AMPLITUDE_LAT = 15.
+
+    def _probe_global(self, position: co.Vec2d) -> Tuple[float, bool]:
+        return (self.BASE + self.AMPLITUDE_LON * math.sin(position.lon * 300.) +
+                self.AMPLITUDE_LAT * math.cos(position.lat * 400.)), True
+
+
+class HeightmapElevation(ElevationProvider):
+    """Interpolates the elevation in a regular grid of lon/lat read from a numpy .npz file (cf. write_heightmap).
+    The file contains the array 'elevations' (rows from south to north, columns from west to east), the array
+    'bounds' (west, south, east, north of the outer grid points) and optionally the boolean array 'solid' of the
+    same shape. Positions outside of the bounds get elevation -9999."""
+    def __init__(self, coords_transform: Optional[co.Transformation], tile_index: int,
+                 auto_save_every: int = 50000, file_name: Optional[str] = None) -> None:
+        super().__init__(coords_transform, tile_index, auto_save_every)
+        if file_name is None:
+            file_name = parameters.ELEV_HEIGHTMAP_FILE
+        with np.load(file_name) as heightmap:
+            self.elevations = heightmap['elevations'].astype(float)
+            self.west, self.south, self.east, self.north = [float(value) for value in heightmap['bounds']]
+            self.solid = heightmap['solid'] if 'solid' in heightmap else None
+        self.rows, self.columns = self.elevations.shape
+
+    def _probe_global(self, position: co.Vec2d) -> Tuple[float, bool]:
+        if not (self.west <= position.lon <= self.east and self.south <= position.lat <= self.north):
+            return -9999, True
+        # bilinear interpolation between the surrounding grid points
+        column = (position.lon - self.west) / (self.east - self.west) * (self.columns - 1)
+        row = (position.lat - self.south) / (self.north - self.south) * (self.rows - 1)
+        column_0 = min(int(column), self.columns - 2)
+        row_0 = min(int(row), self.rows - 2)
+        dx = column - column_0
+        dy = row - row_0
+        cells = self.elevations[row_0:row_0 + 2, column_0:column_0 + 2]
+        elev = (cells[0, 0] * (1 - dx) * (1 - dy) + cells[0, 1] * dx * (1 - dy) +
+                cells[1, 0] * (1 - dx) * dy + cells[1, 1] * dx * dy)
+        is_solid = True
+        if self.solid is not None:
+            is_solid = bool(self.solid[int(round(row)), int(round(column))])
+        return float(elev), is_solid
+
+
+def write_heightmap(file_name: str, provider: ElevationProvider, west: float, south: float, east: float,
+                    north: float, columns: int, rows: int) -> None:
+    """Samples the elevation of a provider (e.g. FGElev) in a regular grid and saves it as a heightmap to be
+    used with HeightmapElevation."""
+    lons = np.linspace(west, east, columns)
+    lats = np.linspace(south, north, rows)
+    results = provider.probe_many([(lon, lat) for lat in lats for lon in lons], True)
+    elevations = np.array([elev for elev, _ in results]).reshape(rows, columns)
+    solid = np.array([is_solid for _, is_solid in results], dtype=bool).reshape(rows, columns)
+    np.savez_compressed(file_name, elevations=elevations, bounds=np.array([west, south, east, north]), solid=solid)
+
+
+# the values of parameter ELEV_PROVIDER and the implementing classes
+ELEVATION_PROVIDERS = {'fgelev': FGElev, 'analytic': AnalyticElevation, 'heightmap': HeightmapElevation}
+
+
+def create_elevation_provider(coords_transform: Optional[co.Transformation], tile_index: int,
+                              auto_save_every: int = 50000) -> ElevationProvider:
+    """Creates the elevation provider chosen in parameter ELEV_PROVIDER."""
+    if parameters.ELEV_PROVIDER not in ELEVATION_PROVIDERS:
+        raise ValueError('Parameter ELEV_PROVIDER must be one of {}, not {}'.format(sorted(ELEVATION_PROVIDERS),
+                                                                                   parameters.ELEV_PROVIDER))
+    return ELEVATION_PROVIDERS[parameters.ELEV_PROVIDER](coords_transform, tile_index, auto_save_every)
+
+
 def progress(i, max_i):
     """progress indicator"""
     if sys.stdout.isatty() and ulog.log_level_info_or_lower():
@@ -685,8 +851,9 @@ def fit_offsets_for_rectangle_with_hull(angle: float, hull: shg.Polygon, model_l
         new_y = hull.centroid.y + correction_y
 
     if parameters.DEBUG_PLOT_OFFSETS:
-        plot_fit_offsets(hull, box_minus, box_plus, angle, model_length_largest,
-                         new_x, new_y, model_name, osm_id)
+        import osm2city.utils.plot_utilities as pu  # only imported when plotting for faster start-up
+        pu.plot_fit_offsets(hull, box_minus, box_plus, angle, model_length_largest,
+                            new_x, new_y, model_name, osm_id)
 
     return new_x, new_y
 
@@ -801,112 +968,119 @@ def merge_buffers(original_list: List[Polygon]) -> List[Polygon]:
     return handled_list
 
 
-# ================ PLOTTING FOR VISUAL TESTING =====
-
-import osm2city.utils.plot_utilities as pu
-from descartes import PolygonPatch
-from matplotlib import patches as pat
-from matplotlib import pyplot as plt
-
-from time import sleep
-
-
-def plot_fit_offsets(hull: shg.Polygon, box_minus: shg.Polygon, box_plus: shg.Polygon,
-                     angle: float,
-                     model_length_largest: bool,
-                     centroid_x: float, centroid_y: float,
-                     model_name: str, osm_id: int) -> None:
-    pdf_pages = pu.create_pdf_pages('fit_offset_' + str(osm_id))
-
-    my_figure = pu.create_a4_landscape_figure()
-    title = 'osm_id={},\n model={},\n angle={},\n length_largest={}'.format(osm_id, model_name, angle,
-                                                                            model_length_largest)
-    my_figure.suptitle(title)
+class STRTreeIndex(object):
+    """A read-only spatial index over geometries, where a query returns the objects related to the geometries.
 
-    ax = my_figure.add_subplot(111)
-
-    patch = PolygonPatch(hull, facecolor='none', edgecolor="black")
-    ax.add_patch(patch)
-    patch = PolygonPatch(box_minus, facecolor='none', edgecolor="green")
-    ax.add_patch(patch)
-    patch = PolygonPatch(box_plus, facecolor='none', edgecolor="red")
-    ax.add_patch(patch)
-    ax.add_patch(pat.Circle((centroid_x, centroid_y), radius=0.4, linewidth=2,
-                            color='blue', fill=False))
-    bounds = bounds_from_list([box_minus.bounds, box_plus.bounds])
-    pu.set_ax_limits_bounds(ax, bounds)
-
-    pdf_pages.savefig(my_figure)
-
-    pdf_pages.close()
-
-    sleep(2)  # to make sure we have not several files in same second
-
-
-def plot_blocked_areas_roads(blocked_areas: List[shg.Polygon], ways: List[shg.LineString],
-                             transform: co.Transformation) -> None:
-    pdf_pages = pu.create_pdf_pages('blocked_areas_roads')
-
-    # Generated buildings
-    my_figure = pu.create_a3_landscape_figure()
-    my_figure.suptitle("Blocked Areas")
-    ax = my_figure.add_subplot(111)
-
-    # first blocked areas
-    pu.add_list_of_polygons(ax, blocked_areas, 'magenta', 'black')
-
-    # then the lines
-    for line in ways:
-        pu.plot_line(ax, line, 'green', 1)
-
-    pu.set_ax_limits_from_tile(ax, transform)
-    pdf_pages.savefig(my_figure)
-
-    pdf_pages.close()
-    plt.close("all")
-
-
-def plot_blocked_areas_and_stg_entries(blocked_areas: List[shg.Polygon], static_objects: List[shg.Polygon],
-                                       shared_objects: List[shg.Polygon], before: List[shg.Polygon],
-                                       after: List[shg.Polygon], transform: co.Transformation) -> None:
-    pdf_pages = pu.create_pdf_pages('blocked_apt_areas_incl_stg_objects')
+    Wraps Shapely's STRtree, such that callers do not need to care whether the installed Shapely version returns
+    geometries (Shapely < 2.0) or integer positions (Shapely >= 2.0) from a query.
+    Like STRtree the query only compares envelopes (bounds), so an exact geometric test still needs to be done
+    by the caller on the (few) candidates returned.
+    The candidates are returned in the same sequence as the items were added, such that iterating over them gives
+    the same result as iterating over all items and skipping the not-relevant ones.
+    """
+    __slots__ = ('_geometries', '_items', '_positions', '_tree')
+
+    def __init__(self, geometries: List[Any], items: List[Any]) -> None:
+        if len(geometries) != len(items):
+            raise ValueError('The number of geometries and items must be the same')
+        self._geometries = list(geometries)  # keep a reference - STRtree in Shapely < 2.0 does not
+        self._items = list(items)
+        self._positions = dict()  # key = id of geometry, value = list of positions (a geometry might be re-used)
+        for position, geometry in enumerate(self._geometries):
+            self._positions.setdefault(id(geometry), list()).append(position)
+        self._tree = None
+        if self._geometries:
+            with warnings.catch_warnings():  # Shapely 1.8 warns about the changed API in 2.0, which is handled
+                warnings.simplefilter('ignore')
+                self._tree = STRtree(self._geometries)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def query_positions(self, geometry) -> List[int]:
+        """Returns the sorted positions of those items, where the envelope intersects with the geometry's envelope."""
+        if self._tree is None or geometry is None or geometry.is_empty:
+            return list()
+        result = self._tree.query(geometry)
+        if isinstance(result, np.ndarray) and result.dtype.kind in 'iu':
+            positions = result.tolist()
+        else:
+            positions = list()
+            for geom in result:
+                positions.extend(self._positions[id(geom)])
+        positions = sorted(set(positions))
+        return positions
 
-    # Blocked areas
-    my_figure = pu.create_large_figure()
-    my_figure.suptitle('Blocked Areas for airports (magenta) as well as static (green) and shared (cyan) stg entries\
-and buildings (yellow)')
-    ax = my_figure.add_subplot(111)
+    def query(self, geometry) -> List[Any]:
+        """Returns the items, where the envelope intersects with the envelope of the geometry."""
+        return [self._items[position] for position in self.query_positions(geometry)]
 
-    # first blocked areas
-    pu.add_list_of_polygons(ax, blocked_areas, 'magenta', 'magenta')
-    # then the static stg entries
-    pu.add_list_of_polygons(ax, static_objects, 'green', 'green')
-    # then the shared stg entries
-    pu.add_list_of_polygons(ax, shared_objects, 'cyan', 'cyan')
-    # and finally the shared stg entries
-    pu.add_list_of_polygons(ax, before, 'yellow', 'yellow')
-    pu.set_ax_limits_from_tile(ax, transform)
-    pdf_pages.savefig(my_figure)
 
-    my_figure = pu.create_large_figure()
-    my_figure.suptitle('Before buildings (red) and after buildings (yellow)')
-    ax = my_figure.add_subplot(111)
-    pu.add_list_of_polygons(ax, before, 'red', 'red')
-    pu.add_list_of_polygons(ax, after, 'yellow', 'yellow')
-    pu.set_ax_limits_from_tile(ax, transform)
-    pdf_pages.savefig(my_figure)
+class BoundsGrid(object):
+    """A spatial index over bounds in a regular grid, to which items can be added incrementally - other than
+    STRTreeIndex, which must be built at once.
 
-    my_figure = pu.create_large_figure()
-    my_figure.suptitle('Only blocked areas')
-    ax = my_figure.add_subplot(111)
-    pu.add_list_of_polygons(ax, blocked_areas, 'magenta', 'magenta')
-    pu.add_list_of_polygons(ax, static_objects, 'green', 'green')
-    pu.add_list_of_polygons(ax, shared_objects, 'cyan', 'cyan')
-    pu.set_ax_limits_from_tile(ax, transform)
-    pdf_pages.savefig(my_figure)
-
-    pdf_pages.close()
-    plt.close("all")
+    Like STRTreeIndex a query only compares bounds (touching bounds intersect) and returns the items in the sequence
+    they were added.
+    """
+    __slots__ = ('cell_size', '_cells', '_added')
+
+    def __init__(self, cell_size: float) -> None:
+        self.cell_size = cell_size
+        self._cells = dict()  # key = tuple of grid indices x/y, value = list of tuples of sequence, bounds and item
+        self._added = 0
+
+    def _cell_keys(self, bounds: Tuple[float, float, float, float]) -> List[Tuple[int, int]]:
+        min_x = math.floor(bounds[0] / self.cell_size)
+        min_y = math.floor(bounds[1] / self.cell_size)
+        max_x = math.floor(bounds[2] / self.cell_size)
+        max_y = math.floor(bounds[3] / self.cell_size)
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+    def __len__(self) -> int:
+        return self._added
+
+    def add(self, bounds: Tuple[float, float, float, float], item: Any) -> None:
+        for key in self._cell_keys(bounds):
+            self._cells.setdefault(key, list()).append((self._added, bounds, item))
+        self._added += 1
+
+    def query(self, bounds: Tuple[float, float, float, float]) -> List[Any]:
+        """Returns the items, where the bounds intersect with the given bounds."""
+        min_x, min_y, max_x, max_y = bounds
+        found = dict()  # key = sequence, value = item - an item can be in several cells
+        for key in self._cell_keys(bounds):
+            for sequence, item_bounds, item in self._cells.get(key, ()):
+                if item_bounds[0] > max_x or item_bounds[2] < min_x or item_bounds[1] > max_y or \
+                        item_bounds[3] < min_y:
+                    continue
+                found[sequence] = item
+        return [found[sequence] for sequence in sorted(found)]
+
+
+def points_in_polygon(points: np.ndarray, polygon) -> np.ndarray:
+    """Returns a boolean array telling for each point (array of shape (n, 2)) whether it is within the polygon.
+
+    Uses the vectorised test of matplotlib instead of creating a Shapely point for each point. Points exactly on the
+    boundary can be inside or outside. The polygon can also be a MultiPolygon.
+    """
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return inside
+    from matplotlib.path import Path  # only imported when needed for faster start-up
+    parts = polygon.geoms if isinstance(polygon, shg.MultiPolygon) else [polygon]
+    for part in parts:
+        min_x, min_y, max_x, max_y = part.bounds
+        candidates = np.flatnonzero((points[:, 0] >= min_x) & (points[:, 0] <= max_x) &
+                                    (points[:, 1] >= min_y) & (points[:, 1] <= max_y))
+        if len(candidates) == 0:
+            continue
+        candidate_points = points[candidates]
+        within = Path(np.asarray(part.exterior.coords)[:, :2]).contains_points(candidate_points)
+        for interior in part.interiors:
+            within &= np.logical_not(Path(np.asarray(interior.coords)[:, :2]).contains_points(candidate_points))
+        inside[candidates[within]] = True
+    return inside
 
 
 # ================ UNITTESTS =======================
@@ -946,6 +1120,37 @@ class TestUtilities(unittest.TestCase):
         self.assertEqual(2, value_from_ratio_dict_parameter(0.5, ratio_parameter))
         self.assertEqual(3, value_from_ratio_dict_parameter(1., ratio_parameter))
 
+    def test_str_tree_index(self):
+        polygons = [shg.box(20, 20, 30, 30), shg.box(0, 0, 10, 10), shg.box(5, 5, 25, 25)]
+        index = STRTreeIndex(polygons, ['a', 'b', 'c'])
+        self.assertEqual(3, len(index))
+        self.assertEqual(['b', 'c'], index.query(shg.box(8, 8, 9, 9)))
+        self.assertEqual(['a', 'b', 'c'], index.query(shg.box(-1, -1, 31, 31)))
+        self.assertEqual(list(), index.query(shg.box(50, 50, 60, 60)))
+        self.assertEqual(list(), STRTreeIndex(list(), list()).query(shg.box(0, 0, 1, 1)))
+        with self.assertRaises(ValueError):
+            STRTreeIndex(polygons, ['a'])
+
+    def test_bounds_grid(self):
+        grid = BoundsGrid(10.)
+        for bounds, item in [((20, 20, 30, 30), 'a'), ((0, 0, 10, 10), 'b'), ((5, 5, 25, 25), 'c')]:
+            grid.add(bounds, item)
+        self.assertEqual(3, len(grid))
+        self.assertEqual(['b', 'c'], grid.query((8, 8, 9, 9)))
+        self.assertEqual(['a', 'b', 'c'], grid.query((-1, -1, 31, 31)))
+        self.assertEqual(['a', 'c'], grid.query((25, 25, 26, 26)))  # touching bounds intersect
+        self.assertEqual(list(), grid.query((50, 50, 60, 60)))
+
+    def test_points_in_polygon(self):
+        polygon = shg.Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], [[(4, 4), (6, 4), (6, 6), (4, 6)]])
+        points = np.array([(1, 1), (5, 5), (11, 5), (9, 9), (-1, -1)])
+        self.assertEqual([True, False, False, True, False], points_in_polygon(points, polygon).tolist())
+        multi = shg.MultiPolygon([polygon, shg.box(20, 0, 30, 10)])
+        self.assertEqual([True, False, False, True, False, True],
+                         points_in_polygon(np.array([(1, 1), (5, 5), (11, 5), (9, 9), (-1, -1), (25, 5)]),
+                                           multi).tolist())
+        self.assertEqual(0, len(points_in_polygon(np.zeros((0, 2)), polygon)))
+
     def test_simplify_balconies(self):
         # too few nodes
         refs_shared = dict()
@@ -982,3 +1187,75 @@ class TestUtilities(unittest.TestCase):
         self.assertEqual(4 + 1, len(simplified_poly.exterior.coords))
         self.assertEqual(2, len(refs_shared[11111]))
         self.assertTrue(3 in refs_shared[11111])
+
+
+_FAKE_FGELEV = """import sys
+print('Now checking for plug-in osgDB_dds.so', flush=True)
+for line in sys.stdin:
+    record, lon, lat = line.split()
+    print('{}: {:.3f} {}'.format(record, float(lon) * 10, '-' if float(lat) < 0 else '1'), flush=True)
+"""
+
+
+class TestElevationProviders(unittest.TestCase):
+    def setUp(self):
+        self.original = (parameters.ELEV_PROVIDER, parameters.ELEV_HEIGHTMAP_FILE, parameters.FG_ELEV,
+                         parameters.FG_ELEV_CACHE, parameters.PROBE_FOR_WATER, parameters.NO_ELEV)
+        self.transform = co.Transformation((8.5, 47.5))
+
+    def tearDown(self):
+        (parameters.ELEV_PROVIDER, parameters.ELEV_HEIGHTMAP_FILE, parameters.FG_ELEV, parameters.FG_ELEV_CACHE,
+         parameters.PROBE_FOR_WATER, parameters.NO_ELEV) = self.original
+
+    def test_abstract_provider(self):
+        with self.assertRaises(TypeError):
+            ElevationProvider(self.transform, 3088961)
+
+    def test_analytic_and_heightmap(self):
+        parameters.ELEV_PROVIDER = 'analytic'
+        parameters.NO_ELEV = False
+        analytic = create_elevation_provider(self.transform, 3088961)
+        self.assertIsInstance(analytic, AnalyticElevation)
+        elev, is_solid = analytic.probe((100., -50.))
+        self.assertTrue(is_solid)
+        self.assertEqual(elev, analytic.probe_elev(self.transform.to_global((100., -50.)), True))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parameters.ELEV_HEIGHTMAP_FILE = os.path.join(tmp_dir, 'heightmap.npz')
+            write_heightmap(parameters.ELEV_HEIGHTMAP_FILE, analytic, 8.49, 47.49, 8.51, 47.51, 41, 41)
+            parameters.ELEV_PROVIDER = 'heightmap'
+            heightmap = create_elevation_provider(self.transform, 3088961)
+        self.assertAlmostEqual(analytic.probe_elev((8.5, 47.5), True), heightmap.probe_elev((8.5, 47.5), True), 3)
+        self.assertAlmostEqual(elev, heightmap.probe_elev((100., -50.)), 0)
+        self.assertEqual((-9999, True), heightmap.probe((8.6, 47.5), True))
+        positions = [(0., 0.), (100., -50.), (-300., 400.)]
+        self.assertEqual([heightmap.probe(position) for position in positions], heightmap.probe_many(positions))
+        parameters.ELEV_PROVIDER = 'foo'
+        with self.assertRaises(ValueError):
+            create_elevation_provider(self.transform, 3088961)
+
+    def test_fgelev_pipelined(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            script = os.path.join(tmp_dir, 'fgelev')
+            with open(script, 'w') as script_file:
+                script_file.write('#!{}\n'.format(sys.executable) + _FAKE_FGELEV)
+            os.chmod(script, 0o755)
+            parameters.FG_ELEV = script
+            parameters.PROBE_FOR_WATER = True
+            parameters.NO_ELEV = False
+            parameters.FG_ELEV_CACHE = True
+            current_directory = os.getcwd()
+            os.chdir(tmp_dir)
+            try:
+                fg_elev = FGElev(None, 3088961, auto_save_every=0)
+                positions = [(i / 100., (i % 3) - 1.) for i in range(450)]
+                results = fg_elev.probe_many(positions + positions[:10], True)
+                self.assertEqual(460, len(results))
+                self.assertEqual((12.4, True), results[124])
+                self.assertEqual((0., False), results[450])
+                self.assertEqual(450, len(fg_elev.cache_additions()))
+                self.assertEqual((45., True), fg_elev.probe((4.5, 0.), True))
+                self.assertEqual((-9999, True), fg_elev.probe((float('nan'), 0.), True))
+                fg_elev.close()
+                self.assertTrue(os.path.isfile('3088961_elev.pkl'))
+            finally:
+                os.chdir(current_directory)